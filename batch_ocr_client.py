@@ -1,15 +1,31 @@
 """
 基于客户端的批量OCR处理脚本
 使用持久化OCR服务器进行批量识别
+多张图片并发提交（--window 控制同时在途的请求数），实时显示吞吐量和预计剩余时间
+
+增量模式（默认）：
+    输出目录下的 batch_manifest.json 记录每个输入文件的路径、大小、修改时间、内容哈希和结果目录，
+    再次运行时只提交新增或内容有变化的图片；每处理完一张立即写回清单，
+    中途崩溃后重新运行会从中断处继续。使用 --full 强制全部重新处理。
+
+热文件夹模式（--watch）：
+    持续监视输入目录，新图片完整写入后立即提交，无需定时重新运行脚本。
 """
 
 import os
 import time
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from ocr_client import PPOCRClient
+from folder_watcher import FolderWatcher
+from manifest_utils import load_manifest, save_manifest, file_sha256
+
+# 支持的图片格式（PDF 和多帧 TIFF 由服务端按页拆分并行识别）
+SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.webp', '.gif', '.pdf'}
 
-# 支持的图片格式
-SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.webp', '.gif'}
+# 增量处理清单（保存在输出目录下）
+MANIFEST_NAME = 'batch_manifest.json'
+MANIFEST_VERSION = 1
 
 
 def get_image_files(folder_path):
@@ -28,25 +44,63 @@ def get_image_files(folder_path):
     return sorted(image_files)
 
 
-def batch_ocr_client(input_folder="OCR_Flies", output_folder="output/batch_results",
-                    host='localhost', port=8888):
+def result_dir_for(image_path, output_folder):
+    """图片对应的结果目录（与服务端的保存规则一致）"""
+    return os.path.join(output_folder, Path(image_path).stem)
+
+
+def is_up_to_date(entry, image_path, output_folder):
     """
-    使用客户端进行批量OCR处理
+    判断图片是否已处理过且结果仍然有效
 
-    参数:
-        input_folder: 输入图片文件夹路径
-        output_folder: 输出结果文件夹路径
-        host: 服务器地址
-        port: 服务器端口
+    大小和修改时间都没变时直接认为未变化；否则计算内容哈希比较
+    （例如文件被重新复制但内容相同），哈希一致时顺便更新清单中的大小和时间
     """
-    print("=" * 80)
-    print("批量 OCR 处理开始 (客户端模式)")
-    print("=" * 80)
+    if not entry or entry.get('status') != 'done':
+        return False
+    if not os.path.exists(os.path.join(entry['output'], 'result.json')):
+        return False
+
+    stat = os.stat(image_path)
+    if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return True
+    if entry['size'] != stat.st_size or entry['sha256'] != file_sha256(image_path):
+        return False
+
+    entry['mtime_ns'] = stat.st_mtime_ns
+    return True
+
+
+def record_result(manifest, image_path, output_folder, success, error=None):
+    """记录一张图片的处理结果"""
+    stat = os.stat(image_path)
+    manifest['files'][os.path.abspath(image_path)] = {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_sha256(image_path),
+        'output': os.path.abspath(result_dir_for(image_path, output_folder)),
+        'status': 'done' if success else 'failed',
+        'error': error,
+        'processed_at': time.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
 
-    # 创建客户端
-    client = PPOCRClient(host, port)
+def format_duration(seconds):
+    """把秒数格式化为 1h02m03s / 2m03s / 3s"""
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m{seconds:02d}s"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+def connect_to_server(host, port, window):
+    """创建客户端并检查服务器状态，服务器不可用或模型未加载时返回 None"""
+    client = PPOCRClient(host, port, pool_size=window)
 
-    # 检查服务器状态
     print("\n📡 正在连接OCR服务器...")
     status = client.get_server_status()
 
@@ -54,7 +108,7 @@ def batch_ocr_client(input_folder="OCR_Flies", output_folder="output/batch_resul
         print("❌ 无法连接到OCR服务器")
         print("请确保服务器已启动:")
         print("  python ocr_server.py")
-        return
+        return None
 
     print("✅ OCR服务器连接成功")
     print(f"   地址: {status['host']}:{status['port']}")
@@ -63,6 +117,32 @@ def batch_ocr_client(input_folder="OCR_Flies", output_folder="output/batch_resul
     if not status['model_loaded']:
         print("\n⚠ 警告: 服务器模型未加载完成")
         print("   请等待模型初始化完成后再试")
+        client.close()
+        return None
+
+    return client
+
+
+def batch_ocr_client(input_folder="OCR_Flies", output_folder="output/batch_results",
+                    host='localhost', port=8888, incremental=True, window=4, upload=False):
+    """
+    使用客户端进行批量OCR处理
+
+    参数:
+        input_folder: 输入图片文件夹路径
+        output_folder: 输出结果文件夹路径
+        host: 服务器地址
+        port: 服务器端口
+        incremental: 是否跳过清单中已处理且未变化的图片
+        window: 同时在途的请求数
+        upload: 上传图片内容并取回结果（服务器在另一台机器上时使用）
+    """
+    print("=" * 80)
+    print("批量 OCR 处理开始 (客户端模式)")
+    print("=" * 80)
+
+    client = connect_to_server(host, port, window)
+    if client is None:
         return
 
     # 获取所有图片文件
@@ -80,41 +160,94 @@ def batch_ocr_client(input_folder="OCR_Flies", output_folder="output/batch_resul
     # 创建输出文件夹
     os.makedirs(output_folder, exist_ok=True)
 
-    # 批量处理
+    # 增量模式：跳过已处理且未变化的图片
+    manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path, MANIFEST_VERSION)
+    skipped_count = 0
+    if incremental:
+        pending = [img_path for img_path in image_files
+                   if not is_up_to_date(manifest['files'].get(os.path.abspath(img_path)),
+                                        img_path, output_folder)]
+        skipped_count = len(image_files) - len(pending)
+        if skipped_count:
+            print(f"\n⏭ 跳过 {skipped_count} 个已处理且未变化的文件（使用 --full 强制重新处理）")
+            save_manifest(manifest, manifest_path)
+        image_files = pending
+
+    if not image_files:
+        client.close()
+        print("\n✅ 所有文件均已处理，无需重新识别")
+        return
+
+    # 批量处理：同时保持 window 个请求在途，服务端编码输出时客户端已经提交了下一张
     success_count = 0
     failed_files = []
+    timing = {'queue_wait': 0.0, 'processing': 0.0, 'transfer': 0.0}
+    total = len(image_files)
     total_start_time = time.time()
 
-    print(f"\n开始批量处理...")
+    print(f"\n开始批量处理（并发窗口: {window}）...")
     print("-" * 80)
 
-    for i, image_path in enumerate(image_files, 1):
-        try:
-            print(f"\n[{i}/{len(image_files)}] 处理中: {os.path.basename(image_path)}")
-            success = client.ocr_image(image_path, output_dir=output_folder, print_result=False)
+    with ThreadPoolExecutor(max_workers=window) as executor:
+        futures = {executor.submit(client.submit_ocr, image_path, output_folder, upload=upload): image_path
+                   for image_path in image_files}
 
-            if success:
-                success_count += 1
-                print(f"  ✓ 完成")
-            else:
-                failed_files.append((image_path, "处理失败"))
-                print(f"  ✗ 失败")
+        # 结果在主线程中按完成顺序处理，清单只由主线程写入
+        for done, future in enumerate(as_completed(futures), 1):
+            image_path = futures[future]
+            name = os.path.basename(image_path)
+            try:
+                response = future.result()
+                if response and response.get('success'):
+                    success_count += 1
+                    queue_wait = response.get('queue_wait', 0.0)
+                    processing = response.get('processing_time', 0.0)
+                    timing['queue_wait'] += queue_wait + response['busy_wait']
+                    timing['processing'] += processing
+                    timing['transfer'] += max(response['round_trip'] - queue_wait - processing, 0.0)
+                    status = f"✓ {name}  ({response['round_trip']:.1f}s{', 缓存' if response.get('cached') else ''})"
+                    record_result(manifest, image_path, output_folder, True)
+                else:
+                    error = response.get('error', '处理失败') if response else '无法连接到OCR服务器'
+                    failed_files.append((image_path, error))
+                    status = f"✗ {name}: {error}"
+                    record_result(manifest, image_path, output_folder, False, error)
+            except Exception as e:
+                failed_files.append((image_path, str(e)))
+                status = f"✗ {name}: {e}"
+                record_result(manifest, image_path, output_folder, False, str(e))
 
-        except Exception as e:
-            print(f"  ✗ 失败: {str(e)}")
-            failed_files.append((image_path, str(e)))
+            # 每张图片处理完立即写回清单，中断后可从此处继续
+            save_manifest(manifest, manifest_path)
+
+            # 吞吐量和剩余时间按已观测到的完成速度估算
+            elapsed = time.time() - total_start_time
+            throughput = done / elapsed if elapsed > 0 else 0.0
+            eta = (total - done) / throughput if throughput > 0 else 0.0
+            print(f"[{done}/{total}] {status} | {throughput * 60:.1f} 张/分钟 | "
+                  f"已用 {format_duration(elapsed)} | 预计剩余 {format_duration(eta)}")
 
     total_end_time = time.time()
+    client.close()
 
     # 输出统计信息
     print("\n" + "=" * 80)
     print("批量处理完成")
     print("=" * 80)
-    print(f"\n总文件数: {len(image_files)}")
+    print(f"\n总文件数: {total + skipped_count}")
+    if skipped_count:
+        print(f"跳过(未变化): {skipped_count}")
     print(f"成功: {success_count}")
     print(f"失败: {len(failed_files)}")
     print(f"总耗时: {total_end_time - total_start_time:.2f} 秒")
-    print(f"平均每张: {(total_end_time - total_start_time) / len(image_files):.2f} 秒")
+    print(f"平均每张: {(total_end_time - total_start_time) / total:.2f} 秒")
+
+    if success_count:
+        # 各阶段时间为所有成功图片的累计值，并发时累计值可以超过总耗时
+        print(f"\n时间分布（成功的 {success_count} 张，累计 / 平均每张）:")
+        for label, key in (('排队等待', 'queue_wait'), ('服务器处理', 'processing'), ('传输及其他', 'transfer')):
+            print(f"  {label}: {timing[key]:.2f} 秒 / {timing[key] / success_count:.2f} 秒")
 
     if failed_files:
         print("\n失败的文件:")
@@ -124,12 +257,123 @@ def batch_ocr_client(input_folder="OCR_Flies", output_folder="output/batch_resul
     print(f"\n结果保存在: {os.path.abspath(output_folder)}")
 
 
+def watch_folder(input_folder="OCR_Flies", output_folder="output/batch_results",
+                 host='localhost', port=8888, window=4, poll_interval=1.0, upload=False):
+    """
+    热文件夹模式：持续监视输入目录，新图片写入完成后立即提交识别，按 Ctrl+C 停止
+
+    参数:
+        input_folder: 监视的输入图片文件夹
+        output_folder: 输出结果文件夹路径
+        host: 服务器地址
+        port: 服务器端口
+        window: 同时在途的请求数
+        poll_interval: 轮询模式下的扫描间隔（秒）
+        upload: 上传图片内容并取回结果（服务器在另一台机器上时使用）
+    """
+    print("=" * 80)
+    print("OCR 热文件夹模式 (客户端模式)")
+    print("=" * 80)
+
+    client = connect_to_server(host, port, window)
+    if client is None:
+        return
+
+    os.makedirs(input_folder, exist_ok=True)
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path, MANIFEST_VERSION)
+
+    watcher = FolderWatcher(input_folder, SUPPORTED_FORMATS, poll_interval=poll_interval)
+    print(f"\n👀 正在监视: {os.path.abspath(input_folder)}（{watcher.backend}）")
+    print(f"   结果保存在: {os.path.abspath(output_folder)}")
+    print(f"   按 Ctrl+C 停止\n")
+
+    in_flight = {}  # future -> (图片路径, 发现时间)
+    counts = {'success': 0, 'failed': 0}
+
+    def finish(future):
+        """记录一个已完成的请求（只在主线程调用，清单只由主线程写入）"""
+        image_path, detected_at = in_flight.pop(future)
+        name = os.path.basename(image_path)
+        try:
+            response = future.result()
+            error = None if response and response.get('success') else (
+                response.get('error', '处理失败') if response else '无法连接到OCR服务器')
+        except Exception as e:
+            error = str(e)
+
+        try:
+            record_result(manifest, image_path, output_folder, error is None, error)
+            save_manifest(manifest, manifest_path)
+        except OSError:
+            pass  # 处理期间输入文件被删除
+
+        if error is None:
+            counts['success'] += 1
+            print(f"  ✓ {name}  (从发现到完成 {time.time() - detected_at:.1f}s)")
+        else:
+            counts['failed'] += 1
+            print(f"  ✗ {name}: {error}")
+
+    with ThreadPoolExecutor(max_workers=window) as executor:
+        try:
+            while True:
+                # 有请求在途时短暂等待，以便及时处理完成的结果
+                for image_path in watcher.poll(timeout=0.2 if in_flight else None):
+                    if any(path == image_path for path, _ in in_flight.values()):
+                        continue
+                    try:
+                        entry = manifest['files'].get(os.path.abspath(image_path))
+                        if is_up_to_date(entry, image_path, output_folder):
+                            continue
+                    except OSError:
+                        continue  # 文件在检查前又被删除
+                    print(f"📥 新文件: {os.path.basename(image_path)}")
+                    future = executor.submit(client.submit_ocr, image_path, output_folder, upload=upload)
+                    in_flight[future] = (image_path, time.time())
+
+                for future in [f for f in in_flight if f.done()]:
+                    finish(future)
+
+        except KeyboardInterrupt:
+            print(f"\n🛑 停止监视，等待 {len(in_flight)} 个在途请求完成...")
+            for future in as_completed(list(in_flight)):
+                finish(future)
+        finally:
+            watcher.close()
+
+    client.close()
+    print(f"成功: {counts['success']}  失败: {counts['failed']}")
+
+
 if __name__ == "__main__":
+    import argparse
+
     # 配置参数
     INPUT_FOLDER = "OCR_Flies"  # 输入文件夹，可以修改为其他路径
     OUTPUT_FOLDER = "output/batch_results"  # 输出文件夹
     HOST = "localhost"  # 服务器地址
     PORT = 8888  # 服务器端口
 
-    # 执行批量处理
-    batch_ocr_client(INPUT_FOLDER, OUTPUT_FOLDER, HOST, PORT)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='批量 OCR 处理')
+    parser.add_argument('--input', default=INPUT_FOLDER, help='输入图片文件夹')
+    parser.add_argument('--output', default=OUTPUT_FOLDER, help='输出结果文件夹')
+    parser.add_argument('--host', default=HOST, help='服务器地址')
+    parser.add_argument('--port', type=int, default=PORT, help='服务器端口')
+    parser.add_argument('--full', action='store_true', help='忽略处理清单，全部重新处理')
+    parser.add_argument('--window', type=int, default=4, help='同时在途的请求数')
+    parser.add_argument('--watch', action='store_true', help='持续监视输入文件夹，新图片到达后立即识别')
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help='监视模式下不支持 inotify 时的轮询间隔（秒）')
+    parser.add_argument('--upload', action='store_true',
+                        help='上传图片内容并取回结果（客户端与服务器不共享磁盘时使用）')
+    args = parser.parse_args()
+
+    if args.watch:
+        watch_folder(args.input, args.output, args.host, args.port,
+                     window=max(args.window, 1), poll_interval=args.poll_interval, upload=args.upload)
+    else:
+        # 执行批量处理
+        batch_ocr_client(args.input, args.output, args.host, args.port,
+                         incremental=not args.full, window=max(args.window, 1), upload=args.upload)
\ No newline at end of file
@@ -5,21 +5,61 @@
 使用方法：
 1. 运行此脚本一次：python convert_models_once.py
 2. 之后使用 PaddleOCRVL_main.py 时会自动使用转换好的模型
+
+可选参数：
+    --jobs N     使用 N 个进程并行转换多个文件
+    --rescan     忽略缓存的目录扫描和 header 检查结果
+    --verify     重新计算已完成文件的 SHA-256 并与进度清单核对
+
+进度清单保存在 ~/.paddlex/convert_manifest.json，记录每个文件转换前后的内容哈希和状态，
+中断后重新运行只会处理未完成或失败的文件；是否需要转换只看清单状态和文件本身，
+.bak 备份只用于恢复中断或核对失败的文件
 """
 
 import os
-import sys
 import json
+import mmap
+import time
 import struct
+import hashlib
 import numpy as np
-import paddle
 from pathlib import Path
-from safetensors import safe_open as original_safe_open
-from safetensors.numpy import save_file
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from bf16_converter import bfloat16_to_float32
+from manifest_utils import load_manifest, save_manifest, file_sha256
+
+
+# 进度清单：每个文件的内容哈希、状态，以及目录扫描和 header 检查的缓存
+MANIFEST_PATH = Path.home() / ".paddlex" / "convert_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def file_signature(file):
+    """文件的 (大小, 修改时间)，用于判断缓存的检查结果是否仍然有效"""
+    stat = os.stat(file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _scan_directory(cache_dir):
+    """遍历目录，返回 (各子目录的修改时间, safetensors 文件列表)"""
+    dir_mtimes = {}
+    files = []
+    for root, _, filenames in os.walk(cache_dir):
+        dir_mtimes[root] = os.stat(root).st_mtime_ns
+        files.extend(os.path.join(root, name) for name in filenames if name.endswith('.safetensors'))
+    return dir_mtimes, sorted(files)
+
+
+def _scan_still_valid(dir_mtimes):
+    """所有子目录的修改时间都没变，说明没有增删文件，扫描结果仍然有效"""
+    try:
+        return all(os.stat(d).st_mtime_ns == mtime for d, mtime in dir_mtimes.items())
+    except OSError:
+        return False
 
 
-def find_safetensors_files():
-    """查找 PaddleOCR 模型目录中的所有 safetensors 文件"""
+def find_safetensors_files(manifest=None):
+    """查找 PaddleOCR 模型目录中的所有 safetensors 文件（传入 manifest 时复用缓存的扫描结果）"""
     # 获取用户主目录下的 PaddleOCR 缓存目录
     home = Path.home()
     paddle_cache_dirs = [
@@ -30,8 +70,15 @@ def find_safetensors_files():
     for cache_dir in paddle_cache_dirs:
         if cache_dir.exists():
             print(f"  搜索目录: {cache_dir}")
-            for file in cache_dir.rglob("*.safetensors"):
-                safetensors_files.append(file)
+            cached = manifest['scan'].get(str(cache_dir)) if manifest is not None else None
+            if cached and _scan_still_valid(cached['dirs']):
+                print(f"  (目录未变化，使用缓存的扫描结果)")
+                files = cached['files']
+            else:
+                dir_mtimes, files = _scan_directory(cache_dir)
+                if manifest is not None:
+                    manifest['scan'][str(cache_dir)] = {'dirs': dir_mtimes, 'files': files}
+            safetensors_files.extend(Path(file) for file in files)
     
     return safetensors_files
 
@@ -52,69 +99,122 @@ def check_if_bfloat16(filename):
     return False
 
 
-def bfloat16_to_float32(data_bytes):
-    """手动将 bfloat16 字节数据转换为 float32 numpy 数组"""
-    bfloat16_data = np.frombuffer(data_bytes, dtype=np.uint16)
-    float32_data = np.zeros(len(bfloat16_data), dtype=np.float32)
-    float32_data.view(np.uint32)[:] = bfloat16_data.astype(np.uint32) << 16
-    return float32_data
+def check_if_bfloat16_cached(file, manifest):
+    """带缓存的 check_if_bfloat16：文件大小和修改时间不变时直接使用上次的结果"""
+    signature = file_signature(file)
+    entry = manifest['files'].setdefault(str(file), {})
+    if entry.get('signature') != signature or 'bfloat16' not in entry:
+        entry['signature'] = signature
+        entry['bfloat16'] = check_if_bfloat16(file)
+    return entry['bfloat16']
 
 
-def convert_safetensors_to_float32(input_file, output_file):
-    """转换 safetensors 文件从 bfloat16 到 float32"""
+def build_float32_header(header):
+    """
+    根据输入 header 预先计算输出 header：bfloat16 张量改为 F32，其余张量原样保留
+    
+    返回:
+        (header_bytes, plan): header_bytes 已按 8 字节对齐；
+        plan 为 [(key, info, 输出字节数)] 列表，按写出顺序排列
+    """
+    output_header = {}
+    if '__metadata__' in header:
+        output_header['__metadata__'] = header['__metadata__']
+    
+    plan = []
+    offset = 0
+    for key, info in header.items():
+        if key == '__metadata__':
+            continue
+        begin, end = info['data_offsets']
+        if info['dtype'] == 'BF16':
+            dtype_str = 'F32'
+            nbytes = (end - begin) * 2
+        else:
+            dtype_str = info['dtype']
+            nbytes = end - begin
+        output_header[key] = {
+            'dtype': dtype_str,
+            'shape': info['shape'],
+            'data_offsets': [offset, offset + nbytes],
+        }
+        plan.append((key, info, nbytes))
+        offset += nbytes
+    
+    header_bytes = json.dumps(output_header, separators=(',', ':')).encode('utf-8')
+    # safetensors 要求数据区按 8 字节对齐，用空格填充 header
+    header_bytes += b' ' * (-len(header_bytes) % 8)
+    return header_bytes, plan
+
+
+def convert_safetensors_to_float32(input_file, output_file, digest=None, num_threads=None):
+    """
+    转换 safetensors 文件从 bfloat16 到 float32
+    
+    流式写出：先写好完整的输出 header，再逐个张量转换并直接写入输出文件，
+    内存峰值约等于最大的单个张量。传入 digest（hashlib 对象）时同时计算输出文件的哈希，
+    num_threads 为单个张量的转换线程数（默认全部核心）
+    """
     print(f"\n处理文件: {input_file.name}")
     print(f"  路径: {input_file}")
     
-    tensors_dict = {}
-    
-    with open(input_file, 'rb') as f:
+    with open(input_file, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
         # 读取 header
-        header_size = struct.unpack('<Q', f.read(8))[0]
-        header_bytes = f.read(header_size)
-        header = json.loads(header_bytes.decode('utf-8'))
+        header_size = struct.unpack_from('<Q', mm, 0)[0]
+        header = json.loads(mm[8:8 + header_size].decode('utf-8'))
         data_start = 8 + header_size
         
-        tensor_info = {k: v for k, v in header.items() if k != '__metadata__'}
+        header_bytes, plan = build_float32_header(header)
         
-        tensor_count = 0
-        bfloat16_count = 0
+        tensor_count = len(plan)
+        bfloat16_count = sum(1 for _, info, _ in plan if info['dtype'] == 'BF16')
         
-        for key, info in tensor_info.items():
-            dtype_str = info['dtype']
-            shape = info['shape']
-            data_offsets = info['data_offsets']
-            
-            tensor_count += 1
-            
-            # 读取张量数据
-            f.seek(data_start + data_offsets[0])
-            tensor_bytes = f.read(data_offsets[1] - data_offsets[0])
-            
-            # 根据 dtype 解析数据
-            if dtype_str == 'BF16':
-                bfloat16_count += 1
-                tensor_data = bfloat16_to_float32(tensor_bytes)
-                tensor_data = tensor_data.reshape(shape)
-            else:
-                dtype_map = {
-                    'F32': np.float32,
-                    'F64': np.float64,
-                    'I32': np.int32,
-                    'I64': np.int64,
-                    'U8': np.uint8,
-                    'F16': np.float16,
-                }
-                np_dtype = dtype_map.get(dtype_str, np.float32)
-                tensor_data = np.frombuffer(tensor_bytes, dtype=np_dtype).reshape(shape)
-            
-            tensors_dict[key] = tensor_data
+        # 转换缓冲区按最大的 bfloat16 张量分配一次，所有张量复用
+        max_elements = max((nbytes // 4 for _, info, nbytes in plan if info['dtype'] == 'BF16'),
+                           default=0)
+        buffer = np.empty(max_elements, dtype=np.float32)
+        source = memoryview(mm)
+        
+        try:
+            with open(output_file, 'wb') as out_file:
+                if digest is None:
+                    write = out_file.write
+                else:
+                    def write(data):
+                        digest.update(data)
+                        out_file.write(data)
+                
+                write(struct.pack('<Q', len(header_bytes)))
+                write(header_bytes)
+                
+                for key, info, nbytes in plan:
+                    begin, end = info['data_offsets']
+                    if data_start + end > len(mm):
+                        raise ValueError(f"文件数据不完整，张量 {key} 超出文件末尾")
+                    tensor_bytes = source[data_start + begin:data_start + end]
+                    
+                    if info['dtype'] == 'BF16':
+                        float32_data = buffer[:nbytes // 4]
+                        bfloat16_to_float32(tensor_bytes, out=float32_data, num_threads=num_threads)
+                        write(float32_data)
+                    else:
+                        # 其他类型直接从映射区域写出
+                        write(tensor_bytes)
+                    tensor_bytes.release()
+                    
+                    # 已写出的输入页不再需要，通知内核回收（Windows 不支持 madvise）
+                    if hasattr(mmap, 'MADV_DONTNEED'):
+                        page_start = (data_start + begin) // mmap.PAGESIZE * mmap.PAGESIZE
+                        if data_start + end > page_start:
+                            mm.madvise(mmap.MADV_DONTNEED, page_start, data_start + end - page_start)
+        finally:
+            source.release()
         
         print(f"  ✓ 读取了 {tensor_count} 个张量")
         if bfloat16_count > 0:
             print(f"  ✓ 转换了 {bfloat16_count} 个 bfloat16 张量到 float32")
     
-    # 保存为新的 safetensors 文件
-    save_file(tensors_dict, output_file)
     print(f"  ✓ 已保存到: {output_file}")
     
     # 验证文件大小
@@ -126,15 +226,141 @@ def convert_safetensors_to_float32(input_file, output_file):
     return bfloat16_count > 0
 
 
+def convert_file(file, num_threads=None):
+    """
+    转换单个文件：先写入 .tmp，再备份原文件为 .bak 并替换（可在子进程中运行）
+    
+    参数:
+        num_threads: bfloat16 转换线程数，多个进程并行时由调用方按进程数分配核心
+    
+    返回:
+        dict: file / status('done' | 'float32' | 'failed') / sha256（转换结果）/
+              source_sha256（原文件）/ error
+    """
+    file = Path(file)
+    backup_file = file.with_suffix('.safetensors.bak')
+    temp_file = file.with_suffix('.safetensors.tmp')
+    digest = hashlib.sha256()
+    
+    try:
+        source_sha256 = file_sha256(file)
+        if convert_safetensors_to_float32(file, temp_file, digest, num_threads):
+            # 备份原文件（覆盖之前中断或失败的转换留下的旧备份）
+            file.replace(backup_file)
+            print(f"  ✓ 原文件已备份为: {backup_file.name}")
+            
+            # 将转换后的文件重命名为原文件名
+            temp_file.replace(file)
+            print(f"  ✓ 转换完成！")
+            return {'file': str(file), 'status': 'done', 'sha256': digest.hexdigest(),
+                    'source_sha256': source_sha256}
+        else:
+            # 如果没有 bfloat16，删除临时文件
+            temp_file.unlink()
+            print(f"  ⚠ 此文件不包含 bfloat16，跳过")
+            return {'file': str(file), 'status': 'float32'}
+    
+    except Exception as e:
+        print(f"  ❌ 转换失败: {e}")
+        if temp_file.exists():
+            temp_file.unlink()
+        return {'file': str(file), 'status': 'failed', 'error': str(e)}
+
+
+def record_result(manifest, result):
+    """把转换结果写入进度清单"""
+    entry = manifest['files'].setdefault(result['file'], {})
+    entry['status'] = result['status']
+    entry['updated_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    if result['status'] == 'failed':
+        entry['error'] = result['error']
+        return
+    entry.pop('error', None)
+    if os.path.exists(result['file']):
+        entry['signature'] = file_signature(result['file'])
+        entry['bfloat16'] = False
+    for key in ('sha256', 'source_sha256'):
+        if key in result:
+            entry[key] = result[key]
+
+
+def recover_interrupted(manifest):
+    """
+    上次运行在备份原文件之后、换上转换结果之前中断时，原文件只剩 .bak：用它恢复原文件
+
+    返回:
+        int: 恢复的文件数
+    """
+    recovered = 0
+    for path, entry in manifest['files'].items():
+        if entry.get('status') != 'running':
+            continue
+        file = Path(path)
+        backup_file = file.with_suffix('.safetensors.bak')
+        if not file.exists() and backup_file.exists():
+            os.replace(backup_file, file)
+            entry.pop('signature', None)
+            entry.pop('bfloat16', None)
+            print(f"  ↩ 已从 {backup_file.name} 恢复中断时的原文件")
+            recovered += 1
+    return recovered
+
+
+def verify_manifest(manifest, files):
+    """
+    重新计算已完成文件的 SHA-256，与清单记录不一致的标记为失败
+
+    .bak 备份与清单记录的原文件哈希一致时用它恢复原文件，并清除缓存的 header 检查结果，
+    本次运行会重新转换该文件
+    """
+    mismatched = 0
+    for file in files:
+        entry = manifest['files'].get(str(file), {})
+        if entry.get('status') != 'done' or 'sha256' not in entry:
+            continue
+        if file_sha256(file) != entry['sha256']:
+            print(f"  ❌ 哈希不一致: {file.name}")
+            entry['status'] = 'failed'
+            entry['error'] = 'SHA-256 与清单记录不一致'
+            entry.pop('sha256', None)
+            entry.pop('signature', None)
+            entry.pop('bfloat16', None)
+            backup_file = file.with_suffix('.safetensors.bak')
+            source_sha256 = entry.get('source_sha256')
+            if backup_file.exists() and (source_sha256 is None or file_sha256(backup_file) == source_sha256):
+                os.replace(backup_file, file)
+                print(f"     已从 {backup_file.name} 恢复原文件，将重新转换")
+            else:
+                print(f"     没有可用的 .bak 备份，无法自动恢复，请重新下载该模型")
+            mismatched += 1
+    return mismatched
+
+
 def main():
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='PaddleOCR 模型转换工具 - bfloat16 → float32')
+    parser.add_argument('--jobs', type=int, default=1, help='并行转换的进程数')
+    parser.add_argument('--rescan', action='store_true', help='忽略缓存的扫描和检查结果')
+    parser.add_argument('--verify', action='store_true', help='核对已完成文件的 SHA-256')
+    args = parser.parse_args()
+    
     print("="*80)
     print("PaddleOCR 模型转换工具 - bfloat16 → float32")
     print("="*80)
     print()
     
+    manifest = load_manifest(MANIFEST_PATH, MANIFEST_VERSION, ('scan', 'files'))
+    if recover_interrupted(manifest):
+        save_manifest(manifest, MANIFEST_PATH)
+    if args.rescan:
+        manifest['scan'] = {}
+        for entry in manifest['files'].values():
+            entry.pop('bfloat16', None)
+    
     # 查找所有 safetensors 文件
     print("正在搜索 PaddleOCR 模型文件...")
-    safetensors_files = find_safetensors_files()
+    safetensors_files = find_safetensors_files(manifest)
     
     if not safetensors_files:
         print("❌ 未找到任何 safetensors 文件")
@@ -143,11 +369,16 @@ def main():
     
     print(f"✓ 找到 {len(safetensors_files)} 个 safetensors 文件\n")
     
+    if args.verify:
+        mismatched = verify_manifest(manifest, safetensors_files)
+        print(f"✓ 哈希核对完成，{mismatched} 个文件不一致\n")
+    
     # 筛选包含 bfloat16 的文件
     bf16_files = []
     for file in safetensors_files:
-        if check_if_bfloat16(file):
+        if check_if_bfloat16_cached(file, manifest):
             bf16_files.append(file)
+    save_manifest(manifest, MANIFEST_PATH)
     
     if not bf16_files:
         print("✓ 所有模型已经是 float32 格式，无需转换！")
@@ -155,54 +386,61 @@ def main():
     
     print(f"需要转换 {len(bf16_files)} 个包含 bfloat16 的文件：")
     for i, file in enumerate(bf16_files, 1):
-        print(f"  {i}. {file.name}")
+        status = manifest['files'].get(str(file), {}).get('status')
+        note = f" (上次{'失败' if status == 'failed' else '未完成'})" if status in ('failed', 'running') else ""
+        print(f"  {i}. {file.name}{note}")
+    
+    # 仍包含 bfloat16 的文件都需要转换：已完成的文件是 float32，不会出现在这里；
+    # 上次中断或失败留下的 .bak 会在转换成功后被覆盖
+    pending = bf16_files
+    for file in pending:
+        manifest['files'][str(file)]['status'] = 'running'
+    save_manifest(manifest, MANIFEST_PATH)
     
-    print("\n开始转换...")
+    jobs = max(1, min(args.jobs, len(pending)))
+    print(f"\n开始转换...（{jobs} 个进程）")
     
     converted_count = 0
-    for file in bf16_files:
-        # 备份原文件
-        backup_file = file.with_suffix('.safetensors.bak')
-        
-        # 如果已经有备份，说明已经转换过了
-        if backup_file.exists():
-            print(f"\n⚠ 跳过 {file.name} (已有备份文件)")
-            continue
-        
-        # 转换并保存到临时文件
-        temp_file = file.with_suffix('.safetensors.tmp')
-        
-        try:
-            if convert_safetensors_to_float32(file, temp_file):
-                # 备份原文件
-                file.rename(backup_file)
-                print(f"  ✓ 原文件已备份为: {backup_file.name}")
-                
-                # 将转换后的文件重命名为原文件名
-                temp_file.rename(file)
-                print(f"  ✓ 转换完成！")
-                converted_count += 1
-            else:
-                # 如果没有 bfloat16，删除临时文件
-                temp_file.unlink()
-                print(f"  ⚠ 此文件不包含 bfloat16，跳过")
-        
-        except Exception as e:
-            print(f"  ❌ 转换失败: {e}")
-            if temp_file.exists():
-                temp_file.unlink()
-            continue
+    failed_count = 0
+    
+    def handle_result(result):
+        nonlocal converted_count, failed_count
+        record_result(manifest, result)
+        save_manifest(manifest, MANIFEST_PATH)
+        if result['status'] == 'done':
+            converted_count += 1
+        elif result['status'] == 'failed':
+            failed_count += 1
+    
+    if jobs == 1:
+        for file in pending:
+            handle_result(convert_file(file))
+    else:
+        # 每个进程只使用 1/jobs 的核心转换，避免 jobs 个进程各自开满全部核心的线程
+        threads = max(1, (os.cpu_count() or 1) // jobs)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(convert_file, str(file), threads): file for file in pending}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # 子进程异常退出（例如内存不足被杀死）
+                    result = {'file': str(futures[future]), 'status': 'failed', 'error': str(e)}
+                    print(f"  ❌ 转换失败: {futures[future].name}: {e}")
+                handle_result(result)
     
     print("\n" + "="*80)
     if converted_count > 0:
         print(f"✅ 转换完成！共转换了 {converted_count} 个文件")
         print(f"   原始文件已备份为 .bak 文件")
         print(f"   现在运行 PaddleOCRVL_main.py 将直接使用 float32 模型，无需再转换！")
-    else:
+    elif failed_count == 0:
         print("✅ 所有需要的模型已经是 float32 格式")
+    if failed_count > 0:
+        print(f"❌ {failed_count} 个文件转换失败，重新运行将只处理这些文件")
+    print(f"   进度清单: {MANIFEST_PATH}")
     print("="*80)
 
 
 if __name__ == "__main__":
     main()
-
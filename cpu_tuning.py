@@ -0,0 +1,506 @@
+"""
+推理工作线程/进程的 CPU 资源分配
+为每个推理工作者（--workers 线程或 --processes 进程）分配计算线程数，可选地绑定到互不重叠的核心集合
+或 NUMA 节点，避免多个请求并发时 OpenMP / MKL / oneDNN 线程超额订阅 CPU
+
+功能：
+- 默认把当前进程可用的核心平均分给各工作者（PaddleOCR 默认每个 pipeline 8 个线程，与工作者数无关）
+- --cpu-pin cores：按物理核心顺序切分为连续的核心集合（超线程兄弟核在同一集合）
+- --cpu-pin numa：工作者轮流分配到各 NUMA 节点，同一节点上的工作者共享该节点的核心
+- --cpu-autotune：启动时用一张校准图片试跑多个线程数，按吞吐量或延迟选出最优配置；
+  每个候选线程数都按该线程数重新构建模型，版面检测模型和 VLM 子模型都使用候选线程数
+
+技术细节：
+- 线程数通过 paddle 的 set_num_threads 设置（调用线程的 OpenMP 线程数和 MKL 线程数），
+  同时写入 OMP_NUM_THREADS / MKL_NUM_THREADS 供之后创建的线程和 spawn 子进程继承
+- 版面检测模型（Paddle Inference）每次运行都会把线程数重置为构建时的 cpu_threads，
+  因此给 VLM 子模型套一层代理，每次调用前重新设置为当前工作者的线程数
+- 核心绑定使用 os.sched_setaffinity(0, ...)，在 Linux 上只作用于调用线程，
+  之后由该线程创建的 OpenMP 线程继承绑定；其他平台不绑定
+- 调优结果按 CPU、校准图片和 PaddleOCR 版本保存在缓存目录的 cpu_tuning.json 中，重启时直接复用
+- 多进程模式下调优在临时 fork 出的子进程中进行，主进程在 fork 推理进程之前不运行推理，
+  避免 fork 继承已经启动的 OpenMP 线程池；同时运行的校准任务各自在再 fork 出的进程中执行，
+  与实际部署一样每个进程独占一个模型
+- 线程模式下每个工作线程各有一份模型，只在第一个工作线程的模型上逐个运行校准任务，吞吐量调优不调整工作者数
+"""
+
+import os
+import glob
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import traceback
+import multiprocessing
+from typing import Any, Callable, Dict, List, Optional
+
+from manifest_utils import file_sha256
+
+
+# 需要按工作者线程数重新设置的子模型（动态图，不会自行设置线程数）
+BUDGETED_MODELS = ('vl_rec_model',)
+
+_current = threading.local()
+
+
+def available_cpus() -> List[int]:
+    """当前进程允许使用的 CPU 编号"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _parse_cpulist(text: str) -> List[int]:
+    """解析 /sys 中的 CPU 列表，例如 '0-3,8-11'"""
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _read_sys(path: str) -> Optional[str]:
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def numa_nodes(cpus: List[int] = None) -> List[List[int]]:
+    """各 NUMA 节点上可用的 CPU；无法获取拓扑时返回空列表"""
+    cpus = set(cpus if cpus is not None else available_cpus())
+    nodes = []
+    for path in sorted(glob.glob('/sys/devices/system/node/node[0-9]*/cpulist'),
+                       key=lambda p: int(os.path.basename(os.path.dirname(p))[4:])):
+        text = _read_sys(path)
+        node_cpus = sorted(cpus.intersection(_parse_cpulist(text))) if text else []
+        if node_cpus:
+            nodes.append(node_cpus)
+    return nodes
+
+
+def topology_order(cpus: List[int]) -> List[int]:
+    """按 (物理 CPU, 核心) 排序，使超线程兄弟核相邻，切分时落在同一集合"""
+    def key(cpu):
+        base = f'/sys/devices/system/cpu/cpu{cpu}/topology'
+        package = _read_sys(f'{base}/physical_package_id')
+        core = _read_sys(f'{base}/core_id')
+        if package is None or core is None:
+            return (0, cpu, cpu)
+        return (int(package), int(core), cpu)
+    return sorted(cpus, key=key)
+
+
+class CpuPlan:
+    """各推理工作者的线程数和绑定的核心"""
+
+    def __init__(self, threads: int, core_sets: Optional[List[List[int]]] = None, pin: str = 'none'):
+        self.threads = threads
+        self.core_sets = core_sets  # 第 i 个工作者绑定 core_sets[i]，None 表示不绑定
+        self.pin = pin
+
+    def cores_for(self, index: int) -> Optional[List[int]]:
+        if not self.core_sets:
+            return None
+        return self.core_sets[index % len(self.core_sets)]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'threads_per_worker': self.threads, 'pin': self.pin, 'core_sets': self.core_sets}
+
+    def describe(self) -> str:
+        if not self.core_sets:
+            return f"每个工作者 {self.threads} 个线程，不绑定核心"
+        sets = '; '.join(_format_cpus(cores) for cores in self.core_sets)
+        return f"每个工作者 {self.threads} 个线程，绑定 {self.pin}: {sets}"
+
+
+def _format_cpus(cpus: List[int]) -> str:
+    """[0, 1, 2, 5] -> '0-2,5'"""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(f'{a}-{b}' if a != b else f'{a}' for a, b in ranges)
+
+
+def plan_cpu(num_workers: int, threads: int = 0, pin: str = 'none') -> CpuPlan:
+    """
+    为 num_workers 个推理工作者分配 CPU
+
+    参数:
+        num_workers: 推理工作线程数或进程数
+        threads: 每个工作者的线程数，0 表示按核心数平均分配
+        pin: none（不绑定）/ cores（互不重叠的核心集合）/ numa（按 NUMA 节点）
+
+    返回:
+        CpuPlan: 分配结果
+    """
+    cpus = available_cpus()
+    num_workers = max(1, num_workers)
+    core_sets = None
+
+    if pin == 'numa':
+        nodes = numa_nodes(cpus)
+        if len(nodes) > 1:
+            core_sets = [nodes[i % len(nodes)] for i in range(num_workers)]
+            # 同一节点上的工作者平分该节点的核心
+            sharing = -(-num_workers // len(nodes))
+            default_threads = max(1, min(len(node) for node in nodes) // sharing)
+        else:
+            print("⚠ 未检测到多个 NUMA 节点，改为按核心绑定")
+            pin = 'cores'
+
+    if pin == 'cores':
+        ordered = topology_order(cpus)
+        if num_workers > len(ordered):
+            print(f"⚠ 工作者数 ({num_workers}) 多于可用核心 ({len(ordered)})，部分工作者共享核心")
+        chunk = max(1, len(ordered) // num_workers)
+        core_sets = [ordered[(i * chunk) % len(ordered):(i * chunk) % len(ordered) + chunk]
+                     for i in range(num_workers)]
+        default_threads = chunk
+    elif pin != 'numa':
+        pin = 'none'
+        default_threads = max(1, len(cpus) // num_workers)
+
+    return CpuPlan(threads or default_threads, core_sets, pin)
+
+
+def set_thread_count(threads: int):
+    """设置调用线程的计算线程数（paddle 内部的 OpenMP 和 MKL）"""
+    try:
+        from paddle.base import core
+    except ImportError:
+        return
+    setter = getattr(core, 'set_num_threads', None)
+    if setter is not None:
+        setter(threads)
+
+
+def configure_process(plan: CpuPlan):
+    """进程级默认线程数：之后创建的线程和 spawn 出的推理进程都从环境变量读取"""
+    os.environ['OMP_NUM_THREADS'] = str(plan.threads)
+    os.environ['MKL_NUM_THREADS'] = str(plan.threads)
+    set_thread_count(plan.threads)
+
+
+def apply_worker(plan: CpuPlan, index: int):
+    """在推理工作线程/进程开始时调用：绑定核心并设置线程数"""
+    cores = plan.cores_for(index)
+    if cores and hasattr(os, 'sched_setaffinity'):
+        # Linux 上 pid 0 表示调用线程，不影响同一进程中的其他工作线程
+        os.sched_setaffinity(0, cores)
+    _current.threads = plan.threads
+    set_thread_count(plan.threads)
+
+
+def _apply_budget():
+    threads = getattr(_current, 'threads', None)
+    if threads:
+        set_thread_count(threads)
+
+
+def _budgeted_iter(iterable):
+    """惰性生成的结果在消费时才计算，每次取下一个结果前重新设置线程数"""
+    iterator = iter(iterable)
+    while True:
+        _apply_budget()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        yield item
+
+
+class _BudgetedModel:
+    """子模型代理：每次调用前把线程数恢复为当前工作者的分配，其余属性透传"""
+
+    def __init__(self, model):
+        self._model = model
+
+    def _budgeted_call(self, func, *args, **kwargs):
+        _apply_budget()
+        result = func(*args, **kwargs)
+        if hasattr(result, '__next__'):
+            return _budgeted_iter(result)
+        return result
+
+    def __call__(self, *args, **kwargs):
+        return self._budgeted_call(self._model, *args, **kwargs)
+
+    def predict(self, *args, **kwargs):
+        return self._budgeted_call(self._model.predict, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+def budget_pipeline(pipeline, max_depth: int = 4) -> int:
+    """
+    在 pipeline 对象图中查找 VLM 子模型并套上线程数代理
+
+    返回:
+        int: 接入的子模型数量
+    """
+    found = 0
+    visited = set()
+    pending = [(pipeline, 0)]
+    while pending:
+        obj, depth = pending.pop()
+        if id(obj) in visited or depth > max_depth:
+            continue
+        visited.add(id(obj))
+        try:
+            attributes = vars(obj)
+        except TypeError:
+            continue
+        for name, value in list(attributes.items()):
+            if name in BUDGETED_MODELS and not isinstance(value, _BudgetedModel):
+                setattr(obj, name, _BudgetedModel(value))
+                found += 1
+            elif hasattr(value, '__dict__') and not isinstance(value, (type, _BudgetedModel)):
+                pending.append((value, depth + 1))
+    return found
+
+
+def make_calibration_image(path: str):
+    """生成一张带多行文字的校准图片（没有指定 --calibration-image 时使用）"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', (1000, 700), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.text((60, 40), 'CPU calibration page', fill='black')
+    for row in range(16):
+        draw.text((60, 90 + row * 36),
+                  f'{row + 1:02d}. The quick brown fox jumps over the lazy dog 0123456789', fill='black')
+    draw.rectangle((600, 40, 940, 70), outline='black')
+    image.save(path)
+
+
+def candidate_threads(max_threads: int) -> List[int]:
+    """候选线程数：2 的幂加上最大值，过小的线程数在 CPU 上太慢，不超过最大值的 1/8"""
+    floor = max(1, max_threads // 8)
+    candidates = {t for t in (1, 2, 4, 8, 16, 32, 64, 128) if floor <= t < max_threads}
+    candidates.add(max_threads)
+    return sorted(candidates)
+
+
+def _calibration_child(run_once, image_path: str, plan: CpuPlan, index: int, barrier):
+    """校准进程：预热一次后等所有校准进程就绪，再同时开始计时的那次识别"""
+    try:
+        apply_worker(plan, index)
+        run_once(image_path)
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        return
+    except BaseException:
+        barrier.abort()
+        raise
+    run_once(image_path)
+
+
+class CpuAutotuner:
+    """
+    启动时的线程数自动调优
+
+    throughput: 多进程模式下，对每个候选线程数 t 同时运行 可用核心数 // t 个校准进程（各自的线程数为 t），
+                按单位时间完成的任务数选择，并相应调整进程数；
+                线程模式下工作者共享同一个模型，工作者数不变，逐个运行校准任务
+    latency:    工作者数不变，单独运行一个校准任务，选择耗时最短的线程数
+    """
+
+    def __init__(self, run_once: Callable[[str], None], objective: str, num_workers: int,
+                 pin: str = 'none', cache_path: Optional[str] = None, cache_tag: str = '',
+                 rebuild: Optional[Callable[[int], None]] = None, scale_workers: bool = False):
+        self.run_once = run_once  # run_once(image_path) 在当前线程中完成一次识别
+        self.objective = objective
+        self.num_workers = max(1, num_workers)
+        self.pin = pin
+        self.cache_path = cache_path
+        self.cache_tag = cache_tag
+        self.rebuild = rebuild  # rebuild(threads) 按该线程数重新构建当前进程中的模型
+        # 只有多进程模式（且支持 fork）才能同时运行多个校准任务并调整工作者数
+        self.scale_workers = scale_workers and 'fork' in multiprocessing.get_all_start_methods()
+        self.results = []
+
+    def _cache_key(self, image_path: str) -> str:
+        key = {'cpus': available_cpus(), 'objective': self.objective, 'pin': self.pin,
+               'workers': None if self.objective == 'throughput' and self.scale_workers else self.num_workers,
+               'scale_workers': self.scale_workers, 'image': file_sha256(image_path), 'tag': self.cache_tag}
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _load_cached(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get(key)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, key: str, result: Dict[str, Any]):
+        if not self.cache_path:
+            return
+        try:
+            cache = {}
+            if os.path.exists(self.cache_path):
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    cache = json.load(f)
+            cache[key] = result
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False, indent=2)
+        except (OSError, ValueError) as e:
+            print(f"⚠ 调优结果保存失败: {e}")
+
+    def _measure(self, image_path: str, workers: int, threads: int) -> float:
+        """
+        运行 workers 个校准任务（预热一次后计时），返回计时部分的总耗时（秒）
+
+        scale_workers 时每个任务在 fork 出的进程中运行，否则 workers 必须为 1，在临时线程中运行
+        （核心绑定只作用于该线程）
+        """
+        plan = plan_cpu(workers, threads, self.pin)
+        if self.scale_workers:
+            return self._measure_processes(image_path, plan, workers)
+
+        elapsed = []
+        errors = []
+
+        def run():
+            try:
+                apply_worker(plan, 0)
+                # 第一次运行包含 oneDNN 原语创建等一次性开销，不计入结果
+                self.run_once(image_path)
+                start_time = time.perf_counter()
+                self.run_once(image_path)
+                elapsed.append(time.perf_counter() - start_time)
+            except Exception as e:
+                errors.append(e)
+
+        runner = threading.Thread(target=run, name='cpu-autotune')
+        runner.start()
+        runner.join()
+        if errors:
+            raise errors[0]
+        return elapsed[0]
+
+    def _measure_processes(self, image_path: str, plan: CpuPlan, workers: int) -> float:
+        context = multiprocessing.get_context('fork')
+        barrier = context.Barrier(workers + 1)
+        processes = [context.Process(target=_calibration_child, args=(self.run_once, image_path, plan, i, barrier),
+                                     name=f'cpu-autotune-{i}') for i in range(workers)]
+        for process in processes:
+            process.start()
+        start_time = None
+        try:
+            # 等所有校准进程预热完成；有进程提前退出时放弃本轮
+            while barrier.n_waiting < workers:
+                if any(process.exitcode is not None for process in processes):
+                    barrier.abort()
+                    break
+                time.sleep(0.05)
+            barrier.wait()
+            start_time = time.perf_counter()
+        except threading.BrokenBarrierError:
+            pass
+        for process in processes:
+            process.join()
+        if start_time is None or any(process.exitcode != 0 for process in processes):
+            codes = [process.exitcode for process in processes]
+            raise RuntimeError(f'校准进程异常退出（退出码 {codes}）')
+        return time.perf_counter() - start_time
+
+    def tune(self, image_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        运行调优（有缓存时直接返回缓存结果）
+
+        返回:
+            dict: threads（每个工作者的线程数）、workers（工作者数）和各候选的测量结果
+        """
+        temp_dir = None
+        if image_path is None:
+            temp_dir = tempfile.mkdtemp(prefix='ocr_calibration_')
+            image_path = os.path.join(temp_dir, 'calibration.png')
+            make_calibration_image(image_path)
+        try:
+            key = self._cache_key(image_path)
+            cached = self._load_cached(key)
+            if cached is not None:
+                print(f"⚙ 使用缓存的 CPU 调优结果: 每个工作者 {cached['threads']} 个线程，"
+                      f"{cached['workers']} 个工作者")
+                return cached
+
+            cpus = len(available_cpus())
+            scale = self.objective == 'throughput' and self.scale_workers
+            max_threads = cpus if scale else max(1, cpus // self.num_workers)
+            candidates = candidate_threads(max_threads)
+            print(f"⚙ CPU 自动调优（{self.objective}）：候选线程数 {candidates}")
+            if self.objective == 'throughput' and not scale:
+                print(f"   线程模式下逐个运行校准任务，保持 {self.num_workers} 个工作者"
+                      f"（--processes 模式下会同时调整进程数）")
+
+            for threads in candidates:
+                if self.rebuild is not None:
+                    # 版面检测模型的线程数在构建时确定，每个候选线程数都重新构建
+                    self.rebuild(threads)
+                workers = max(1, cpus // threads) if scale else 1
+                elapsed = self._measure(image_path, workers, threads)
+                entry = {'threads': threads, 'workers': workers, 'seconds': round(elapsed, 3),
+                         'throughput': round(workers / elapsed, 4)}
+                self.results.append(entry)
+                print(f"   {threads:>3} 线程 × {workers:>2} 个任务: {elapsed:.2f} 秒，"
+                      f"{entry['throughput'] * 60:.2f} 张/分钟")
+
+            if self.objective == 'throughput':
+                best = max(self.results, key=lambda r: r['throughput'])
+            else:
+                best = min(self.results, key=lambda r: r['seconds'])
+            result = {'threads': best['threads'],
+                      'workers': best['workers'] if scale else self.num_workers,
+                      'objective': self.objective, 'tuned_at': time.time(), 'candidates': self.results}
+            self._store(key, result)
+            print(f"✅ CPU 调优完成: 每个工作者 {result['threads']} 个线程，{result['workers']} 个工作者")
+            return result
+        finally:
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _tune_child(conn, tuner: CpuAutotuner, image_path: Optional[str]):
+    try:
+        conn.send(('result', tuner.tune(image_path)))
+    except Exception as e:
+        conn.send(('error', f'{e}\n{traceback.format_exc()}'))
+    finally:
+        conn.close()
+
+
+def tune_in_subprocess(tuner: CpuAutotuner, image_path: Optional[str] = None) -> Dict[str, Any]:
+    """在 fork 出的临时子进程中运行 tuner.tune()；不支持 fork 的平台直接在当前进程中运行"""
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return tuner.tune(image_path)
+    context = multiprocessing.get_context('fork')
+    parent_conn, child_conn = context.Pipe()
+    process = context.Process(target=_tune_child, args=(child_conn, tuner, image_path))
+    process.start()
+    child_conn.close()
+    try:
+        kind, payload = parent_conn.recv()
+    except EOFError:
+        raise RuntimeError(f'调优进程异常退出（退出码 {process.exitcode}）')
+    finally:
+        process.join()
+        parent_conn.close()
+    if kind == 'error':
+        raise RuntimeError(payload)
+    return payload
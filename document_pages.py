@@ -0,0 +1,128 @@
+"""
+多页文档（PDF / 多帧 TIFF）的按页读取
+服务端把多页文档拆成逐页任务，每个任务只渲染自己那一页，多个推理工作线程/进程可以并行处理不同页
+
+技术细节：
+- 不预先渲染整个文档：count_pages 只读取页数，render_page 按需渲染单页
+- PDF 使用 pypdfium2（PaddleX 读取 PDF 时使用的同一个库），TIFF 使用 Pillow
+- 渲染结果为 BGR 的 numpy 数组，与 cv2.imread 一致，可直接传给 predict
+- pdfium 不是线程安全的：多个推理工作线程渲染、连接线程统计页数可能同时发生，
+  所有 pdfium 调用（打开、渲染、转换为图片、关闭）都在模块级锁内串行执行
+"""
+
+import os
+import threading
+from typing import Any, Dict, List
+
+import numpy as np
+
+try:
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
+
+
+# 可能包含多页的格式
+MULTIPAGE_FORMATS = {'.pdf', '.tif', '.tiff'}
+
+# pdfium 的全局状态没有加锁保护，同一进程内同一时间只能有一个线程调用
+_pdfium_lock = threading.Lock()
+
+# PDF 渲染分辨率，与 PaddleX 读取 PDF 时的默认缩放一致（2 倍，即 144 DPI）
+PDF_RENDER_SCALE = 2.0
+
+
+def is_multipage_format(path: str) -> bool:
+    """按扩展名判断是否可能是多页文档"""
+    return os.path.splitext(path)[1].lower() in MULTIPAGE_FORMATS
+
+
+def _is_pdf(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() == '.pdf'
+
+
+def _open_pdf(path: str):
+    if pypdfium2 is None:
+        raise RuntimeError('读取 PDF 需要 pypdfium2，请先安装: pip install pypdfium2')
+    return pypdfium2.PdfDocument(path)
+
+
+def count_pages(path: str) -> int:
+    """文档页数（只读取文档结构，不渲染）"""
+    if _is_pdf(path):
+        with _pdfium_lock:
+            pdf = _open_pdf(path)
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+
+    from PIL import Image
+    with Image.open(path) as image:
+        return getattr(image, 'n_frames', 1)
+
+
+def render_page(path: str, page_index: int) -> np.ndarray:
+    """
+    渲染文档的第 page_index 页（从 0 开始）
+
+    返回:
+        np.ndarray: BGR 图像
+    """
+    if _is_pdf(path):
+        with _pdfium_lock:
+            pdf = _open_pdf(path)
+            try:
+                page = pdf[page_index]
+                bitmap = page.render(scale=PDF_RENDER_SCALE)
+                # convert 复制出独立的图像，之后可以在锁外使用
+                image = bitmap.to_pil().convert('RGB')
+                bitmap.close()
+                page.close()
+            finally:
+                pdf.close()
+    else:
+        from PIL import Image
+        with Image.open(path) as tiff:
+            tiff.seek(page_index)
+            image = tiff.convert('RGB')
+
+    return np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
+
+
+def page_file_stem(page_idx: int) -> str:
+    """多页文档中第 page_idx 页（从 1 开始）的结果文件名"""
+    return f'page_{page_idx:04d}'
+
+
+def merge_page_results(save_path: str, pages: List[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    把逐页结果合并为一个文档：result.md 按页顺序拼接，result.json 汇总每页的 JSON
+
+    参数:
+        save_path: 文档的结果目录
+        pages: 各页的 {'page_idx', 'json_path', 'md_path'}，按页码排序
+
+    返回:
+        dict: 合并文件的路径 {'merged_json_path', 'merged_md_path'}
+    """
+    markdown_pages = []
+    json_pages = []
+    for page in pages:
+        with open(page['md_path'], 'r', encoding='utf-8') as f:
+            markdown_pages.append(f.read().strip())
+        with open(page['json_path'], 'r', encoding='utf-8') as f:
+            json_pages.append(f.read().strip())
+
+    merged_md_path = os.path.join(save_path, 'result.md')
+    with open(merged_md_path, 'w', encoding='utf-8') as f:
+        f.write('\n\n'.join(markdown_pages) + '\n')
+
+    # 每页的 JSON 原样嵌入，避免重新解析和序列化大文档
+    merged_json_path = os.path.join(save_path, 'result.json')
+    with open(merged_json_path, 'w', encoding='utf-8') as f:
+        f.write('{"page_count": %d, "pages": [\n' % len(pages))
+        f.write(',\n'.join(json_pages))
+        f.write('\n]}\n')
+
+    return {'merged_json_path': merged_json_path, 'merged_md_path': merged_md_path}
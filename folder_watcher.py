@@ -0,0 +1,207 @@
+"""
+热文件夹监视
+持续监视输入目录，新图片完整写入后立即报告，供 batch_ocr_client.py --watch 使用
+
+技术细节：
+- Linux 上通过 ctypes 直接调用 inotify，只在 IN_CLOSE_WRITE（写入方关闭文件）和
+  IN_MOVED_TO（改名/移动进目录）时报告，不会拿到写了一半的文件
+- 其他平台（或 inotify 不可用时）退回轮询：文件大小和修改时间在 settle_time 内保持不变才报告
+- 启动时先报告目录中已有的文件，由调用方根据处理清单决定是否跳过
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from typing import Iterable, List, Optional
+
+
+# inotify 常量（见 <sys/inotify.h>）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+def _load_inotify():
+    """加载 libc 中的 inotify 函数，不可用时返回 None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class FolderWatcher:
+    """监视一个目录中指定扩展名的文件"""
+
+    def __init__(self, folder: str, extensions: Iterable[str], poll_interval: float = 1.0,
+                 settle_time: float = 2.0, use_inotify: bool = True):
+        self.folder = os.path.abspath(folder)
+        self.extensions = {ext.lower() for ext in extensions}
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.backend = 'polling'
+
+        self._fd = None
+        self._pending = self._existing_files()  # 待报告的文件
+        self._seen = {}  # 轮询模式：路径 -> (大小, 修改时间, 首次观察到该状态的时间)
+        self._reported = {}  # 路径 -> 报告时的 (大小, 修改时间)
+
+        libc = _load_inotify() if use_inotify else None
+        if libc is not None:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0 and libc.inotify_add_watch(fd, os.fsencode(self.folder),
+                                                  IN_CLOSE_WRITE | IN_MOVED_TO) >= 0:
+                self._fd = fd
+                self.backend = 'inotify'
+            elif fd >= 0:
+                os.close(fd)
+
+        if self.backend == 'polling':
+            # 已有文件直接报告，避免轮询时再等待一次稳定期
+            for path in self._pending:
+                self._mark_reported(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _matches(self, name: str) -> bool:
+        return os.path.splitext(name)[1].lower() in self.extensions and not name.startswith('.')
+
+    def _existing_files(self) -> List[str]:
+        if not os.path.isdir(self.folder):
+            return []
+        return sorted(entry.path for entry in os.scandir(self.folder)
+                      if entry.is_file() and self._matches(entry.name))
+
+    def _mark_reported(self, path: str):
+        try:
+            stat = os.stat(path)
+            self._reported[path] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            pass
+
+    def poll(self, timeout: Optional[float] = None) -> List[str]:
+        """
+        等待新完成写入的文件
+
+        参数:
+            timeout: 最长等待秒数，None 表示一直等到有文件为止
+
+        返回:
+            list: 新文件的绝对路径（可能为空）
+        """
+        if self._pending:
+            ready, self._pending = self._pending, []
+            return ready
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            if self._fd is not None:
+                ready = self._read_inotify(remaining)
+            else:
+                ready = self._scan(remaining)
+            if ready or (deadline is not None and time.monotonic() >= deadline):
+                return ready
+
+    def _read_inotify(self, timeout: Optional[float]) -> List[str]:
+        """读取 inotify 事件"""
+        try:
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+        except InterruptedError:
+            return []
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                return []
+            raise
+
+        ready = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + name_len].split(b'\0', 1)[0]
+            offset += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                # 事件队列溢出，可能丢了事件：重新扫描整个目录
+                ready.extend(self._existing_files())
+                continue
+            if not name:
+                continue
+            name = os.fsdecode(name)
+            if self._matches(name):
+                ready.append(os.path.join(self.folder, name))
+
+        # 同一批事件中同一文件只报告一次
+        return list(dict.fromkeys(ready))
+
+    def _scan(self, timeout: Optional[float]) -> List[str]:
+        """轮询一次目录：大小和修改时间在 settle_time 内不变的文件视为写入完成"""
+        now = time.monotonic()
+        ready = []
+        current = set()
+
+        if os.path.isdir(self.folder):
+            for entry in os.scandir(self.folder):
+                if not (entry.is_file() and self._matches(entry.name)):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                path = entry.path
+                state = (stat.st_size, stat.st_mtime_ns)
+                current.add(path)
+
+                if self._reported.get(path) == state:
+                    continue
+                seen = self._seen.get(path)
+                if seen is None or seen[:2] != state:
+                    self._seen[path] = (*state, now)
+                elif now - seen[2] >= self.settle_time:
+                    ready.append(path)
+                    self._reported[path] = state
+                    del self._seen[path]
+
+        # 被删除的文件不再跟踪
+        for path in list(self._seen):
+            if path not in current:
+                del self._seen[path]
+        for path in list(self._reported):
+            if path not in current:
+                del self._reported[path]
+
+        if not ready:
+            interval = self.poll_interval if timeout is None else min(self.poll_interval, timeout)
+            time.sleep(interval)
+        return sorted(ready)
@@ -0,0 +1,153 @@
+"""
+推理前的图片预处理
+扫描仪输出的 600 DPI 大图远超模型需要的分辨率，可以在进入 pipeline.predict 之前先缩小，
+并识别重复提交的图片，直接复用已有结果（各项均需显式开启）
+
+技术细节：
+- 在独立的线程池中执行（Pillow 的解码和缩放会释放 GIL），与上一张图片的推理重叠进行
+- JPEG 使用 draft 模式在解码时直接按 1/2、1/4、1/8 缩小，不必先解码出完整的大图
+- 缩放目标：最长边不超过 max_side，或按图片自带的 DPI 缩放到 target_dpi
+- 灰度转换只在图片本身几乎没有颜色时进行（去除扫描仪的色偏），彩色图片保持不变
+- 按 EXIF 方向信息旋转图片（与 cv2.imread 的行为一致），手机拍摄的照片不会横着送入模型
+- 去重按解码后像素的 SHA-256 精确匹配：同一图片另存为其他格式或去掉元数据后仍能命中；
+  不做感知哈希的近似匹配，金额只差一位数字的两张发票在缩略图和 dHash 上与同一图片的缩放副本
+  无法区分，近似匹配会把另一份文档的识别结果返回给新文档
+"""
+
+import io
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+
+# 通道间平均差异低于此值（0-255）视为灰度图片
+GRAYSCALE_TOLERANCE = 6.0
+
+# 去重索引最多保存的像素哈希数
+DEDUPE_INDEX_SIZE = 10000
+
+
+def is_effectively_grayscale(image) -> bool:
+    """在缩略图上检查各通道是否几乎相同"""
+    if image.mode in ('L', 'LA', '1', 'I', 'F'):
+        return True
+    thumb = np.asarray(image.convert('RGB').resize((64, 64)), dtype=np.int16)
+    spread = np.abs(thumb[:, :, 0] - thumb[:, :, 1]) + np.abs(thumb[:, :, 1] - thumb[:, :, 2])
+    return float(spread.mean()) / 2 < GRAYSCALE_TOLERANCE
+
+
+class ImagePreprocessor:
+    """推理前的缩放 / 灰度 / 去重预处理"""
+
+    def __init__(self, max_side: int = 0, target_dpi: int = 0, grayscale: bool = False,
+                 dedupe: bool = False, num_workers: int = 2):
+        """
+        参数:
+            max_side: 最长边上限（像素），0 表示不限制
+            target_dpi: 按图片 DPI 缩放到的目标分辨率，0 表示不使用
+            grayscale: 是否把几乎没有颜色的图片转为灰度
+            dedupe: 是否让解码后像素完全相同的图片复用已有结果
+            num_workers: 预处理线程数
+        """
+        self.max_side = max_side
+        self.target_dpi = target_dpi
+        self.grayscale = grayscale
+        self.dedupe = dedupe
+        self.num_workers = num_workers
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='preprocess')
+        self._hashes = OrderedDict()  # 像素哈希 -> 结果缓存键
+        self._lock = threading.Lock()
+
+    def options(self) -> Dict[str, Any]:
+        """构造参数，用于在 spawn 出的推理进程中创建设置相同的预处理器"""
+        return {'max_side': self.max_side, 'target_dpi': self.target_dpi, 'grayscale': self.grayscale,
+                'dedupe': self.dedupe, 'num_workers': self.num_workers}
+
+    def signature(self) -> str:
+        """影响识别结果的预处理设置，作为结果缓存版本的一部分"""
+        return f"max{self.max_side}-dpi{self.target_dpi}-gray{int(self.grayscale)}"
+
+    def _target_scale(self, image) -> float:
+        """计算缩放比例（只缩小，不放大）"""
+        scale = 1.0
+        if self.max_side:
+            scale = min(scale, self.max_side / max(image.size))
+        if self.target_dpi:
+            dpi = image.info.get('dpi')
+            if dpi and dpi[0]:
+                scale = min(scale, self.target_dpi / float(dpi[0]))
+        return scale
+
+    def prepare(self, source) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """
+        预处理一张图片
+
+        参数:
+            source: 图片路径或图片字节
+
+        返回:
+            (image, info): BGR 图像（与 cv2.imread 一致）和预处理信息
+                           （原始尺寸、缩放比例、是否转为灰度和像素哈希）
+        """
+        from PIL import Image, ImageOps
+
+        image = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+        original_size = image.size
+        scale = self._target_scale(image)
+
+        if scale < 1.0 and image.format == 'JPEG':
+            # 解码时直接缩小（只会缩小到不小于请求的尺寸）
+            target = (max(1, int(original_size[0] * scale)), max(1, int(original_size[1] * scale)))
+            image.draft('RGB', target)
+
+        # EXIF 方向为 5-8 时宽高互换，原始尺寸按旋转后的方向记录
+        if image.getexif().get(0x0112) in (5, 6, 7, 8):
+            original_size = original_size[::-1]
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        if scale < 1.0:
+            target = (max(1, round(original_size[0] * scale)), max(1, round(original_size[1] * scale)))
+            image = image.resize(target, Image.LANCZOS, reducing_gap=2.0)
+
+        grayscale = self.grayscale and is_effectively_grayscale(image)
+        if grayscale:
+            image = image.convert('L').convert('RGB')
+
+        info = {
+            'original_size': list(original_size),
+            'size': list(image.size),
+            'scale': image.size[0] / original_size[0],
+            'grayscale': grayscale
+        }
+        array = np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
+        if self.dedupe:
+            info['pixel_hash'] = hashlib.sha256(repr(array.shape).encode('ascii') + array.tobytes()).hexdigest()
+        return array, info
+
+    def submit(self, source) -> Future:
+        """在预处理线程池中执行 prepare"""
+        return self.executor.submit(self.prepare, source)
+
+    def find_duplicate(self, pixel_hash: str) -> Optional[str]:
+        """查找像素完全相同的已识别图片，返回其结果缓存键"""
+        if not self.dedupe:
+            return None
+        with self._lock:
+            cache_key = self._hashes.get(pixel_hash)
+            if cache_key is not None:
+                self._hashes.move_to_end(pixel_hash)
+            return cache_key
+
+    def remember(self, pixel_hash: str, cache_key: str):
+        """记录一张识别成功的图片"""
+        with self._lock:
+            self._hashes[pixel_hash] = cache_key
+            self._hashes.move_to_end(pixel_hash)
+            while len(self._hashes) > DEDUPE_INDEX_SIZE:
+                self._hashes.popitem(last=False)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
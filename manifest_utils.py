@@ -0,0 +1,53 @@
+"""
+JSON 清单读写与文件内容哈希
+供 convert_models_once.py、batch_ocr_client.py 和 cpu_tuning.py 共用
+
+技术细节：
+- 清单带版本号，文件不存在、损坏或版本不符时返回空清单，调用方按空清单重新处理
+- 写回时先写临时文件再原子替换，中途崩溃不会留下半个清单
+"""
+
+import os
+import json
+import hashlib
+from typing import Any, Dict, Iterable
+
+
+def load_manifest(path, version: int, sections: Iterable[str] = ('files',)) -> Dict[str, Any]:
+    """
+    读取清单，不存在或格式不符时返回空清单
+
+    参数:
+        path: 清单文件路径
+        version: 期望的清单版本号
+        sections: 空清单中包含的字典字段
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if isinstance(manifest, dict) and manifest.get('version') == version:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    manifest = {'version': version}
+    for name in sections:
+        manifest[name] = {}
+    return manifest
+
+
+def save_manifest(manifest: Dict[str, Any], path):
+    """原子地写回清单（先写临时文件再替换）"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def file_sha256(path, block_size: int = 1024 * 1024) -> str:
+    """计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,281 @@
+"""
+模型权重快照（热备快速重启）
+首次初始化成功后，把构建 PaddleOCRVL 时打开过的所有 safetensors 权重预先转换为 float32，
+按对齐方式写入单个可 mmap 的快照文件；之后重启时 setup_safetensors 直接从快照读取张量，
+不再逐个解析 checkpoint、也不做 bfloat16 转换
+
+文件格式：
+    8 字节魔数 b'OCRSNAP1' + 8 字节小端 header 长度 + header JSON，
+    数据区从 4096 字节对齐处开始，每个张量按 64 字节对齐
+    header 记录每个来源 checkpoint 的路径、大小、修改时间，每个张量的偏移和形状，
+    以及 checkpoint 所在目录中的配置文件（config.json 等）内容
+
+技术细节：
+- 来源文件的大小/修改时间或目录中的配置文件变化后（例如运行了 convert_models_once.py），
+  对应 checkpoint 自动回退到原文件读取，服务端会在后台重新生成快照
+- 快照只替换权重读取这一步；PaddleX 的模型结构构建和配置解析仍会执行
+- 写入先写临时文件再原子替换，中途退出不会留下损坏的快照
+"""
+
+import os
+import json
+import mmap
+import time
+import struct
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from bf16_converter import bfloat16_to_float32
+
+
+MAGIC = b'OCRSNAP1'
+FORMAT_VERSION = 1
+DATA_ALIGNMENT = 4096
+TENSOR_ALIGNMENT = 64
+
+# 快照中保存的配置文件（与权重位于同一目录）
+CONFIG_SUFFIXES = ('.json', '.yml', '.yaml')
+
+def _align(value: int, alignment: int) -> int:
+    return -(-value // alignment) * alignment
+
+
+def _source_key(path: str) -> Dict[str, Any]:
+    stat = os.stat(path)
+    return {'path': os.path.realpath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _read_configs(path: str) -> Dict[str, str]:
+    """checkpoint 所在目录中的配置文件内容"""
+    folder = os.path.dirname(os.path.realpath(path))
+    configs = {}
+    for name in sorted(os.listdir(folder)):
+        if name.endswith(CONFIG_SUFFIXES) and os.path.isfile(os.path.join(folder, name)):
+            with open(os.path.join(folder, name), 'r', encoding='utf-8', errors='replace') as f:
+                configs[name] = f.read()
+    return configs
+
+
+def _read_safetensors_header(mm) -> Tuple[Dict[str, Any], int]:
+    header_size = struct.unpack_from('<Q', mm, 0)[0]
+    header = json.loads(mm[8:8 + header_size].decode('utf-8'))
+    header.pop('__metadata__', None)
+    return header, 8 + header_size
+
+
+class SnapshotCheckpoint:
+    """
+    快照中的一个 checkpoint，属性与 setup_safetensors._Checkpoint 一致
+    （mmap / data_start / tensor_info / decoded），张量偏移是相对整个快照文件的绝对位置
+    """
+
+    from_snapshot = True
+
+    def __init__(self, snapshot, tensor_info: Dict[str, Any]):
+        self.mmap = snapshot.mmap
+        self.data_start = 0
+        self.tensor_info = tensor_info
+        self.decoded = None
+
+    def close(self):
+        # 映射属于整个快照，由 ModelSnapshot.close() 释放
+        self.decoded = None
+
+
+class ModelSnapshot:
+    """已打开的快照文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.mmap[:8] != MAGIC:
+                raise ValueError('不是模型快照文件')
+            header_size = struct.unpack_from('<Q', self.mmap, 8)[0]
+            self.header = json.loads(self.mmap[16:16 + header_size].decode('utf-8'))
+            if self.header.get('format_version') != FORMAT_VERSION:
+                raise ValueError(f"快照格式版本不符: {self.header.get('format_version')}")
+        except Exception:
+            self.close()
+            raise
+
+        # 来源 realpath -> 快照条目，只保留来源文件和配置都没有变化的条目
+        self.entries = {}
+        self.stale = []
+        for entry in self.header['checkpoints']:
+            try:
+                valid = (_source_key(entry['path']) == entry['source']
+                         and _read_configs(entry['path']) == entry['configs'])
+            except OSError:
+                valid = False
+            if valid:
+                self.entries[entry['source']['path']] = entry
+            else:
+                self.stale.append(entry['path'])
+
+    @property
+    def time_to_ready(self) -> Optional[float]:
+        """生成快照的那次启动（未使用快照）的就绪耗时"""
+        return self.header.get('time_to_ready')
+
+    def checkpoint_for(self, filename: str) -> Optional[SnapshotCheckpoint]:
+        """filename 对应的快照 checkpoint；快照中没有或已过期时返回 None"""
+        entry = self.entries.get(os.path.realpath(filename))
+        if entry is None:
+            return None
+        return SnapshotCheckpoint(self, entry['tensors'])
+
+    def close(self):
+        if getattr(self, 'mmap', None) is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                pass  # 仍有张量视图引用映射区域，随进程退出释放
+            self.mmap = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def open_snapshot(path: str) -> Optional[ModelSnapshot]:
+    """打开快照，文件不存在或无法使用时返回 None"""
+    if not os.path.exists(path):
+        return None
+    try:
+        snapshot = ModelSnapshot(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"⚠ 模型快照无法使用，将从原始权重加载: {e}")
+        return None
+    if snapshot.stale:
+        print(f"⚠ 模型快照中 {len(snapshot.stale)} 个 checkpoint 已过期（权重或配置有变化），"
+              f"这些权重从原文件加载")
+    if not snapshot.entries:
+        snapshot.close()
+        return None
+    return snapshot
+
+
+def write_snapshot(path: str, checkpoint_paths: List[str], metadata: Dict[str, Any] = None) -> int:
+    """
+    把 checkpoint_paths 中的 safetensors 文件写为一个快照
+
+    参数:
+        path: 快照文件路径
+        checkpoint_paths: 需要包含的 safetensors 文件
+        metadata: 额外写入 header 的信息（例如生成时的就绪耗时）
+
+    返回:
+        int: 快照文件大小（字节）
+    """
+    sources = []
+    offset = 0
+    for checkpoint_path in checkpoint_paths:
+        with open(checkpoint_path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header, _ = _read_safetensors_header(mm)
+        tensors = {}
+        for name, info in sorted(header.items(), key=lambda item: item[1]['data_offsets'][0]):
+            count = int(np.prod(info['shape'])) if info['shape'] else 1
+            begin, end = info['data_offsets']
+            if info['dtype'] == 'BF16':
+                # bfloat16 统一转换为 float32，字节数翻倍
+                if end - begin != count * 2:
+                    raise ValueError(f"{checkpoint_path}: BF16 张量 {name} 的数据长度 {end - begin} "
+                                     f"与形状 {info['shape']} 不符")
+                nbytes = count * 4
+            else:
+                # 其他类型原样复制，字节数取自源文件中的偏移，不依赖数据类型表
+                nbytes = end - begin
+            offset = _align(offset, TENSOR_ALIGNMENT)
+            tensors[name] = {
+                'dtype': 'F32' if info['dtype'] == 'BF16' else info['dtype'],
+                'shape': info['shape'],
+                'data_offsets': [offset, offset + nbytes],
+                'source_dtype': info['dtype'],
+                'source_offsets': info['data_offsets']
+            }
+            offset += nbytes
+        sources.append((checkpoint_path, tensors))
+
+    # header 长度决定数据区起点，而张量的绝对偏移又写在 header 中：先按相对偏移估算长度，
+    # 留出余量后确定数据区起点，再把所有偏移平移到绝对位置
+    def build_header(data_start):
+        checkpoints = []
+        for checkpoint_path, tensors in sources:
+            checkpoints.append({
+                'path': os.path.realpath(checkpoint_path),
+                'source': _source_key(checkpoint_path),
+                'configs': _read_configs(checkpoint_path),
+                'tensors': {name: {'dtype': info['dtype'], 'shape': info['shape'],
+                                   'data_offsets': [info['data_offsets'][0] + data_start,
+                                                    info['data_offsets'][1] + data_start]}
+                            for name, info in tensors.items()}
+            })
+        header = {'format_version': FORMAT_VERSION, 'created_at': time.time(),
+                  'checkpoints': checkpoints}
+        header.update(metadata or {})
+        return json.dumps(header, ensure_ascii=False).encode('utf-8')
+
+    estimate = len(build_header(0))
+    data_start = _align(16 + estimate + 1024, DATA_ALIGNMENT)
+    header_bytes = build_header(data_start)
+    while 16 + len(header_bytes) > data_start:
+        data_start += DATA_ALIGNMENT
+        header_bytes = build_header(data_start)
+    total_size = data_start + offset
+
+    temp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    try:
+        with open(temp_path, 'w+b') as out_file:
+            out_file.truncate(total_size)
+            with mmap.mmap(out_file.fileno(), total_size) as out:
+                out[:8] = MAGIC
+                struct.pack_into('<Q', out, 8, len(header_bytes))
+                out[16:16 + len(header_bytes)] = header_bytes
+
+                for checkpoint_path, tensors in sources:
+                    with open(checkpoint_path, 'rb') as f, \
+                            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        _, source_start = _read_safetensors_header(mm)
+                        for info in tensors.values():
+                            begin, end = info['source_offsets']
+                            out_begin, out_end = (data_start + value for value in info['data_offsets'])
+                            if info['source_dtype'] == 'BF16':
+                                # 直接转换到输出映射区域，不经过中间缓冲
+                                target = np.frombuffer(out, dtype=np.float32,
+                                                       count=(out_end - out_begin) // 4, offset=out_begin)
+                                source = np.frombuffer(mm, dtype=np.uint16,
+                                                       count=(end - begin) // 2, offset=source_start + begin)
+                                bfloat16_to_float32(source, out=target)
+                                del target, source
+                            else:
+                                out[out_begin:out_end] = mm[source_start + begin:source_start + end]
+                out.flush()
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return total_size
+
+
+def write_snapshot_in_background(path: str, checkpoint_paths: List[str],
+                                 metadata: Dict[str, Any] = None) -> threading.Thread:
+    """在后台线程中生成快照，不影响服务对外提供识别"""
+    def run():
+        start_time = time.time()
+        try:
+            size = write_snapshot(path, checkpoint_paths, metadata)
+        except Exception as e:
+            print(f"⚠ 模型快照生成失败: {e}")
+            return
+        print(f"💾 模型快照已生成: {path}（{size / (1 << 30):.2f} GB，"
+              f"{len(checkpoint_paths)} 个 checkpoint，耗时 {time.time() - start_time:.1f} 秒）")
+
+    thread = threading.Thread(target=run, name='model-snapshot', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,273 @@
+"""
+PaddleOCRVL 服务的 asyncio 前端
+用一个事件循环处理所有客户端连接，替代每个连接一个线程的 accept 循环
+
+技术细节：
+- 请求类型与线程版完全一致（ocr / status / metrics / reload / shutdown），共用 PPOCRServer 的队列和推理工作线程
+- OCR 请求只入队，不占用任何线程等待；工作线程完成后通过 call_soon_threadsafe 唤醒协程
+- status / metrics 直接在事件循环中处理，即使正在处理很慢的图片也能立即返回
+- 同一连接上的多个请求并发处理，响应按完成顺序写回，客户端通过 request_id 匹配
+- 流式请求（stream=True）每识别完一页就写回一个 FRAME_PARTIAL 帧
+- 多页文档的调度线程在整个文档识别期间一直占用，使用单独的线程池，
+  不会占满默认线程池、阻塞其他请求的缓存查询和预处理
+- 收到 shutdown 请求或 SIGTERM 后停止接受新连接，在事件循环内等待进行中的请求写回响应
+  （最多 drain_timeout 秒），之后再关闭空闲连接、退出事件循环
+
+使用方法：
+    python ocr_server.py --async
+"""
+
+import signal
+import asyncio
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any
+
+from document_pages import is_multipage_format
+from ocr_protocol import (read_message_async, write_message_async, ProtocolError,
+                          FRAME_RESPONSE, FRAME_ERROR, FRAME_PARTIAL)
+
+
+class AsyncFrontend:
+    """PPOCRServer 的 asyncio 网络前端"""
+
+    def __init__(self, server, backlog=1024):
+        self.server = server
+        self.backlog = backlog
+        self.connections = 0
+        self._loop = None
+        self._handlers = set()  # 连接处理任务
+        self._requests = set()  # 所有连接上尚未写回响应的请求任务
+        self._document_executor = None  # 多页文档调度线程池
+
+    def run(self):
+        """启动事件循环，直到服务被关闭"""
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        """监听端口并处理连接"""
+        self._loop = asyncio.get_running_loop()
+        self.server.start_inference_workers()
+        # 同时在途的文档数超过 推理工作者数 + 队列长度 时，多出的文档也只能等待队列空位
+        self._document_executor = ThreadPoolExecutor(
+            max_workers=self.server.num_workers + self.server.job_queue.maxsize,
+            thread_name_prefix='document'
+        )
+
+        listener = await asyncio.start_server(
+            self.handle_connection, self.server.host, self.server.port,
+            backlog=self.backlog, reuse_address=True
+        )
+
+        self.server.running = True
+        print(f"\n🚀 PPOCR 服务已启动 (asyncio 前端)")
+        print(f"   把需要批处理的图片文件放到 OCR_Flies 目录下")
+        print(f"   然后双击 batch_ocr_client_run.bat - 批量处理")
+        print(f"   监听地址: {self.server.host}:{self.server.port}")
+        print(f"   等待客户端连接...")
+        print(f"   按 Ctrl+C 停止服务\n")
+
+        try:
+            # 在事件循环中处理 SIGTERM，关闭前可以继续写回响应
+            self._loop.add_signal_handler(signal.SIGTERM, self._request_stop)
+        except (NotImplementedError, AttributeError, RuntimeError):
+            pass  # Windows 上退回 PPOCRServer 的信号处理
+
+        # 收到 shutdown 请求或终止信号后 running 会被置为 False
+        while self.server.running:
+            await asyncio.sleep(0.5)
+
+        listener.close()
+        await self.drain(self.server.drain_timeout)
+        self._document_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _request_stop(self):
+        print("\n收到终止信号，正在优雅关闭服务...")
+        self.server.running = False
+
+    async def drain(self, timeout: float):
+        """等待进行中的请求写回响应（最多 timeout 秒），然后关闭所有连接"""
+        pending = set(self._requests)
+        if pending and timeout > 0:
+            print(f"⏳ 等待 {len(pending)} 个进行中的请求完成（最多 {timeout:.0f} 秒）...")
+            _, pending = await asyncio.wait(pending, timeout=timeout)
+            if pending:
+                print("⚠ 等待超时，取消剩余请求")
+        # 空闲连接阻塞在读取下一个请求上，直接取消
+        remaining = list(pending) + list(self._handlers)
+        for task in remaining:
+            task.cancel()
+        await asyncio.gather(*remaining, return_exceptions=True)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理一个客户端连接"""
+        self.connections += 1
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        async def send_partial(partial: Dict[str, Any], request_id, codec: int):
+            async with write_lock:
+                await write_message_async(writer, dict(partial, request_id=request_id),
+                                          FRAME_PARTIAL, codec=codec)
+
+        async def respond(request: Dict[str, Any], codec: int):
+            if request.get('type') == 'ocr' and request.get('stream'):
+                try:
+                    response = await self.submit_ocr_job(
+                        request, lambda partial: send_partial(partial, request.get('request_id'), codec)
+                    )
+                except ConnectionError:
+                    raise  # 客户端已断开，无法再写回响应
+                except Exception as e:
+                    response = {
+                        'success': False,
+                        'error': f'请求处理失败: {e}',
+                        'details': traceback.format_exc()
+                    }
+            else:
+                response = await self.process_request(request)
+            if 'request_id' in request:
+                response['request_id'] = request['request_id']
+            blob = response.pop('blob', b'')
+            async with write_lock:
+                await write_message_async(writer, response, FRAME_RESPONSE, blob=blob, codec=codec)
+
+        try:
+            while self.server.running:
+                try:
+                    frame = await read_message_async(reader)
+                except ValueError as e:
+                    # payload 解码失败，整帧已读取，连接仍然可用
+                    async with write_lock:
+                        await write_message_async(
+                            writer, {'success': False, 'error': f'JSON解析错误: {e}'}, FRAME_ERROR
+                        )
+                    continue
+
+                if frame is None:
+                    break
+
+                request = frame.message
+                if frame.blob:
+                    # 内联上传的图片字节
+                    request['image_bytes'] = frame.blob
+                task = asyncio.ensure_future(respond(request, frame.codec))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                self._requests.add(task)
+                task.add_done_callback(self._requests.discard)
+
+            # 等待本连接上尚未完成的请求写回响应
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        except ProtocolError as e:
+            print(f"❌ 协议错误: {e}")
+            try:
+                async with write_lock:
+                    await write_message_async(writer, {'success': False, 'error': f'协议错误: {e}'},
+                                              FRAME_ERROR)
+            except OSError:
+                pass
+        except (ConnectionError, OSError):
+            pass
+        except asyncio.CancelledError:
+            pass  # 服务关闭时事件循环取消所有连接，直接结束即可
+        except Exception as e:
+            print(f"❌ 客户端处理错误: {e}")
+        finally:
+            self.connections -= 1
+            self._handlers.discard(handler)
+            writer.close()
+
+    async def process_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """按请求类型分发：OCR 入队等待，状态查询直接返回，其他请求交给线程池"""
+        request_type = request.get('type')
+
+        try:
+            if request_type == 'ocr':
+                return await self.submit_ocr_job(request)
+            elif request_type == 'status':
+                response = self.server.handle_status_request()
+                response['connections'] = self.connections
+                return response
+            elif request_type == 'metrics':
+                return {'success': True, 'text': self.server.metrics_text()}
+            else:
+                return await self._loop.run_in_executor(None, self.server.process_request, request)
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f'请求处理失败: {e}',
+                'details': traceback.format_exc()
+            }
+
+    async def submit_ocr_job(self, request: Dict[str, Any], send_partial=None) -> Dict[str, Any]:
+        """
+        OCR 请求入队后挂起协程，直到推理工作线程完成；结果缓存命中时直接返回
+
+        参数:
+            send_partial: 流式请求的中间结果发送协程函数 send_partial(partial)
+        """
+        invalid = self.server.validate_ocr_request(request)
+        if invalid is not None:
+            return invalid
+
+        # 计算图片哈希需要读文件，放到线程池中避免阻塞事件循环
+        cache_key, cached = await self._loop.run_in_executor(
+            None, self.server.lookup_cached_result, request
+        )
+        if cached is not None:
+            return cached
+
+        if is_multipage_format(self.server.display_name(request)):
+            # 多页文档由文档线程池中的线程拆页调度；中间结果在事件循环中按顺序写出
+            def on_partial(partial):
+                asyncio.run_coroutine_threadsafe(send_partial(partial), self._loop).result()
+
+            response = await self._loop.run_in_executor(
+                self._document_executor, self.server.run_document, request, cache_key,
+                on_partial if send_partial is not None else None
+            )
+            if response is not None:
+                return response
+
+        # 预处理在预处理线程池中进行，这里只在默认线程池中等待它完成
+        duplicate = await self._loop.run_in_executor(None, self.server.preprocess_request, request)
+        if duplicate is not None:
+            return duplicate
+
+        # 工作线程中产生的中间结果按顺序转交给事件循环，任务结束时放入 None
+        partials = asyncio.Queue() if send_partial is not None else None
+
+        def on_partial(partial):
+            self._loop.call_soon_threadsafe(partials.put_nowait, partial)
+
+        job = self.server.enqueue_ocr_job(request, cache_key,
+                                          on_partial if partials is not None else None)
+        if job is None:
+            return self.server.busy_response()
+
+        future = self._loop.create_future()
+
+        def on_done(job):
+            try:
+                if partials is not None:
+                    self._loop.call_soon_threadsafe(partials.put_nowait, None)
+                self._loop.call_soon_threadsafe(_set_future_result, future, job)
+            except RuntimeError:
+                pass  # 等待超时后事件循环已关闭，请求已被取消
+
+        job.add_done_callback(on_done)
+        if partials is not None:
+            while (partial := await partials.get()) is not None:
+                await send_partial(partial)
+        await future
+        return job.response()
+
+
+def _set_future_result(future, value):
+    if not future.done():
+        future.set_result(value)
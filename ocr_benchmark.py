@@ -0,0 +1,429 @@
+"""
+OCR 服务压测与延迟基准
+用 PPOCRClient 回放一组图片，统计延迟分位数（p50/p95/p99）、吞吐量和错误率，写入 JSON 报告
+
+两种负载模式：
+- 固定并发（--concurrency N，默认）：闭环，始终保持 N 个请求在途，一个完成立即提交下一个
+- 固定到达率（--rate R）：开环，每秒按固定间隔提交 R 个请求，不等待之前的请求完成；
+  延迟从计划发送时刻算起，客户端来不及发送造成的滞后也计入延迟（避免协调遗漏）
+
+桩模式（--stub）：
+    在本进程中启动服务端，把 PaddleOCRVL 换成耗时固定的假 pipeline，不需要模型文件，
+    几秒内即可测出网络、排队和结果序列化路径的开销；没有指定图片时自动生成合成图片
+
+使用方法：
+    # 对已运行的服务回放 OCR_Flies 中的图片（建议服务端以 --no-cache 启动，避免命中结果缓存）
+    python ocr_benchmark.py --input OCR_Flies --concurrency 4 --requests 40
+
+    # 桩模式：4 个推理工作线程，每张 0.2 秒，以每秒 15 个请求持续 20 秒
+    python ocr_benchmark.py --stub --stub-delay 0.2 --workers 4 --rate 15 --duration 20
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import socket
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from ocr_client import PPOCRClient
+from batch_ocr_client import get_image_files
+
+
+class StubResult:
+    """假 pipeline 的单页结果，接口与 PaddleOCRVL 的结果对象一致"""
+
+    def __init__(self, source: str, page_index: int, num_blocks: int):
+        self.source = source
+        self.page_index = page_index
+        self.num_blocks = num_blocks
+
+    @property
+    def json(self) -> Dict[str, Any]:
+        blocks = [{
+            'block_label': 'text',
+            'block_content': f'{self.source} 第 {self.page_index + 1} 页 第 {i + 1} 段',
+            'block_bbox': [0, i * 40, 800, i * 40 + 32]
+        } for i in range(self.num_blocks)]
+        return {'res': {'input_path': self.source, 'page_index': self.page_index,
+                        'parsing_res_list': blocks}}
+
+    def save_to_json(self, save_path: str):
+        if not save_path.endswith('.json'):
+            save_path = os.path.join(save_path, 'result.json')
+        with open(save_path, 'w', encoding='utf-8') as f:
+            json.dump(self.json, f, ensure_ascii=False, indent=2)
+
+    def save_to_markdown(self, save_path: str):
+        if not save_path.endswith('.md'):
+            save_path = os.path.join(save_path, 'result.md')
+        with open(save_path, 'w', encoding='utf-8') as f:
+            f.write('\n\n'.join(block['block_content']
+                                for block in self.json['res']['parsing_res_list']) + '\n')
+
+
+class StubPipeline:
+    """确定性的假 PaddleOCRVL：每页固定耗时 delay 秒，结果只取决于输入"""
+
+    def __init__(self, delay: float = 0.1, pages: int = 1, num_blocks: int = 20):
+        self.delay = delay
+        self.pages = pages
+        self.num_blocks = num_blocks
+
+    def predict_iter(self, image_input, **kwargs):
+        source = image_input if isinstance(image_input, str) else 'array-%s' % (
+            'x'.join(str(n) for n in getattr(image_input, 'shape', ())))
+        for page_index in range(self.pages):
+            time.sleep(self.delay)
+            yield StubResult(source, page_index, self.num_blocks)
+
+    def predict(self, image_input, **kwargs):
+        return list(self.predict_iter(image_input, **kwargs))
+
+
+def install_stub_pipeline(delay: float, pages: int = 1):
+    """
+    用假 pipeline 替换 paddleocr 模块，必须在导入 ocr_server 之前调用
+
+    ocr_server 在导入时仍会应用 safetensors 补丁，因此 paddle 和 safetensors 需要可以导入，
+    但不需要 PaddleOCR 和模型文件
+    """
+    if 'ocr_server' in sys.modules:
+        raise RuntimeError('install_stub_pipeline 必须在导入 ocr_server 之前调用')
+    module = types.ModuleType('paddleocr')
+    module.__version__ = 'stub'
+    module.PaddleOCRVL = lambda *args, **kwargs: StubPipeline(delay, pages)
+    sys.modules['paddleocr'] = module
+
+
+def make_synthetic_corpus(folder: str, count: int = 8, size=(1240, 1754)) -> List[str]:
+    """生成 count 张合成图片（A4 150 DPI 大小的灰色条纹），返回路径列表"""
+    from PIL import Image, ImageDraw
+
+    paths = []
+    for i in range(count):
+        image = Image.new('RGB', size, 'white')
+        draw = ImageDraw.Draw(image)
+        for y in range(80 + i * 7, size[1] - 80, 48):
+            draw.rectangle([100, y, size[0] - 100 - (y * 13 + i * 31) % 400, y + 20], fill=(60, 60, 60))
+        path = os.path.join(folder, f'synthetic_{i:03d}.png')
+        image.save(path)
+        paths.append(path)
+    return paths
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_stub_server(port: int, workers: int, queue_size: int, processes: int = 0,
+                      use_async: bool = False):
+    """在后台线程中启动使用假 pipeline 的服务端（禁用结果缓存和预处理）"""
+    import ocr_server
+    from startup_profiler import profiler
+
+    server = ocr_server.PPOCRServer('127.0.0.1', port, workers, queue_size, processes, cache_dir=None)
+    initialized = server.initialize_model()
+    profiler.stop()
+    if not initialized:
+        raise RuntimeError('假 pipeline 初始化失败')
+    server.start_process_pool()
+
+    if use_async:
+        from ocr_async_server import AsyncFrontend
+        target = AsyncFrontend(server).run
+    else:
+        target = server.start_server
+    threading.Thread(target=target, name='stub-server', daemon=True).start()
+
+    deadline = time.time() + 10
+    while not server.running and time.time() < deadline:
+        time.sleep(0.05)
+    return server
+
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    """线性插值分位数，p 取 0-100"""
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * p / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+def summarize(values: List[float]) -> Optional[Dict[str, float]]:
+    """延迟分布摘要（秒）"""
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        'min': round(values[0], 4),
+        'mean': round(sum(values) / len(values), 4),
+        'p50': round(percentile(values, 50), 4),
+        'p95': round(percentile(values, 95), 4),
+        'p99': round(percentile(values, 99), 4),
+        'max': round(values[-1], 4)
+    }
+
+
+class Benchmark:
+    """回放图片并记录每个请求的结果"""
+
+    def __init__(self, client: PPOCRClient, corpus: List[str], output_dir: str, upload: bool = False):
+        self.client = client
+        self.corpus = corpus
+        self.output_dir = output_dir
+        self.upload = upload
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def run_one(self, index: int, scheduled_at: Optional[float] = None):
+        """发送第 index 个请求（按顺序循环使用图片）；scheduled_at 为开环模式的计划发送时刻"""
+        image_path = self.corpus[index % len(self.corpus)]
+        started_at = time.time()
+        try:
+            response = self.client.submit_ocr(image_path, self.output_dir, upload=self.upload)
+        except Exception as e:
+            response = {'success': False, 'error': f'客户端异常: {e}'}
+        finished_at = time.time()
+
+        if response is None:
+            response = {'success': False, 'error': '无法连接服务器'}
+        sample = {
+            'index': index,
+            'image': os.path.basename(image_path),
+            'success': bool(response.get('success')),
+            'latency': finished_at - (scheduled_at if scheduled_at is not None else started_at),
+            'send_lag': started_at - scheduled_at if scheduled_at is not None else 0.0,
+            'busy_wait': response.get('busy_wait', 0.0),
+            'queue_wait': response.get('queue_wait'),
+            'processing_time': response.get('processing_time'),
+            'cached': bool(response.get('cached') or response.get('duplicate')),
+            'error': None if response.get('success') else str(response.get('error', '未知错误'))
+        }
+        with self._lock:
+            self.samples.append(sample)
+
+    def run_closed_loop(self, concurrency: int, total: Optional[int], duration: Optional[float]):
+        """固定并发：concurrency 个线程各自连续发送请求"""
+        counter = iter(range(sys.maxsize))
+        counter_lock = threading.Lock()
+        deadline = time.time() + duration if duration else None
+
+        def next_index():
+            with counter_lock:
+                index = next(counter)
+            if total is not None and index >= total:
+                return None
+            if deadline is not None and time.time() >= deadline:
+                return None
+            return index
+
+        def loop():
+            while (index := next_index()) is not None:
+                self.run_one(index)
+
+        threads = [threading.Thread(target=loop, name=f'bench-{i}') for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_open_loop(self, rate: float, total: int, max_in_flight: int):
+        """固定到达率：按 1/rate 的间隔发送 total 个请求，最多 max_in_flight 个请求同时在途"""
+        interval = 1.0 / rate
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='bench') as executor:
+            for index in range(total):
+                scheduled_at = start_time + index * interval
+                delay = scheduled_at - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self.run_one, index, scheduled_at)
+
+    def report(self, config: Dict[str, Any], wall_time: float,
+               server_status: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """汇总为 JSON 报告"""
+        samples = sorted(self.samples, key=lambda sample: sample['index'])
+        succeeded = [sample for sample in samples if sample['success']]
+        errors = Counter(sample['error'] for sample in samples if not sample['success'])
+
+        def values(key):
+            return [sample[key] for sample in succeeded if sample.get(key) is not None]
+
+        report = {
+            'started_at': config.pop('started_at'),
+            'config': config,
+            'wall_time': round(wall_time, 3),
+            'requests': {
+                'total': len(samples),
+                'success': len(succeeded),
+                'failed': len(samples) - len(succeeded),
+                'busy_retried': sum(1 for sample in samples if sample['busy_wait']),
+                'cached': sum(1 for sample in samples if sample['cached'])
+            },
+            'error_rate': round((len(samples) - len(succeeded)) / len(samples), 4) if samples else 0.0,
+            'throughput': round(len(succeeded) / wall_time, 3) if wall_time > 0 else 0.0,
+            'latency': summarize(values('latency')),
+            'queue_wait': summarize(values('queue_wait')),
+            'processing_time': summarize(values('processing_time')),
+            'send_lag': summarize(values('send_lag')) if config['mode'] == 'rate' else None,
+            'errors': dict(errors.most_common(10)),
+            'samples': samples
+        }
+        if server_status is not None:
+            report['server_metrics'] = server_status.get('metrics')
+        return report
+
+
+def print_report(report: Dict[str, Any]):
+    config = report['config']
+    requests = report['requests']
+    print("\n" + "=" * 60)
+    print("📊 基准测试结果")
+    print("=" * 60)
+    if config['mode'] == 'rate':
+        print(f"负载: 每秒 {config['rate']} 个请求（开环）")
+    else:
+        print(f"负载: {config['concurrency']} 个并发请求（闭环）")
+    print(f"请求: {requests['total']}，成功 {requests['success']}，失败 {requests['failed']}"
+          f"，错误率 {report['error_rate'] * 100:.1f}%")
+    print(f"吞吐量: {report['throughput']:.2f} 张/秒（总耗时 {report['wall_time']:.1f} 秒）")
+    for name, label in [('latency', '端到端延迟'), ('queue_wait', '服务端排队'),
+                        ('processing_time', '服务端处理'), ('send_lag', '发送滞后')]:
+        summary = report.get(name)
+        if summary:
+            print(f"{label}: p50 {summary['p50']:.3f}s  p95 {summary['p95']:.3f}s  "
+                  f"p99 {summary['p99']:.3f}s  max {summary['max']:.3f}s")
+    if requests['busy_retried']:
+        print(f"⏳ {requests['busy_retried']} 个请求因服务器繁忙重试过")
+    if requests['cached']:
+        print(f"⚠ {requests['cached']} 个请求命中了服务端结果缓存，建议以 --no-cache 启动服务端")
+    for error, count in report['errors'].items():
+        print(f"❌ {count} 次: {error}")
+    print("=" * 60)
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='OCR 服务压测与延迟基准')
+    parser.add_argument('--input', default='OCR_Flies', help='回放的图片目录')
+    parser.add_argument('--output', default=None, help='识别结果目录（默认使用临时目录，结束后删除）')
+    parser.add_argument('--host', default='localhost', help='服务器地址')
+    parser.add_argument('--port', type=int, default=8888, help='服务器端口')
+    parser.add_argument('--concurrency', type=int, default=4, help='固定并发模式下同时在途的请求数')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='固定到达率模式：每秒发送的请求数（>0 时启用，忽略 --concurrency）')
+    parser.add_argument('--max-in-flight', type=int, default=64, help='固定到达率模式下最多同时在途的请求数')
+    parser.add_argument('--requests', type=int, default=None, help='发送的请求总数（默认为图片数）')
+    parser.add_argument('--duration', type=float, default=None, help='持续发送的秒数（与 --requests 二选一）')
+    parser.add_argument('--upload', action='store_true', help='以内联上传方式发送图片')
+    parser.add_argument('--report', default='benchmark_report.json', help='JSON 报告路径')
+    parser.add_argument('--stub', action='store_true',
+                        help='在本进程中启动使用假 pipeline 的服务端（不需要模型文件）')
+    parser.add_argument('--stub-delay', type=float, default=0.1, help='桩模式：每页推理耗时（秒）')
+    parser.add_argument('--stub-pages', type=int, default=1, help='桩模式：每张图片的页数')
+    parser.add_argument('--workers', type=int, default=1, help='桩模式：推理工作线程数')
+    parser.add_argument('--queue-size', type=int, default=16, help='桩模式：等待队列容量')
+    parser.add_argument('--processes', type=int, default=0, help='桩模式：推理进程数')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='桩模式：使用 asyncio 前端')
+    args = parser.parse_args()
+
+    if args.requests is not None and args.duration is not None:
+        parser.error('--requests 和 --duration 只能指定一个')
+
+    temp_dirs = []
+    server = None
+    host, port = args.host, args.port
+
+    corpus = get_image_files(args.input) if os.path.isdir(args.input) else []
+    if args.stub:
+        install_stub_pipeline(args.stub_delay, args.stub_pages)
+        if not corpus:
+            corpus_dir = tempfile.mkdtemp(prefix='ocr-bench-corpus-')
+            temp_dirs.append(corpus_dir)
+            corpus = make_synthetic_corpus(corpus_dir)
+            print(f"🖼 已生成 {len(corpus)} 张合成图片")
+        host, port = '127.0.0.1', free_port()
+        server = start_stub_server(port, args.workers, args.queue_size, args.processes, args.use_async)
+    if not corpus:
+        print(f"❌ 在 {args.input} 中没有找到图片")
+        sys.exit(1)
+
+    output_dir = args.output
+    if output_dir is None:
+        output_dir = tempfile.mkdtemp(prefix='ocr-bench-output-')
+        temp_dirs.append(output_dir)
+
+    total = args.requests
+    if total is None and args.duration is None:
+        total = len(corpus)
+    mode = 'rate' if args.rate > 0 else 'concurrency'
+    if mode == 'rate' and total is None:
+        total = int(args.duration * args.rate)
+    in_flight = args.max_in_flight if mode == 'rate' else args.concurrency
+
+    client = PPOCRClient(host, port, pool_size=in_flight)
+    status = client.get_server_status()
+    if not status or not status.get('model_loaded'):
+        print(f"❌ 服务器 {host}:{port} 未运行或模型未加载")
+        sys.exit(1)
+
+    config = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'mode': mode,
+        'concurrency': args.concurrency if mode == 'concurrency' else None,
+        'rate': args.rate if mode == 'rate' else None,
+        'max_in_flight': args.max_in_flight if mode == 'rate' else None,
+        'requests': total,
+        'duration': args.duration,
+        'upload': args.upload,
+        'corpus_size': len(corpus),
+        'server': f'{host}:{port}',
+        'server_workers': status.get('workers'),
+        'stub': {'delay': args.stub_delay, 'pages': args.stub_pages, 'processes': args.processes,
+                 'async': args.use_async} if args.stub else None
+    }
+
+    load = f"每秒 {args.rate} 个请求" if mode == 'rate' else f"{args.concurrency} 个并发"
+    amount = f"{total} 个请求" if total is not None else f"{args.duration:.0f} 秒"
+    print(f"🚀 开始基准测试: {load}，{amount}，{len(corpus)} 张图片循环使用")
+
+    benchmark = Benchmark(client, corpus, output_dir, upload=args.upload)
+    start_time = time.time()
+    try:
+        if mode == 'rate':
+            benchmark.run_open_loop(args.rate, total, args.max_in_flight)
+        else:
+            benchmark.run_closed_loop(args.concurrency, total, args.duration)
+    except KeyboardInterrupt:
+        print("\n⚠ 已中断，仅统计已完成的请求")
+    wall_time = time.time() - start_time
+
+    report = benchmark.report(config, wall_time, client.get_server_status())
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_report(report)
+    print(f"📝 报告已保存: {args.report}")
+
+    client.close()
+    if server is not None:
+        server.stop()
+    for folder in temp_dirs:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,51 +3,258 @@ PaddleOCRVL 客户端
 用于与持久化OCR服务器交互
 """
 
-import json
 import socket
 import time
 import os
 import sys
-from typing import Dict, Any, Optional
+import itertools
+import threading
+from typing import Dict, Any, List, Optional
+from ocr_protocol import (recv_message, send_message, ProtocolError,
+                          FRAME_REQUEST, FRAME_PARTIAL, CODEC_JSON)
+
+
+# 可以安全重发的请求类型：不写结果文件、不触发推理，服务器执行两次也没有副作用
+IDEMPOTENT_REQUESTS = ('status', 'metrics')
+
+
+def save_inline_results(response: Dict[str, Any], image_path: str, output_dir: str) -> str:
+    """
+    把上传请求随响应返回的结果文件写到 output_dir/图片名 下
+
+    写入后 response 中的 save_path、json_path、md_path 改为本地路径，与共享文件系统模式一致
+
+    返回:
+        str: 本地结果目录
+    """
+    save_path = os.path.join(output_dir, os.path.splitext(os.path.basename(image_path))[0])
+    blob = memoryview(response.pop('blob', b''))
+    offset = 0
+    for entry in response.get('files', []):
+        # 防止恶意路径写到结果目录之外
+        relative = os.path.normpath(entry['path'])
+        if os.path.isabs(relative) or relative == '..' or relative.startswith('..' + os.sep):
+            raise ValueError(f"非法的结果文件路径: {entry['path']}")
+        file_path = os.path.join(save_path, relative)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'wb') as f:
+            f.write(blob[offset:offset + entry['size']])
+        offset += entry['size']
+
+    for page in response.get('results', []):
+        page['json_path'] = os.path.join(save_path, page['json_path'])
+        page['md_path'] = os.path.join(save_path, page['md_path'])
+    for key, value in response.items():
+        if key.endswith('_path'):
+            response[key] = os.path.join(save_path, value)
+    response['save_path'] = save_path
+    return save_path
 
 
 class PPOCRClient:
     """PaddleOCRVL 客户端"""
 
-    def __init__(self, host='localhost', port=8888):
+    def __init__(self, host='localhost', port=8888, codec=CODEC_JSON, pool_size=4):
         self.host = host
         self.port = port
         self.timeout = 1800  # 30分钟超时
+        self.codec = codec  # 请求编码：CODEC_JSON 或 CODEC_MSGPACK
 
-    def _send_request(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        """发送请求到服务器"""
+        # 持久连接池：请求结束后连接放回池中复用，避免每次请求都重新建立连接
+        self.pool_size = pool_size
+        self._idle_sockets = []
+        self._pool_lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def close(self):
+        """关闭连接池中的所有空闲连接"""
+        with self._pool_lock:
+            sockets, self._idle_sockets = self._idle_sockets, []
+        for sock in sockets:
+            sock.close()
+
+    def _connect(self) -> socket.socket:
+        """建立一个新连接"""
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _is_reusable(self, sock: socket.socket) -> bool:
+        """空闲连接是否仍可使用：服务器关闭连接后 socket 可读并读到 EOF（或错误）"""
         try:
-            # 创建socket连接
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.setblocking(False)
+            try:
+                sock.recv(1, socket.MSG_PEEK)
+            finally:
                 sock.settimeout(self.timeout)
-                sock.connect((self.host, self.port))
+        except BlockingIOError:
+            return True  # 没有可读数据，连接正常
+        except OSError:
+            return False
+        # 读到 EOF，或收到了不属于任何请求的数据，都不能再复用
+        return False
+
+    def _acquire(self):
+        """从连接池取出一个连接（跳过已被服务器关闭的连接），返回 (sock, 是否为复用的连接)"""
+        while True:
+            with self._pool_lock:
+                if not self._idle_sockets:
+                    break
+                sock = self._idle_sockets.pop()
+            if self._is_reusable(sock):
+                return sock, True
+            sock.close()
+        return self._connect(), False
+
+    def _release(self, sock: socket.socket):
+        """连接放回池中，池已满时直接关闭"""
+        with self._pool_lock:
+            if len(self._idle_sockets) < self.pool_size:
+                self._idle_sockets.append(sock)
+                return
+        sock.close()
 
-                # 发送请求
-                request_data = json.dumps(request, ensure_ascii=False).encode('utf-8')
-                sock.send(request_data)
+    def _tag(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """为请求分配 request_id，服务器会在响应中原样带回"""
+        return dict(request, request_id=next(self._request_ids))
+
+    def _exchange(self, request: Dict[str, Any], blob: bytes = b'',
+                  on_partial=None) -> Optional[Dict[str, Any]]:
+        """
+        在池中的连接上完成一次请求/响应
+
+        复用的连接断开时，只有请求还没有完整发出（服务器不可能开始处理），
+        或者请求本身可以安全重发（status / metrics）时才换新连接重试一次；
+        OCR 请求可能已经在服务器上识别并写了结果文件，不会重发
+
+        blob 作为帧附件随请求发送；响应帧带有附件时放在返回字典的 'blob' 中。
+        最终响应之前收到的中间结果帧依次交给 on_partial
+        """
+        request = self._tag(request)
+        idempotent = request.get('type') in IDEMPOTENT_REQUESTS
+        while True:
+            sock, reused = self._acquire()
+            sent = False
+            try:
+                send_message(sock, request, FRAME_REQUEST, blob=blob, codec=self.codec)
+                sent = True
+                frame = recv_message(sock)
+                while frame is not None and frame.frame_type == FRAME_PARTIAL:
+                    reused = False  # 已收到数据，连接中途断开时不能再重发请求
+                    if on_partial is not None:
+                        on_partial(frame.message)
+                    frame = recv_message(sock)
+            except ConnectionError:
+                sock.close()
+                if reused and (not sent or idempotent):
+                    continue
+                raise
+            except BaseException:
+                sock.close()
+                raise
 
-                # 接收响应
-                response_data = sock.recv(8192 * 10)  # 增大缓冲区
-                if not response_data:
-                    return None
+            if frame is None:
+                sock.close()
+                if reused and idempotent:
+                    continue
+                return None
 
-                return json.loads(response_data.decode('utf-8'))
+            self._release(sock)
+            if frame.blob:
+                frame.message['blob'] = frame.blob
+            return frame.message
+
+    def _send_request(self, request: Dict[str, Any], blob: bytes = b'',
+                      on_partial=None) -> Optional[Dict[str, Any]]:
+        """发送请求到服务器"""
+        try:
+            return self._exchange(request, blob, on_partial)
 
         except socket.error as e:
             print(f"❌ 连接错误: {e}")
             return None
-        except json.JSONDecodeError as e:
+        except ProtocolError as e:
+            print(f"❌ 协议错误: {e}")
+            return None
+        except ValueError as e:
             print(f"❌ 响应解析错误: {e}")
             return None
         except Exception as e:
             print(f"❌ 请求失败: {e}")
             return None
 
+    def _pipeline_on(self, sock: socket.socket, requests: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+        """在一个连接上连续写出所有请求，同时读取响应，按 request_id 归档"""
+        def sender():
+            try:
+                for request in requests:
+                    send_message(sock, request, FRAME_REQUEST, codec=self.codec)
+            except OSError:
+                pass  # 连接异常由读取端发现
+
+        # 单独的线程负责写，避免请求较大时双方发送缓冲区都被填满而互相等待
+        send_thread = threading.Thread(target=sender, daemon=True)
+        send_thread.start()
+
+        responses = {}
+        try:
+            while len(responses) < len(requests):
+                frame = recv_message(sock)
+                if frame is None:
+                    break
+                if frame.frame_type == FRAME_PARTIAL:
+                    continue
+                responses[frame.message.get('request_id')] = frame.message
+        finally:
+            send_thread.join(timeout=1)
+        return responses
+
+    def send_pipelined(self, requests: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """
+        在同一个连接上流水线发送多个请求
+
+        参数:
+            requests: 请求列表
+
+        返回:
+            list: 与 requests 顺序一致的响应列表，没有收到响应的位置为 None
+        """
+        if not requests:
+            return []
+
+        tagged = [self._tag(request) for request in requests]
+        sock = None
+        responses = {}
+        try:
+            sock, reused = self._acquire()
+            try:
+                responses = self._pipeline_on(sock, tagged)
+            except ConnectionError:
+                if not reused:
+                    raise
+            if not responses and reused and all(r.get('type') in IDEMPOTENT_REQUESTS for r in tagged):
+                # 复用的连接已被服务器关闭，换一个新连接重试（只重发没有副作用的请求）
+                sock.close()
+                sock = self._connect()
+                responses = self._pipeline_on(sock, tagged)
+        except (socket.error, ProtocolError, ValueError) as e:
+            print(f"❌ 流水线请求失败: {e}")
+
+        if sock is not None:
+            if len(responses) == len(tagged):
+                self._release(sock)
+            else:
+                sock.close()
+
+        return [responses.get(request['request_id']) for request in tagged]
+
     def is_server_running(self) -> bool:
         """检查服务器是否运行"""
         response = self._send_request({'type': 'status'})
@@ -58,7 +265,62 @@ class PPOCRClient:
         response = self._send_request({'type': 'status'})
         return response if response and response.get('success') else None
 
-    def ocr_image(self, image_path: str, output_dir: str = 'output', print_result: bool = True) -> bool:
+    def get_metrics(self) -> Optional[str]:
+        """获取 Prometheus 文本格式的服务端指标"""
+        response = self._send_request({'type': 'metrics'})
+        return response['text'] if response and response.get('success') else None
+
+    def submit_ocr(self, image_path: str, output_dir: str = 'output',
+                   verbose: bool = False, upload: bool = False, on_partial=None) -> Optional[Dict[str, Any]]:
+        """
+        提交一张图片并等待结果，服务器繁忙时按建议的时间等待后重试
+
+        参数:
+            upload: 把图片字节随请求发送，结果随响应返回并保存到本地 output_dir，
+                    客户端与服务器无需共享文件系统
+            on_partial: 传入时以流式模式提交，每识别完一页调用 on_partial(partial)，
+                        partial 包含 page_idx、elapsed、markdown、blocks 以及该页的结果文件路径
+
+        返回:
+            dict: 服务器响应，额外附带客户端侧计时 round_trip（不含繁忙等待）和 busy_wait；
+                  无法连接时返回 None
+        """
+        if upload:
+            request = {'type': 'ocr', 'image_name': os.path.basename(image_path)}
+            with open(image_path, 'rb') as f:
+                blob = f.read()
+        else:
+            request = {
+                'type': 'ocr',
+                'image_path': os.path.abspath(image_path),
+                'output_dir': output_dir
+            }
+            blob = b''
+        if on_partial is not None:
+            request['stream'] = True
+
+        busy_wait = 0.0
+        start_time = time.time()
+        response = self._send_request(request, blob, on_partial)
+        while response and response.get('busy'):
+            # 服务器队列已满，按建议的时间等待后重试
+            retry_after = response.get('retry_after', 30)
+            if verbose:
+                print(f"⏳ 服务器繁忙，{retry_after:.0f} 秒后重试...")
+            time.sleep(retry_after)
+            busy_wait += retry_after
+            response = self._send_request(request, blob, on_partial)
+
+        if upload and response and response.get('success'):
+            save_inline_results(response, image_path, output_dir)
+
+        if response is not None:
+            response['round_trip'] = time.time() - start_time - busy_wait
+            response['busy_wait'] = busy_wait
+        return response
+
+    def ocr_image(self, image_path: str, output_dir: str = 'output', print_result: bool = True,
+                  upload: bool = False, stream: bool = False) -> bool:
         """
         对单个图片进行OCR识别
 
@@ -66,6 +328,8 @@ class PPOCRClient:
             image_path: 图片路径
             output_dir: 结果保存目录
             print_result: 是否打印结果
+            upload: 是否把图片内容上传到服务器（见 submit_ocr）
+            stream: 是否逐页接收中间结果，每识别完一页立即打印
 
         返回:
             bool: 是否成功
@@ -78,14 +342,14 @@ class PPOCRClient:
         if print_result:
             print(f"\n🔍 发送OCR请求: {os.path.basename(image_path)}")
 
-        request = {
-            'type': 'ocr',
-            'image_path': os.path.abspath(image_path),
-            'output_dir': output_dir
-        }
+        def on_partial(partial):
+            if print_result:
+                print(f"📄 第 {partial['page_idx']} 页完成 ({partial['elapsed']:.1f}s, "
+                      f"{len(partial.get('blocks', []))} 个版面块)")
 
         start_time = time.time()
-        response = self._send_request(request)
+        response = self.submit_ocr(image_path, output_dir, verbose=print_result, upload=upload,
+                                   on_partial=on_partial if stream else None)
         end_time = time.time()
 
         if not response:
@@ -108,6 +372,67 @@ class PPOCRClient:
                 print(f"❌ OCR识别失败: {response.get('error')}")
             return False
 
+    def ocr_images(self, image_paths: List[str], output_dir: str = 'output') -> List[Optional[Dict[str, Any]]]:
+        """
+        在一个连接上流水线提交多张图片
+
+        参数:
+            image_paths: 图片路径列表
+            output_dir: 结果保存目录
+
+        返回:
+            list: 与 image_paths 顺序一致的服务器响应，失败的位置为 None
+        """
+        requests = [{
+            'type': 'ocr',
+            'image_path': os.path.abspath(image_path),
+            'output_dir': output_dir
+        } for image_path in image_paths]
+        return self.send_pipelined(requests)
+
+    def reload_model(self, wait: bool = True, poll_interval: float = 2.0) -> bool:
+        """
+        让服务端在不中断服务的情况下重新加载模型（例如运行 convert_models_once.py 之后）
+
+        参数:
+            wait: 是否等待重新加载完成
+            poll_interval: 等待时查询状态的间隔（秒）
+
+        返回:
+            bool: 请求被接受（wait 为 True 时为重新加载成功）
+        """
+        print("🔄 正在发送重新加载模型请求...")
+        response = self._send_request({'type': 'reload'})
+        if not response or not response.get('success'):
+            print(f"❌ 无法重新加载模型: {response.get('error') if response else '无法连接服务器'}")
+            return False
+        print("   服务端正在后台构建新模型，旧模型继续处理请求")
+        if not wait:
+            return True
+
+        last_state = None
+        while True:
+            time.sleep(poll_interval)
+            status = self.get_server_status()
+            if status is None:
+                print("❌ 等待期间与服务器失去连接")
+                return False
+            reload_state = status.get('reload', {})
+            state = reload_state.get('state')
+            if state == 'done':
+                print(f"✅ 模型重新加载完成，耗时 {reload_state['reload_time']:.1f} 秒"
+                      f"（第 {reload_state['generation']} 代）")
+                return True
+            if state == 'failed':
+                print(f"❌ 模型重新加载失败，服务端继续使用旧模型: {reload_state.get('error')}")
+                return False
+            progress = (state, reload_state.get('processes_done'))
+            if progress != last_state:
+                done = reload_state.get('processes_done')
+                detail = f" {done}/{reload_state['processes_total']}" if done is not None else ''
+                print(f"   {state}{detail}...")
+                last_state = progress
+
     def shutdown_server(self) -> bool:
         """关闭服务器"""
         print("🛑 正在发送关闭请求...")
@@ -131,7 +456,13 @@ def main():
     parser.add_argument('--port', type=int, default=8888, help='服务器端口')
     parser.add_argument('--output', default='output', help='结果输出目录')
     parser.add_argument('--status', action='store_true', help='查看服务器状态')
-    parser.add_argument('--shutdown', action='store_true', help='关闭服务器')
+    parser.add_argument('--metrics', action='store_true', help='输出 Prometheus 格式的服务端指标')
+    parser.add_argument('--shutdown', action='store_true', help='关闭服务器（等待进行中的任务完成）')
+    parser.add_argument('--reload', action='store_true',
+                        help='不停机重新加载模型（更新模型文件或运行 convert_models_once.py 之后）')
+    parser.add_argument('--upload', action='store_true',
+                        help='上传图片内容并取回结果（客户端与服务器不共享磁盘时使用）')
+    parser.add_argument('--stream', action='store_true', help='逐页接收识别结果')
 
     args = parser.parse_args()
 
@@ -147,11 +478,33 @@ def main():
             print(f"   地址: {status['host']}:{status['port']}")
             print(f"   运行状态: {'🟢 运行中' if status['server_running'] else '🔴 已停止'}")
             print(f"   模型状态: {'🟢 已加载' if status['model_loaded'] else '🔴 未加载'}")
+            reload_state = status.get('reload', {})
+            if reload_state.get('state', 'idle') != 'idle':
+                print(f"   模型重新加载: {reload_state['state']}（当前第 {status['model_generation']} 代）")
+            metrics = status.get('metrics')
+            if metrics:
+                print(f"   请求统计: {metrics['requests']}")
+                if metrics.get('pages'):
+                    print(f"   多页文档页数: {metrics['pages']}")
+                for stage, summary in metrics['stages'].items():
+                    print(f"   {stage:<11} 平均 {summary['avg']:.3f} 秒，最长 {summary['max']:.3f} 秒"
+                          f"（{summary['count']} 次）")
             print("=" * 60)
         else:
             print("🔴 服务器未运行或无法连接")
         return
 
+    if args.metrics:
+        text = client.get_metrics()
+        if text is None:
+            print("🔴 服务器未运行或无法连接")
+            sys.exit(1)
+        print(text, end='')
+        return
+
+    if args.reload:
+        sys.exit(0 if client.reload_model() else 1)
+
     # 关闭服务器
     if args.shutdown:
         client.shutdown_server()
@@ -159,7 +512,7 @@ def main():
 
     # OCR识别
     if args.image:
-        success = client.ocr_image(args.image, args.output)
+        success = client.ocr_image(args.image, args.output, upload=args.upload, stream=args.stream)
         sys.exit(0 if success else 1)
     else:
         parser.print_help()
@@ -0,0 +1,375 @@
+"""
+OCR 服务的性能指标
+按阶段统计每个请求的耗时，通过 status 请求和 Prometheus 文本格式（--metrics-port）对外提供
+
+阶段：
+    queue_wait   在等待队列中的时间
+    preprocess   预处理线程池中的解码和缩放
+    decode       推理工作线程中的图片解码 / PDF 页渲染
+    layout       版面检测模型
+    vlm          VLM 识别模型（逐块生成文本）
+    inference    pipeline.predict 的总耗时（包含 layout 和 vlm）
+    serialize    JSON / Markdown 结果写盘
+
+技术细节：
+- 每个推理任务创建一个 StageTimings 并显式传递，各阶段耗时累加到它上面，随响应一起返回，
+  多进程模式下也能在主进程中汇总
+- layout / vlm 通过给 pipeline 内部的子模型套一层计时代理得到；找不到子模型时只有 inference。
+  代理把耗时交给 pipeline 上当前绑定的任务（bind_timings），而不是调用线程，
+  PaddleX 在内部线程中运行的子模型同样计入；每个 pipeline 同一时间只运行一个任务
+- 多页文档按页拆分成多个任务，请求数和请求耗时按整个文档计一次，逐页任务另计为页数
+- 直方图的桶覆盖 50 ms 到 20 分钟，适配单张图片 80-600 秒的耗时范围
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+
+# 直方图桶上限（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+
+STAGES = ('queue_wait', 'preprocess', 'decode', 'layout', 'vlm', 'inference', 'serialize')
+
+# pipeline 内部需要计时的子模型属性名 -> 阶段
+INSTRUMENTED_MODELS = {
+    'layout_det_model': 'layout',
+    'vl_rec_model': 'vlm',
+}
+
+# pipeline 上保存计时去处（_StageSink）的属性名
+_SINK_ATTR = '_ocr_stage_sink'
+
+
+def _timed_iter(iterable, stage: str, add):
+    """统计迭代器每次产出结果所花的时间（惰性生成的结果在消费时才真正计算）"""
+    iterator = iter(iterable)
+    while True:
+        start_time = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            add(stage, time.perf_counter() - start_time)
+            return
+        add(stage, time.perf_counter() - start_time)
+        yield item
+
+
+class StageTimings:
+    """一个推理任务的各阶段耗时（线程安全，可以从任意线程累加）"""
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def timed(self, stage: str):
+        """统计 with 块的耗时"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start_time)
+
+    def timed_iter(self, iterable, stage: str):
+        """统计迭代器每次产出结果所花的时间"""
+        return _timed_iter(iterable, stage, self.add)
+
+    def to_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._stages)
+
+
+class _StageSink:
+    """一个 pipeline 的子模型计时去处：指向该 pipeline 上正在运行的任务的 StageTimings"""
+
+    def __init__(self):
+        self.timings = None
+
+    def add(self, stage: str, seconds: float):
+        timings = self.timings
+        if timings is not None:
+            timings.add(stage, seconds)
+
+
+@contextmanager
+def bind_timings(pipeline, timings: StageTimings):
+    """任务运行期间把 pipeline 子模型的耗时记到 timings 上（无论子模型在哪个线程中运行）"""
+    sink = getattr(pipeline, _SINK_ATTR, None)
+    if sink is not None:
+        sink.timings = timings
+    try:
+        yield timings
+    finally:
+        if sink is not None:
+            sink.timings = None
+
+
+class _TimedModel:
+    """子模型的计时代理：调用和 predict 的耗时计入指定阶段，其余属性透传"""
+
+    def __init__(self, model, stage, sink):
+        self._model = model
+        self._stage = stage
+        self._sink = sink
+
+    def _timed_call(self, func, *args, **kwargs):
+        start_time = time.perf_counter()
+        result = func(*args, **kwargs)
+        self._sink.add(self._stage, time.perf_counter() - start_time)
+        if hasattr(result, '__next__'):
+            return _timed_iter(result, self._stage, self._sink.add)
+        return result
+
+    def __call__(self, *args, **kwargs):
+        return self._timed_call(self._model, *args, **kwargs)
+
+    def predict(self, *args, **kwargs):
+        return self._timed_call(self._model.predict, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+def instrument_pipeline(pipeline, max_depth: int = 4) -> List[str]:
+    """
+    在 pipeline 对象图中查找版面检测和 VLM 子模型并套上计时代理，
+    之后用 bind_timings(pipeline, timings) 把子模型耗时记到正在运行的任务上
+
+    返回:
+        list: 成功接入计时的阶段名
+    """
+    sink = getattr(pipeline, _SINK_ATTR, None)
+    if sink is None:
+        sink = _StageSink()
+        try:
+            setattr(pipeline, _SINK_ATTR, sink)
+        except AttributeError:
+            return []
+    found = []
+    visited = set()
+    pending = [(pipeline, 0)]
+    while pending:
+        obj, depth = pending.pop()
+        if id(obj) in visited or depth > max_depth:
+            continue
+        visited.add(id(obj))
+        try:
+            attributes = vars(obj)
+        except TypeError:
+            continue
+        for name, value in list(attributes.items()):
+            if name in INSTRUMENTED_MODELS and not isinstance(value, _TimedModel):
+                setattr(obj, name, _TimedModel(value, INSTRUMENTED_MODELS[name], sink))
+                found.append(INSTRUMENTED_MODELS[name])
+            elif hasattr(value, '__dict__') and not isinstance(value, (type, _TimedModel)):
+                pending.append((value, depth + 1))
+    return found
+
+
+def process_rss(pid: Optional[int] = None) -> Optional[int]:
+    """进程当前的常驻内存（字节）；无法获取时返回 None"""
+    pid = pid or os.getpid()
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid == os.getpid():
+        try:
+            import psutil
+            return psutil.Process(pid).memory_info().rss
+        except ImportError:
+            pass
+    return None
+
+
+class Histogram:
+    """累积直方图（Prometheus 语义：每个桶统计 <= 上限的样本数）"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 3),
+            'avg': round(self.sum / self.count, 3) if self.count else 0.0,
+            'max': round(self.max, 3)
+        }
+
+    def prometheus_lines(self, name: str, labels: str = '') -> List[str]:
+        prefix = f'{labels},' if labels else ''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}')
+        label_part = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{label_part} {self.sum:.6f}')
+        lines.append(f'{name}_count{label_part} {self.count}')
+        return lines
+
+
+class ServerMetrics:
+    """服务端指标汇总（线程安全）"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.model_load_time = None
+        self.time_to_ready = None  # 从进程启动到可以接受请求的耗时
+        self.instrumented_stages = []
+        self.request_latency = Histogram()
+        self.stage_latency = {stage: Histogram() for stage in STAGES}
+        self.requests = {}  # 结果状态 -> 次数（多页文档计一次）
+        self.pages = {}  # 多页文档逐页任务的结果状态 -> 页数
+        self._lock = threading.Lock()
+
+    def count(self, status: str):
+        """计数一个请求结果：success / failure / cached / duplicate / busy"""
+        with self._lock:
+            self.requests[status] = self.requests.get(status, 0) + 1
+
+    def observe_job(self, queue_wait: float, run_time: float, result: Dict[str, Any], page: bool = False):
+        """
+        记录一个推理任务：总耗时和各阶段耗时
+
+        参数:
+            page: 是否为多页文档的逐页任务；逐页任务只计入页数和阶段耗时，
+                  文档本身由 observe_document 计为一个请求
+        """
+        with self._lock:
+            status = 'success' if result.get('success') else 'failure'
+            if page:
+                self.pages[status] = self.pages.get(status, 0) + 1
+            else:
+                self.requests[status] = self.requests.get(status, 0) + 1
+                self.request_latency.observe(queue_wait + run_time)
+            self.stage_latency['queue_wait'].observe(queue_wait)
+            for stage, seconds in result.get('timings', {}).items():
+                if stage in self.stage_latency:
+                    self.stage_latency[stage].observe(seconds)
+
+    def observe_document(self, elapsed: float, response: Dict[str, Any]):
+        """记录一个多页文档请求：按整个文档计一次请求，耗时为从拆页到合并完成"""
+        with self._lock:
+            status = 'success' if response.get('success') else 'failure'
+            self.requests[status] = self.requests.get(status, 0) + 1
+            self.request_latency.observe(elapsed)
+
+    def observe_stage(self, stage: str, seconds: float):
+        with self._lock:
+            self.stage_latency[stage].observe(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """用于 status 响应的摘要"""
+        with self._lock:
+            return {
+                'uptime': round(time.time() - self.started_at, 1),
+                'model_load_time': self.model_load_time,
+                'time_to_ready': self.time_to_ready,
+                'rss_bytes': process_rss(),
+                'requests': dict(self.requests),
+                'pages': dict(self.pages),
+                'latency': self.request_latency.summary(),
+                'stages': {stage: histogram.summary() for stage, histogram in self.stage_latency.items()
+                           if histogram.count}
+            }
+
+    def prometheus_text(self, gauges: Dict[str, Any] = None, process_pids: List[int] = ()) -> str:
+        """Prometheus 文本格式（exposition format 0.0.4）"""
+        lines = []
+        with self._lock:
+            lines.append('# HELP ocr_requests_total OCR 请求数，按结果分类')
+            lines.append('# TYPE ocr_requests_total counter')
+            for status, count in sorted(self.requests.items()):
+                lines.append(f'ocr_requests_total{{status="{status}"}} {count}')
+
+            lines.append('# HELP ocr_pages_total 多页文档逐页任务数，按结果分类')
+            lines.append('# TYPE ocr_pages_total counter')
+            for status, count in sorted(self.pages.items()):
+                lines.append(f'ocr_pages_total{{status="{status}"}} {count}')
+
+            lines.append('# HELP ocr_request_duration_seconds 请求耗时（排队 + 处理，多页文档为整个文档）')
+            lines.append('# TYPE ocr_request_duration_seconds histogram')
+            lines.extend(self.request_latency.prometheus_lines('ocr_request_duration_seconds'))
+
+            lines.append('# HELP ocr_stage_duration_seconds 各阶段耗时')
+            lines.append('# TYPE ocr_stage_duration_seconds histogram')
+            for stage, histogram in self.stage_latency.items():
+                lines.extend(histogram.prometheus_lines('ocr_stage_duration_seconds', f'stage="{stage}"'))
+
+            model_load_time = self.model_load_time
+            time_to_ready = self.time_to_ready
+
+        lines.append('# HELP ocr_model_load_seconds 模型加载耗时')
+        lines.append('# TYPE ocr_model_load_seconds gauge')
+        lines.append(f'ocr_model_load_seconds {model_load_time or 0:.3f}')
+        lines.append('# HELP ocr_time_to_ready_seconds 从进程启动到可以接受请求的耗时')
+        lines.append('# TYPE ocr_time_to_ready_seconds gauge')
+        lines.append(f'ocr_time_to_ready_seconds {time_to_ready or 0:.3f}')
+
+        lines.append('# HELP ocr_process_rss_bytes 进程常驻内存')
+        lines.append('# TYPE ocr_process_rss_bytes gauge')
+        for label, pid in [('main', os.getpid())] + [(str(pid), pid) for pid in process_pids]:
+            rss = process_rss(pid)
+            if rss is not None:
+                lines.append(f'ocr_process_rss_bytes{{process="{label}"}} {rss}')
+
+        for name, value in (gauges or {}).items():
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    render = None  # 由 start_metrics_http_server 设置为返回指标文本的函数
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 抓取请求很频繁，不打印访问日志
+
+
+def start_metrics_http_server(host: str, port: int, render) -> ThreadingHTTPServer:
+    """在后台线程中提供 http://host:port/metrics"""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'render': staticmethod(render)})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=httpd.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    return httpd
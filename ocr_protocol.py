@@ -0,0 +1,186 @@
+"""
+OCR 服务端/客户端共用的二进制分帧协议
+
+帧格式（网络字节序）：
+    magic(2) 'PO' | version(1) | frame_type(1) | codec(1) | 保留(1) | payload_len(4) | blob_len(4)
+    payload: JSON 或 msgpack 编码的消息字典
+    blob:    可选的原始二进制附件（例如内联上传的图片字节）
+
+技术细节：
+- 发送使用 sendall，接收按长度精确读取，任意大小的请求/响应都不会被截断
+- 帧头带版本号，不兼容的版本直接报错而不是误解析
+- msgpack 为可选依赖，未安装时只使用 JSON
+- 同时提供阻塞 socket 和 asyncio 两套读写函数
+- 流式请求在最终响应之前可以收到任意多个 FRAME_PARTIAL 帧，带有相同的 request_id
+"""
+
+import json
+import socket
+import asyncio
+import struct
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+MAGIC = b'PO'
+PROTOCOL_VERSION = 1
+
+# 帧类型
+FRAME_REQUEST = 1
+FRAME_RESPONSE = 2
+FRAME_ERROR = 3
+FRAME_PARTIAL = 4  # 流式请求的中间结果（每页一帧），之后仍以 FRAME_RESPONSE 结束
+
+# payload 编码
+CODEC_JSON = 0
+CODEC_MSGPACK = 1
+
+HEADER = struct.Struct('!2sBBBxII')
+
+# 单帧上限，防止错误或恶意的长度字段导致一次性分配过多内存
+MAX_PAYLOAD_SIZE = 64 * 1024 * 1024
+MAX_BLOB_SIZE = 512 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    """帧格式错误，连接上的字节流已无法继续解析"""
+
+
+class Frame(NamedTuple):
+    """收到的一帧"""
+    frame_type: int
+    message: Dict[str, Any]
+    blob: bytes
+    codec: int
+
+
+def encode_payload(message: Dict[str, Any], codec: int = CODEC_JSON) -> bytes:
+    """将消息字典编码为 payload 字节"""
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise ProtocolError('未安装 msgpack，无法使用 msgpack 编码')
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message, ensure_ascii=False).encode('utf-8')
+
+
+def decode_payload(payload: bytes, codec: int) -> Dict[str, Any]:
+    """
+    将 payload 字节解码为消息字典
+
+    内容无法解码或解码结果不是字典时抛出 ValueError（帧边界仍然完好）
+    """
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise ProtocolError('收到 msgpack 编码的帧，但未安装 msgpack')
+        message = msgpack.unpackb(payload, raw=False)
+    elif codec == CODEC_JSON:
+        message = json.loads(payload.decode('utf-8'))
+    else:
+        raise ProtocolError(f'未知的 payload 编码: {codec}')
+    if not isinstance(message, dict):
+        raise ValueError(f'消息必须是字典，收到 {type(message).__name__}')
+    return message
+
+
+def pack_frame(message: Dict[str, Any], frame_type: int = FRAME_RESPONSE,
+               blob: bytes = b'', codec: int = CODEC_JSON) -> bytes:
+    """将消息打包为完整的帧"""
+    payload = encode_payload(message, codec)
+    if len(payload) > MAX_PAYLOAD_SIZE or len(blob) > MAX_BLOB_SIZE:
+        raise ProtocolError(f'帧过大: payload {len(payload)} 字节, blob {len(blob)} 字节')
+    header = HEADER.pack(MAGIC, PROTOCOL_VERSION, frame_type, codec, len(payload), len(blob))
+    return b''.join((header, payload, blob))
+
+
+def unpack_header(header: bytes) -> Tuple[int, int, int, int]:
+    """解析帧头，返回 (frame_type, codec, payload_len, blob_len)"""
+    magic, version, frame_type, codec, payload_len, blob_len = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ProtocolError(f'无效的帧头: {header[:2]!r}')
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f'不支持的协议版本: {version}（当前版本 {PROTOCOL_VERSION}）')
+    if payload_len > MAX_PAYLOAD_SIZE or blob_len > MAX_BLOB_SIZE:
+        raise ProtocolError(f'帧过大: payload {payload_len} 字节, blob {blob_len} 字节')
+    return frame_type, codec, payload_len, blob_len
+
+
+def recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    """
+    精确读取 size 字节
+
+    返回:
+        bytes: 读取到的数据；连接在读取任何字节之前被关闭时返回 None
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            if received == 0:
+                return None
+            raise ProtocolError(f'连接在帧中途关闭（已收到 {received}/{size} 字节）')
+        received += count
+    return bytes(buffer)
+
+
+def send_message(sock: socket.socket, message: Dict[str, Any], frame_type: int = FRAME_RESPONSE,
+                 blob: bytes = b'', codec: int = CODEC_JSON):
+    """发送一条消息（完整写出整个帧）"""
+    sock.sendall(pack_frame(message, frame_type, blob, codec))
+
+
+def recv_message(sock: socket.socket) -> Optional[Frame]:
+    """
+    接收一条消息
+
+    payload 解码失败时抛出 ValueError，此时整帧已被读取，连接仍可继续使用
+
+    返回:
+        Frame；对端在帧边界正常关闭连接时返回 None
+    """
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    frame_type, codec, payload_len, blob_len = unpack_header(header)
+    payload = recv_exact(sock, payload_len) if payload_len else b''
+    blob = recv_exact(sock, blob_len) if blob_len else b''
+    if payload is None or blob is None:
+        raise ProtocolError('连接在帧中途关闭')
+    return Frame(frame_type, decode_payload(payload, codec), blob, codec)
+
+
+async def read_message_async(reader: asyncio.StreamReader) -> Optional[Frame]:
+    """
+    asyncio 版本的 recv_message
+
+    payload 解码失败时抛出 ValueError，此时整帧已被读取，连接仍可继续使用
+
+    返回:
+        Frame；对端在帧边界正常关闭连接时返回 None
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ProtocolError(f'连接在帧中途关闭（已收到 {len(e.partial)}/{HEADER.size} 字节）')
+    frame_type, codec, payload_len, blob_len = unpack_header(header)
+    try:
+        payload = await reader.readexactly(payload_len)
+        blob = await reader.readexactly(blob_len)
+    except asyncio.IncompleteReadError:
+        raise ProtocolError('连接在帧中途关闭')
+    return Frame(frame_type, decode_payload(payload, codec), blob, codec)
+
+
+async def write_message_async(writer: asyncio.StreamWriter, message: Dict[str, Any],
+                              frame_type: int = FRAME_RESPONSE, blob: bytes = b'',
+                              codec: int = CODEC_JSON):
+    """asyncio 版本的 send_message"""
+    writer.write(pack_frame(message, frame_type, blob, codec))
+    await writer.drain()
@@ -0,0 +1,212 @@
+"""
+按图片内容寻址的 OCR 结果缓存
+同一张图片（无论路径、由哪个客户端提交）只需识别一次，之后直接复用保存的结果
+
+技术细节：
+- 缓存键 = SHA-256(图片字节) + 模型/流水线版本，更换模型后旧结果自动失效
+- 每个条目保存整个结果目录（result.json、result.md 以及 Markdown 引用的图片）
+- 命中时把文件复制到请求的 output_dir；不使用硬链接，否则之后写到同一路径的其他结果会改写缓存条目
+- 磁盘占用超过上限时按最近最少使用（LRU）顺序淘汰
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+def _tree_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+class ResultCache:
+    """磁盘上的 OCR 结果缓存（LRU 淘汰）"""
+
+    META_FILE = 'meta.json'
+    FILES_DIR = 'files'
+
+    def __init__(self, cache_dir: str, max_bytes: int, version: str):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._index = OrderedDict()  # key -> 条目大小，按最近使用时间从旧到新排列
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _load_index(self):
+        """启动时扫描已有条目，按上次访问时间恢复 LRU 顺序"""
+        entries = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                if '.tmp-' in key:
+                    # 上次写入中途留下的临时目录
+                    shutil.rmtree(os.path.join(prefix_dir, key), ignore_errors=True)
+                    continue
+                meta_path = os.path.join(prefix_dir, key, self.META_FILE)
+                try:
+                    with open(meta_path, 'r', encoding='utf-8') as f:
+                        size = json.load(f)['size']
+                    entries.append((os.path.getmtime(meta_path), key, size))
+                except (OSError, ValueError, KeyError):
+                    # 不完整的条目（例如写入中途崩溃）直接清理
+                    shutil.rmtree(os.path.join(prefix_dir, key), ignore_errors=True)
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def key_for_file(self, image_path: str) -> str:
+        """计算缓存键：图片内容哈希 + 版本"""
+        digest = hashlib.sha256()
+        with open(image_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        digest.update(b'\0' + self.version.encode('utf-8'))
+        return digest.hexdigest()
+
+    def key_for_bytes(self, data: bytes) -> str:
+        """计算内联上传图片的缓存键，与 key_for_file 对同一图片得到相同的键"""
+        digest = hashlib.sha256(data)
+        digest.update(b'\0' + self.version.encode('utf-8'))
+        return digest.hexdigest()
+
+    def restore(self, key: str, save_path: str, count: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        命中时把缓存的结果放到 save_path
+
+        参数:
+            count: 是否计入命中/未命中统计；同一请求的后续查找传 False，每个请求只计一次
+
+        返回:
+            dict: 与 handle_ocr_request 相同格式的响应（附带 cached=True）；未命中返回 None
+        """
+        start_time = time.time()
+        with self._lock:
+            if key not in self._index:
+                if count:
+                    self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            if count:
+                self.hits += 1
+
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, self.META_FILE)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            os.makedirs(save_path, exist_ok=True)
+            shutil.copytree(os.path.join(entry_dir, self.FILES_DIR), save_path, dirs_exist_ok=True)
+            os.utime(meta_path)  # 记录访问时间，重启后恢复 LRU 顺序
+        except (OSError, ValueError) as e:
+            print(f"⚠ 缓存条目损坏，已丢弃: {key[:12]}... ({e})")
+            self._discard(key)
+            return None
+
+        results = [{
+            'page_idx': page['page_idx'],
+            'json_path': os.path.join(save_path, page['json_path']),
+            'md_path': os.path.join(save_path, page['md_path'])
+        } for page in meta['results']]
+
+        response = {
+            'success': True,
+            'cached': True,
+            'processing_time': time.time() - start_time,
+            'results': results,
+            'save_path': save_path
+        }
+        for key, value in meta.get('paths', {}).items():
+            response[key] = os.path.join(save_path, value)
+        if 'page_count' in meta:
+            response['page_count'] = meta['page_count']
+        return response
+
+    def store(self, key: str, response: Dict[str, Any]):
+        """把一次成功识别的结果目录存入缓存"""
+        save_path = response['save_path']
+        entry_dir = self._entry_dir(key)
+        temp_dir = f"{entry_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+
+        try:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            shutil.copytree(save_path, os.path.join(temp_dir, self.FILES_DIR))
+            size = _tree_size(temp_dir)
+            meta = {
+                'version': self.version,
+                'size': size,
+                'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'results': [{
+                    'page_idx': page['page_idx'],
+                    'json_path': os.path.relpath(page['json_path'], save_path),
+                    'md_path': os.path.relpath(page['md_path'], save_path)
+                } for page in response.get('results', [])],
+                # 多页文档的合并文件等其他路径字段
+                'paths': {key: os.path.relpath(value, save_path) for key, value in response.items()
+                          if key.endswith('_path') and key != 'save_path'}
+            }
+            if 'page_count' in response:
+                meta['page_count'] = response['page_count']
+            with open(os.path.join(temp_dir, self.META_FILE), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+
+            with self._lock:
+                if key in self._index:
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+                    return
+                # 先在临时目录写完整再改名，中途崩溃不会留下半个条目
+                os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+                os.replace(temp_dir, entry_dir)
+                self._index[key] = size
+                self._total_bytes += size
+                self._evict()
+        except OSError as e:
+            print(f"⚠ 写入结果缓存失败: {e}")
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def _discard(self, key: str):
+        with self._lock:
+            size = self._index.pop(key, None)
+            if size is not None:
+                self._total_bytes -= size
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def _evict(self):
+        """超过容量上限时淘汰最久未使用的条目（调用方持有锁）"""
+        while self._total_bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率等统计，用于 status 响应"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._index),
+                'size_bytes': self._total_bytes,
+                'max_bytes': self.max_bytes
+            }
@@ -3,40 +3,205 @@ PaddleOCRVL 持久化服务端
 模型加载后持续运行，直到手动停止
 """
 
+import gc
 import os
 import json
 import time
 import signal
+import queue
+import shutil
 import socket
+import tempfile
 import threading
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 import traceback
 
+# 启动耗时分析：设置了 OCR_PROFILE_STARTUP=1 时从这里开始记录各导入阶段（--profile-startup 输出结果）
+from startup_profiler import profiler, print_startup_summary
+
+with profiler.phase('import paddle'):
+    import paddle  # 单独计时 paddle 本身的导入（setup_safetensors 依赖它）
+
 # 应用 safetensors 兼容性补丁
-from setup_safetensors import setup_safetensors_patch
-setup_safetensors_patch()
+with profiler.phase('import setup_safetensors'):
+    from setup_safetensors import setup_safetensors_patch, checkpoint_cache, set_snapshot
+    import setup_safetensors
+with profiler.phase('safetensors 补丁'):
+    setup_safetensors_patch()
+
+with profiler.phase('import paddleocr'):
+    import paddleocr
+    from paddleocr import PaddleOCRVL
+from ocr_protocol import (recv_message, send_message, ProtocolError,
+                          FRAME_RESPONSE, FRAME_ERROR, FRAME_PARTIAL)
+from document_pages import (is_multipage_format, count_pages, render_page,
+                            page_file_stem, merge_page_results)
+from ocr_metrics import ServerMetrics, StageTimings, bind_timings, instrument_pipeline
+from cpu_tuning import (CpuAutotuner, apply_worker, budget_pipeline, configure_process, plan_cpu,
+                        tune_in_subprocess)
+
+
+def decode_image_bytes(data: bytes):
+    """
+    在内存中解码上传的图片字节
+
+    返回:
+        np.ndarray: BGR 图像（与 cv2.imread 一致，可直接传给 predict）；
+                    无法解码（例如 PDF）或未安装 OpenCV 时返回 None
+    """
+    try:
+        import cv2
+        import numpy as np
+    except ImportError:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def page_blocks(res) -> List[Dict[str, Any]]:
+    """从单页结果中提取版面块（类别、文本、坐标），结果对象不提供时返回空列表"""
+    try:
+        data = res.json
+    except Exception:
+        return []
+    if not isinstance(data, dict):
+        return []
+    data = data.get('res', data)
+    return [{
+        'label': block.get('block_label'),
+        'content': block.get('block_content'),
+        'bbox': block.get('block_bbox')
+    } for block in data.get('parsing_res_list', []) if isinstance(block, dict)]
+
+
+class InferenceJob:
+    """排队等待推理的 OCR 任务"""
 
-from paddleocr import PaddleOCRVL
+    def __init__(self, request: Dict[str, Any], position: int, cache_key: Optional[str] = None):
+        self.request = request
+        self.cache_key = cache_key  # 结果缓存键，任务成功后用于写入缓存
+        self.position = position  # 入队时前面还有多少个任务
+        self.enqueued_at = time.time()
+        self.started_at = None
+        self.result = None
+        self.done = threading.Event()
+        self._callbacks = []
+        self._partial_callbacks = []
+        self._lock = threading.Lock()
+
+    def add_partial_callback(self, callback):
+        """每产生一页结果时在工作线程中调用 callback(partial)；需要在任务入队前注册"""
+        self._partial_callbacks.append(callback)
+
+    def publish(self, partial: Dict[str, Any]):
+        """推送一页中间结果"""
+        for callback in self._partial_callbacks:
+            try:
+                callback(partial)
+            except Exception as e:
+                print(f"⚠ 中间结果回调失败: {e}")
+
+    def add_done_callback(self, callback):
+        """任务完成时在工作线程中调用 callback(job)；已完成则立即调用"""
+        with self._lock:
+            if not self.done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def finish(self, result: Dict[str, Any]):
+        """记录结果并唤醒等待者"""
+        with self._lock:
+            self.result = result
+            self.done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                # 回调失败（例如事件循环已关闭）不能影响工作线程
+                print(f"⚠ 任务回调失败: {e}")
+
+    def response(self) -> Dict[str, Any]:
+        """返回给客户端的响应：推理结果加上排队信息"""
+        response = dict(self.result)
+        response['queue_position'] = self.position
+        if self.started_at is not None:
+            response['queue_wait'] = self.started_at - self.enqueued_at
+        return response
 
 
 class PPOCRServer:
     """PaddleOCRVL 持久化服务器"""
 
-    def __init__(self, host='localhost', port=8888):
+    def __init__(self, host='localhost', port=8888, num_workers=1, queue_size=16, num_processes=0,
+                 cache_dir='.ocr_cache', cache_size_mb=2048, preprocessor=None, snapshot_path=None,
+                 drain_timeout=600, cpu_plan=None, mkldnn_cache_capacity=None):
         self.host = host
         self.port = port
-        self.pipeline = None
+        self.pipelines = []  # 线程模式下每个推理工作线程独占一个 pipeline，按工作线程编号索引
+        self.pipeline_generation = 0  # 每次加载/重新加载模型后加一
+
+        # 模型热重载：推理任务开始时租用所在工作线程的 pipeline，重载替换后旧 pipeline 上的任务全部结束才释放
+        self._pipeline_cond = threading.Condition()
+        self._pipeline_leases = {}  # id(pipeline) -> 正在使用它的任务数
+        self._reload_lock = threading.Lock()
+        self.reload_state = {'state': 'idle'}
         self.server_socket = None
         self.running = False
+        self.drain_timeout = drain_timeout  # 关闭时等待进行中任务完成的最长秒数
+
+        # 调度：连接线程只负责解析和入队，推理由固定数量的工作线程完成
+        self.num_workers = num_workers
+        self.job_queue = queue.Queue(maxsize=queue_size)
+        self.workers = []
+        self._workers_stop = threading.Event()
+        self.active_jobs = 0
+        self.requests_in_flight = 0  # 连接线程上已收到、尚未写回响应的请求（包括多页文档的整个调度过程）
+        self.avg_job_time = None  # 任务耗时的指数移动平均，用于估算重试等待时间
+        self._stats_lock = threading.Lock()
+
+        # 多进程模式：推理由 fork 出的子进程完成，每个工作线程对应一个进程
+        self.num_processes = num_processes
+        self.process_pool = None
+
+        # 每个推理工作者的线程数和核心绑定（cpu_tuning.CpuPlan），None 时使用 PaddleOCR 的默认设置
+        self.cpu_plan = cpu_plan
+        self.mkldnn_cache_capacity = mkldnn_cache_capacity
+
+        # 推理前的缩放/去重预处理（image_preprocess.ImagePreprocessor），None 时不预处理
+        self.preprocessor = preprocessor
+
+        # spawn 模式的推理进程用这些参数在子进程中构造 PPOCRServer（网络和调度参数由主进程负责）
+        self.init_kwargs = {
+            'cache_dir': cache_dir, 'cache_size_mb': cache_size_mb, 'snapshot_path': snapshot_path,
+            'drain_timeout': drain_timeout, 'mkldnn_cache_capacity': mkldnn_cache_capacity,
+            'preprocess_options': preprocessor.options() if preprocessor is not None else None
+        }
+
+        # 各阶段耗时等性能指标
+        self.metrics = ServerMetrics()
+
+        # 模型权重快照（model_snapshot），None 时不使用
+        self.snapshot_path = snapshot_path
+        self.snapshot_info = None  # 本次启动使用的快照：覆盖的 checkpoint 和生成时的就绪耗时
+
+        # 按图片内容寻址的结果缓存，cache_dir 为 None 时禁用
+        self.result_cache = None
+        if cache_dir:
+            from ocr_result_cache import ResultCache
+            version = f"paddleocr-{getattr(paddleocr, '__version__', 'unknown')}"
+            if preprocessor is not None:
+                version += f"-{preprocessor.signature()}"
+            self.result_cache = ResultCache(cache_dir, cache_size_mb * 1024 * 1024, version)
 
         # 注册信号处理器
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
 
     def _signal_handler(self, signum, frame):
-        """处理终止信号"""
+        """处理终止信号：SIGTERM 等待进行中的任务完成，Ctrl+C 立即停止"""
         print(f"\n收到信号 {signum}，正在优雅关闭服务...")
-        self.stop()
+        self.stop(drain_timeout=0 if signum == signal.SIGINT else None)
 
     def initialize_model(self):
         """初始化PaddleOCRVL模型"""
@@ -48,8 +213,16 @@ class PPOCRServer:
         start_time = time.time()
 
         try:
-            self.pipeline = PaddleOCRVL()
+            # PaddleOCRVL 不支持在同一个实例上并发推理，线程模式下为每个工作线程各构建一个；
+            # 多进程模式下主进程只构建一个，fork 后由各推理进程共享
+            count = 1 if self.num_processes > 0 else self.num_workers
+            for index in range(count):
+                if count > 1:
+                    print(f"   正在构建第 {index + 1}/{count} 个工作线程的模型...")
+                self.pipelines.append(self.build_pipeline())
+            self.pipeline_generation += 1
             end_time = time.time()
+            self.metrics.model_load_time = end_time - start_time
 
             print("=" * 60)
             print(f"✅ 模型初始化完成！")
@@ -65,9 +238,505 @@ class PPOCRServer:
 
         return True
 
+    def build_pipeline(self, cpu_threads: Optional[int] = None):
+        """
+        构建一个新的 PaddleOCRVL pipeline（不替换当前正在使用的 pipeline）
+
+        参数:
+            cpu_threads: 版面检测模型的线程数，None 表示使用 cpu_plan 中的线程数
+        """
+        if profiler.enabled:
+            # 给 PaddleX 内部的模型创建、配置加载和权重赋值接入启动耗时分析
+            profiler.install_paddlex_hooks()
+        snapshot = self.open_snapshot()
+        try:
+            # 构建期间同一权重文件会被打开两次，缓存解码结果，构建完成后立即清空
+            with profiler.phase('PaddleOCRVL()'), checkpoint_cache():
+                pipeline = PaddleOCRVL(**self.pipeline_options(cpu_threads))
+        finally:
+            # 权重已复制进 paddle 张量，快照映射不再需要
+            if snapshot is not None:
+                set_snapshot(None)
+                snapshot.close()
+        # 给版面检测和 VLM 子模型接入计时（在 fork 推理进程之前完成，子进程同样生效）
+        self.metrics.instrumented_stages = instrument_pipeline(pipeline)
+        if self.cpu_plan is not None:
+            budget_pipeline(pipeline)
+        return pipeline
+
+    def pipeline_options(self, cpu_threads: Optional[int] = None) -> Dict[str, Any]:
+        """构建 PaddleOCRVL 的 CPU 相关参数"""
+        options = {}
+        if cpu_threads is None and self.cpu_plan is not None:
+            cpu_threads = self.cpu_plan.threads
+        if cpu_threads is not None:
+            # 版面检测模型（Paddle Inference）的线程数在构建时确定
+            options['cpu_threads'] = cpu_threads
+        if self.mkldnn_cache_capacity is not None:
+            options['mkldnn_cache_capacity'] = self.mkldnn_cache_capacity
+        return options
+
+    def calibrate(self, image_path: str):
+        """用第一个工作线程的模型在调用线程中识别一次 image_path，不保存结果（CPU 调优用）"""
+        pipeline, _ = self.acquire_pipeline()
+        try:
+            predict = getattr(pipeline, 'predict_iter', pipeline.predict)
+            for _ in predict(image_path):
+                pass
+        finally:
+            self.release_pipeline(pipeline)
+
+    def autotune_cpu(self, objective: str, image_path: Optional[str] = None,
+                     cache_path: Optional[str] = None) -> bool:
+        """
+        启动时试跑多个线程数，按 objective（throughput / latency）选出每个工作者的线程数，
+        多进程模式下 throughput 同时调整进程数；须在 start_process_pool 之前调用。
+        每个候选线程数都重新构建第一个工作线程的模型，调优完成后按选出的线程数重新构建全部模型
+
+        返回:
+            bool: 是否调优成功（失败时保留原有分配）
+        """
+        pin = self.cpu_plan.pin if self.cpu_plan is not None else 'none'
+        old_threads = self.cpu_plan.threads if self.cpu_plan is not None else None
+        tuner = CpuAutotuner(self.calibrate, objective, self.num_processes or self.num_workers, pin,
+                             cache_path, f"paddleocr-{getattr(paddleocr, '__version__', 'unknown')}",
+                             rebuild=lambda threads: self.swap_pipeline(self.build_pipeline(threads)),
+                             scale_workers=self.num_processes > 0)
+        try:
+            if self.num_processes > 0:
+                result = tune_in_subprocess(tuner, image_path)
+            else:
+                result = tuner.tune(image_path)
+        except Exception as e:
+            print(f"⚠ CPU 自动调优失败，使用默认分配: {e}")
+            if self.num_processes <= 0:
+                # 调优过程中可能已换上按其他线程数构建的模型，恢复为默认分配
+                self.swap_pipeline(self.build_pipeline())
+                with self._pipeline_cond:
+                    self.pipeline_generation += 1
+            return False
+
+        workers = result['workers']
+        if self.num_processes > 0:
+            self.num_processes = workers
+        self.num_workers = workers
+        self.cpu_plan = plan_cpu(workers, result['threads'], pin)
+        configure_process(self.cpu_plan)
+        print(f"⚙ CPU 分配: {self.cpu_plan.describe()}")
+
+        # 线程模式下调优过程中已换上最后一个候选线程数的模型；多进程模式下调优在子进程中进行
+        if tuner.results or result['threads'] != old_threads:
+            print(f"🔄 按调优结果重新构建模型（{result['threads']} 个线程）...")
+            try:
+                self.rebuild_pipelines()
+            except Exception as e:
+                print(f"❌ 重新构建模型失败: {e}")
+                return False
+        return True
+
+    def acquire_pipeline(self, index: int = 0):
+        """
+        租用第 index 个工作线程当前的 pipeline，用完后必须调用 release_pipeline
+
+        返回:
+            tuple: (pipeline, 模型代数)
+        """
+        with self._pipeline_cond:
+            pipeline = self.pipelines[index] if index < len(self.pipelines) else None
+            if pipeline is not None:
+                self._pipeline_leases[id(pipeline)] = self._pipeline_leases.get(id(pipeline), 0) + 1
+            return pipeline, self.pipeline_generation
+
+    def release_pipeline(self, pipeline):
+        if pipeline is None:
+            return
+        with self._pipeline_cond:
+            remaining = self._pipeline_leases[id(pipeline)] - 1
+            if remaining:
+                self._pipeline_leases[id(pipeline)] = remaining
+            else:
+                del self._pipeline_leases[id(pipeline)]
+            self._pipeline_cond.notify_all()
+
+    def swap_pipeline(self, pipeline, index: int = 0):
+        """
+        原子地换上第 index 个工作线程的新 pipeline：之后开始的任务都使用新 pipeline，
+        等旧 pipeline 上进行中的任务全部结束后释放它（不改变模型代数）
+        """
+        with self._pipeline_cond:
+            old = self.pipelines[index] if index < len(self.pipelines) else None
+            if old is None:
+                self.pipelines.append(pipeline)
+            else:
+                self.pipelines[index] = pipeline
+                self._pipeline_cond.wait_for(lambda: id(old) not in self._pipeline_leases)
+        del old
+        gc.collect()
+
+    def rebuild_pipelines(self, on_progress=None):
+        """
+        逐个为每个工作线程构建新模型并换上，同一时间最多多占用一份模型的内存；
+        全部换完后模型代数加一
+
+        参数:
+            on_progress: 每换完一个调用 on_progress(已完成数, 总数)
+        """
+        total = len(self.pipelines)
+        for index in range(total):
+            self.swap_pipeline(self.build_pipeline(), index)
+            if on_progress is not None and total > 1:
+                on_progress(index + 1, total)
+        with self._pipeline_cond:
+            self.pipeline_generation += 1
+
+    def reload_model(self) -> Dict[str, Any]:
+        """
+        处理重新加载模型请求：在后台构建新模型，旧模型在此期间继续服务，
+        构建完成后原子替换，等旧模型上的任务结束后释放其内存
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            return {'success': False, 'error': '模型正在重新加载', 'reload': self.reload_state}
+        print("🔄 收到重新加载模型请求，旧模型在新模型就绪前继续服务")
+        self.reload_state = {'state': 'building', 'started_at': time.time(),
+                             'generation': self.pipeline_generation}
+        threading.Thread(target=self._reload_worker, name='model-reload', daemon=True).start()
+        return {'success': True, 'message': '已开始在后台重新加载模型', 'reload': self.reload_state}
+
+    def _reload_worker(self):
+        started_at = self.reload_state['started_at']
+        try:
+            if self.process_pool is not None:
+                # 多进程模式：推理在子进程中进行，逐个重启子进程中的模型
+                self.reload_state = dict(self.reload_state, state='rolling')
+                result = self.process_pool.reload(on_progress=self._reload_progress)
+                if not result.get('success'):
+                    raise RuntimeError(result.get('error', '推理进程重新加载失败'))
+                with self._pipeline_cond:
+                    self.pipeline_generation += 1
+            else:
+                # 线程模式：逐个替换各工作线程的模型，每个旧模型等其上的任务结束后释放
+                self.reload_state = dict(self.reload_state, state='rolling')
+                self.rebuild_pipelines(on_progress=self._reload_progress)
+            self.metrics.model_load_time = time.time() - started_at
+            self.reload_state = {'state': 'done', 'started_at': started_at, 'finished_at': time.time(),
+                                 'reload_time': time.time() - started_at,
+                                 'generation': self.pipeline_generation}
+            print(f"✅ 模型重新加载完成，耗时 {time.time() - started_at:.1f} 秒（第 {self.pipeline_generation} 代）")
+            self.write_snapshot_if_needed()
+        except Exception as e:
+            print(f"❌ 模型重新加载失败，继续使用旧模型: {e}")
+            print(traceback.format_exc())
+            self.reload_state = {'state': 'failed', 'started_at': started_at, 'finished_at': time.time(),
+                                 'error': str(e), 'generation': self.pipeline_generation}
+        finally:
+            self._reload_lock.release()
+
+    def _reload_progress(self, done: int, total: int):
+        """每重新加载完一个推理进程（或工作线程）的模型调用一次"""
+        self.reload_state = dict(self.reload_state, processes_done=done, processes_total=total)
+        print(f"🔄 推理工作者模型重新加载 {done}/{total}")
+
+    def reload_in_place(self) -> Dict[str, Any]:
+        """推理子进程中重新加载模型：子进程同一时间只处理一个任务，直接替换即可"""
+        start_time = time.time()
+        self.rebuild_pipelines()
+        return {'success': True, 'load_time': time.time() - start_time}
+
+    def open_snapshot(self):
+        """打开模型快照并交给 safetensors 补丁使用，没有可用快照时返回 None"""
+        if not self.snapshot_path:
+            return None
+        from model_snapshot import open_snapshot
+        snapshot = open_snapshot(self.snapshot_path)
+        if snapshot is None:
+            self.snapshot_info = None
+            return None
+        print(f"⚡ 使用模型快照: {self.snapshot_path}（{len(snapshot.entries)} 个 checkpoint）")
+        self.snapshot_info = {'checkpoints': set(snapshot.entries), 'time_to_ready': snapshot.time_to_ready}
+        set_snapshot(snapshot)
+        return snapshot
+
+    def refresh_snapshot(self, time_to_ready: float):
+        """
+        报告就绪耗时；快照不存在或没有覆盖本次加载的全部权重时在后台重新生成
+
+        参数:
+            time_to_ready: 从进程启动到可以接受请求的耗时（秒）
+        """
+        self.metrics.time_to_ready = time_to_ready
+        info = self.snapshot_info
+        if info is not None and info.get('time_to_ready'):
+            print(f"⏱ 启动就绪耗时: {time_to_ready:.2f} 秒（使用模型快照；"
+                  f"不使用快照时为 {info['time_to_ready']:.2f} 秒）")
+        else:
+            print(f"⏱ 启动就绪耗时: {time_to_ready:.2f} 秒")
+
+        if not self.snapshot_path:
+            return
+        checkpoints = list(setup_safetensors.opened_checkpoints)
+        if not checkpoints:
+            return
+        if info is not None and info['checkpoints'].issuperset(checkpoints):
+            return
+        # 就绪耗时基准只取完全没有使用快照的那次启动
+        self.write_snapshot_if_needed(info.get('time_to_ready') if info is not None else time_to_ready)
+
+    def write_snapshot_if_needed(self, baseline: Optional[float] = None):
+        """快照没有覆盖本次加载的全部权重时在后台重新生成"""
+        if not self.snapshot_path:
+            return
+        checkpoints = list(setup_safetensors.opened_checkpoints)
+        info = self.snapshot_info
+        if not checkpoints or (info is not None and info['checkpoints'].issuperset(checkpoints)):
+            return
+        if baseline is None and info is not None:
+            baseline = info.get('time_to_ready')
+        from model_snapshot import write_snapshot_in_background
+        print(f"💾 正在后台生成模型快照: {self.snapshot_path}")
+        write_snapshot_in_background(self.snapshot_path, checkpoints, {'time_to_ready': baseline})
+
+    def start_process_pool(self):
+        """模型加载完成后 fork 推理进程（需在启动任何线程之前调用）"""
+        if self.num_processes <= 0 or self.process_pool is not None:
+            return
+        from ocr_worker_pool import ProcessWorkerPool
+
+        self.process_pool = ProcessWorkerPool(self.handle_ocr_request, self.num_processes,
+                                              reloader=self.reload_in_place, cpu_plan=self.cpu_plan,
+                                              server_kwargs=self.init_kwargs)
+        self.process_pool.start()
+        # 每个进程同一时间只处理一个任务，工作线程数与进程数一致
+        self.num_workers = self.num_processes
+
+    def start_inference_workers(self):
+        """启动推理工作线程，只有它们会调用 pipeline，每个工作线程只使用自己的 pipeline"""
+        for i in range(self.num_workers - len(self.workers)):
+            worker = threading.Thread(
+                target=self._inference_worker,
+                args=(len(self.workers),),
+                name=f"inference-worker-{len(self.workers) + 1}"
+            )
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def _inference_worker(self, index: int = 0):
+        """推理工作线程：依次从队列取出任务执行"""
+        # 多进程模式下工作线程只负责转发，CPU 分配在推理进程中生效
+        if self.cpu_plan is not None and self.process_pool is None:
+            apply_worker(self.cpu_plan, index)
+        while not self._workers_stop.is_set():
+            try:
+                job = self.job_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            job.started_at = time.time()
+            with self._stats_lock:
+                self.active_jobs += 1
+            try:
+                on_page = job.publish if job.request.get('stream') else None
+                if self.process_pool is not None:
+                    result = self.process_pool.run(job.request, on_page)
+                else:
+                    result = self.handle_ocr_request(job.request, on_page, worker=index)
+            except Exception as e:
+                result = {
+                    'success': False,
+                    'error': f'OCR处理失败: {e}',
+                    'details': traceback.format_exc()
+                }
+            elapsed = time.time() - job.started_at
+            self.metrics.observe_job(job.started_at - job.enqueued_at, elapsed, result,
+                                     page='page_index' in job.request)
+            with self._stats_lock:
+                self.active_jobs -= 1
+                if self.avg_job_time is None:
+                    self.avg_job_time = elapsed
+                else:
+                    self.avg_job_time = 0.8 * self.avg_job_time + 0.2 * elapsed
+            if job.cache_key is not None and result.get('success'):
+                self.result_cache.store(job.cache_key, result)
+                info = job.request.get('preprocess', {})
+                if 'pixel_hash' in info:
+                    self.preprocessor.remember(info['pixel_hash'], job.cache_key)
+            if job.request.get('image_bytes') is not None and 'save_path' in result:
+                result = self.inline_results(result)
+            job.finish(result)
+
+    def retry_after(self) -> float:
+        """队列满时建议客户端等待的秒数：按平均任务耗时估算排空一个位置所需时间"""
+        with self._stats_lock:
+            avg_job_time = self.avg_job_time
+        if avg_job_time is None:
+            return 30.0
+        return max(1.0, avg_job_time / self.num_workers)
+
+    def busy_response(self) -> Dict[str, Any]:
+        """队列已满时返回的繁忙提示"""
+        self.metrics.count('busy')
+        retry_after = self.retry_after()
+        return {
+            'success': False,
+            'busy': True,
+            'error': f'服务繁忙，队列已满，请 {retry_after:.0f} 秒后重试',
+            'retry_after': retry_after,
+            'queue_length': self.job_queue.qsize()
+        }
+
+    def lookup_cached_result(self, request: Dict[str, Any]):
+        """
+        在结果缓存中查找请求的图片
+
+        返回:
+            (cache_key, response): 命中时 response 为可直接返回的响应；
+            未启用缓存或图片不存在时 cache_key 为 None
+        """
+        if self.result_cache is None:
+            return None, None
+
+        image_bytes = request.get('image_bytes')
+        if image_bytes is not None:
+            cache_key = self.result_cache.key_for_bytes(image_bytes)
+            save_path = self.result_save_path(request)
+            response = self.result_cache.restore(cache_key, save_path)
+            if response is None:
+                shutil.rmtree(os.path.dirname(save_path), ignore_errors=True)
+                return cache_key, None
+            response = self.inline_results(response)
+        else:
+            image_path = request.get('image_path')
+            if not image_path or not os.path.isfile(image_path):
+                return None, None
+            cache_key = self.result_cache.key_for_file(image_path)
+            response = self.result_cache.restore(cache_key, self.result_save_path(request))
+            if response is None:
+                return cache_key, None
+
+        print(f"⚡ 结果缓存命中: {self.display_name(request)}")
+        self.metrics.count('cached')
+        return cache_key, response
+
+    def preprocess_request(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        在预处理线程池中缩放图片并计算像素哈希（调用线程等待，推理工作线程同时处理其他图片）
+
+        预处理后的图像放入 request['prepared_image']，预处理信息放入 request['preprocess']
+
+        返回:
+            dict: 与已识别图片像素完全相同时，直接返回复用其结果的响应；否则返回 None
+        """
+        if self.preprocessor is None:
+            return None
+
+        image_bytes = request.get('image_bytes')
+        source = image_bytes if image_bytes is not None else request.get('image_path')
+        if source is None or (image_bytes is None and not os.path.isfile(source)):
+            return None
+
+        try:
+            start_time = time.perf_counter()
+            image, info = self.preprocessor.submit(source).result()
+            self.metrics.observe_stage('preprocess', time.perf_counter() - start_time)
+        except Exception as e:
+            # 无法预处理的图片交给 pipeline 按原样读取
+            print(f"⚠ 预处理失败，使用原图: {self.display_name(request)} ({e})")
+            return None
+        request['prepared_image'] = image
+        request['preprocess'] = info
+
+        if self.result_cache is None or 'pixel_hash' not in info:
+            return None
+        cache_key = self.preprocessor.find_duplicate(info['pixel_hash'])
+        if cache_key is None:
+            return None
+
+        save_path = self.result_save_path(request)
+        # lookup_cached_result 已经为这个请求计过一次未命中，复用重复图片的结果不再重复计数
+        response = self.result_cache.restore(cache_key, save_path, count=False)
+        if response is None:
+            if image_bytes is not None:
+                shutil.rmtree(os.path.dirname(save_path), ignore_errors=True)
+            return None
+        print(f"♻ 重复图片（像素相同），复用已有结果: {self.display_name(request)}")
+        self.metrics.count('duplicate')
+        response['duplicate'] = True
+        response['preprocess'] = info
+        if image_bytes is not None:
+            response = self.inline_results(response)
+        return response
+
+    def enqueue_ocr_job(self, request: Dict[str, Any], cache_key: Optional[str] = None,
+                        on_partial=None) -> Optional[InferenceJob]:
+        """把 OCR 请求放入有界队列，队列已满时返回 None（不阻塞）"""
+        job = InferenceJob(request, self.job_queue.qsize(), cache_key)
+        if on_partial is not None:
+            job.add_partial_callback(on_partial)
+        try:
+            self.job_queue.put_nowait(job)
+        except queue.Full:
+            return None
+        return job
+
+    def validate_ocr_request(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """检查 OCR 请求带有图片内容或存在的图片路径，不合法时返回错误响应"""
+        if request.get('image_bytes') is not None:
+            return None
+        image_path = request.get('image_path')
+        if not isinstance(image_path, str) or not image_path or not os.path.exists(image_path):
+            return {
+                'success': False,
+                'error': f'图片文件不存在: {image_path}'
+            }
+        return None
+
+    def submit_ocr_job(self, request: Dict[str, Any], on_partial=None) -> Dict[str, Any]:
+        """
+        把 OCR 请求放入有界队列并等待结果；缓存命中时直接返回，队列已满时立即返回繁忙提示
+
+        参数:
+            on_partial: 流式请求每产生一页结果时在调用线程中调用 on_partial(partial)
+        """
+        # 之后的缓存查找和多页判断都依赖图片路径，先校验请求
+        invalid = self.validate_ocr_request(request)
+        if invalid is not None:
+            return invalid
+
+        cache_key, cached = self.lookup_cached_result(request)
+        if cached is not None:
+            return cached
+
+        if is_multipage_format(self.display_name(request)):
+            response = self.run_document(request, cache_key, on_partial)
+            if response is not None:
+                return response
+
+        duplicate = self.preprocess_request(request)
+        if duplicate is not None:
+            return duplicate
+
+        if on_partial is None:
+            job = self.enqueue_ocr_job(request, cache_key)
+            if job is None:
+                return self.busy_response()
+            job.done.wait()
+            return job.response()
+
+        # 中间结果经队列转交给调用线程发送，客户端读得慢也不会拖住推理工作线程
+        partials = queue.Queue()
+        job = self.enqueue_ocr_job(request, cache_key, partials.put)
+        if job is None:
+            return self.busy_response()
+        job.add_done_callback(lambda job: partials.put(None))
+        for partial in iter(partials.get, None):
+            on_partial(partial)
+        return job.response()
+
     def start_server(self):
         """启动服务器"""
         try:
+            self.start_inference_workers()
+
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.server_socket.bind((self.host, self.port))
@@ -110,29 +779,54 @@ class PPOCRServer:
             client_socket.settimeout(1800)
 
             while self.running:
-                # 接收请求数据
-                data = client_socket.recv(4096)
-                if not data:
-                    break
-
+                # 接收一个完整的请求帧
                 try:
-                    request = json.loads(data.decode('utf-8'))
-                    response = self.process_request(request)
-
-                    # 发送响应
-                    response_data = json.dumps(response, ensure_ascii=False).encode('utf-8')
-                    client_socket.send(response_data)
-
-                    if request.get('type') == 'status':
-                        break  # 状态查询后断开连接
-
-                except json.JSONDecodeError as e:
+                    frame = recv_message(client_socket)
+                except ValueError as e:
+                    # payload 解码失败，整帧已读取，连接仍然可用
                     error_response = {
                         'success': False,
                         'error': f'JSON解析错误: {e}'
                     }
-                    client_socket.send(json.dumps(error_response).encode('utf-8'))
+                    send_message(client_socket, error_response, FRAME_ERROR)
+                    continue
+
+                if frame is None:
+                    break
 
+                # 关闭服务时等待计数归零，确保响应（包括 shutdown 请求本身的响应）写回后才停止
+                with self._stats_lock:
+                    self.requests_in_flight += 1
+                try:
+                    request = frame.message
+                    if frame.blob:
+                        # 内联上传的图片字节
+                        request['image_bytes'] = frame.blob
+                    if request.get('type') == 'ocr' and request.get('stream'):
+                        def send_partial(partial, request_id=request.get('request_id')):
+                            send_message(client_socket, dict(partial, request_id=request_id),
+                                         FRAME_PARTIAL, codec=frame.codec)
+                        response = self.submit_ocr_job(request, send_partial)
+                    else:
+                        response = self.process_request(request)
+
+                    # 带回 request_id，客户端据此匹配流水线中的响应
+                    if 'request_id' in request:
+                        response['request_id'] = request['request_id']
+
+                    # 发送响应（与请求使用相同的编码），连接保持以便客户端复用
+                    send_message(client_socket, response, FRAME_RESPONSE,
+                                 blob=response.pop('blob', b''), codec=frame.codec)
+                finally:
+                    with self._stats_lock:
+                        self.requests_in_flight -= 1
+
+        except ProtocolError as e:
+            print(f"❌ 协议错误: {e}")
+            try:
+                send_message(client_socket, {'success': False, 'error': f'协议错误: {e}'}, FRAME_ERROR)
+            except OSError:
+                pass
         except Exception as e:
             print(f"❌ 客户端处理错误: {e}")
         finally:
@@ -144,9 +838,13 @@ class PPOCRServer:
         request_type = request.get('type')
 
         if request_type == 'ocr':
-            return self.handle_ocr_request(request)
+            return self.submit_ocr_job(request)
         elif request_type == 'status':
             return self.handle_status_request()
+        elif request_type == 'metrics':
+            return {'success': True, 'text': self.metrics_text()}
+        elif request_type == 'reload':
+            return self.reload_model()
         elif request_type == 'shutdown':
             return self.handle_shutdown_request()
         else:
@@ -155,118 +853,535 @@ class PPOCRServer:
                 'error': f'未知请求类型: {request_type}'
             }
 
-    def handle_ocr_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
-        """处理OCR识别请求"""
-        if not self.pipeline:
+    def run_document(self, request: Dict[str, Any], cache_key: Optional[str] = None,
+                     on_partial=None) -> Optional[Dict[str, Any]]:
+        """
+        多页文档（PDF / TIFF）：每页作为独立任务入队，多个推理工作线程/进程并行识别，最后合并
+
+        同一文档同时在途的页数不超过推理工作线程数，后面的页在前面的页完成后才渲染和入队；
+        每页结果保存为 page_0001.json / page_0001.md，全部完成后合并为 result.json / result.md
+
+        返回:
+            dict: 与 handle_ocr_request 格式相同的响应，results 为逐页结果，另附 page_count
+                  和合并文件路径；文档只有一页时返回 None，由调用方按普通图片处理
+        """
+        image_bytes = request.get('image_bytes')
+        name = self.display_name(request)
+        save_path = self.result_save_path(request)
+
+        if image_bytes is not None:
+            # 上传的文档只写一次临时文件，各页任务都从这里渲染
+            doc_path = os.path.join(os.path.dirname(save_path), 'input' + os.path.splitext(name)[1])
+            with open(doc_path, 'wb') as f:
+                f.write(image_bytes)
+        else:
+            doc_path = request.get('image_path')
+
+        def discard_upload():
+            if image_bytes is not None:
+                shutil.rmtree(os.path.dirname(save_path), ignore_errors=True)
+
+        try:
+            page_count = count_pages(doc_path)
+        except Exception as e:
+            discard_upload()
+            self.metrics.count('failure')
+            return {'success': False, 'error': f'无法读取文档 {name}: {e}'}
+        if page_count <= 1:
+            discard_upload()
+            return None
+
+        print(f"📑 多页文档: {name}，共 {page_count} 页")
+        os.makedirs(save_path, exist_ok=True)
+        start_time = time.time()
+
+        # 工作线程中的页完成事件和中间结果都经此队列交给调用线程处理
+        events = queue.Queue()
+        next_pages = iter(range(page_count))
+        results = {}
+        errors = {}
+
+        def forward_partial(partial):
+            events.put(('partial', partial))
+
+        def submit_next_page() -> bool:
+            """下一页入队；没有剩余的页时返回 False"""
+            for page_index in next_pages:
+                page_request = {
+                    'type': 'ocr',
+                    'image_path': doc_path,
+                    'page_index': page_index,
+                    'result_dir': save_path,
+                    'stream': on_partial is not None
+                }
+                while not self._workers_stop.is_set():
+                    job = self.enqueue_ocr_job(page_request, on_partial=forward_partial if on_partial else None)
+                    if job is not None:
+                        job.add_done_callback(lambda job: events.put(('done', job)))
+                        return True
+                    time.sleep(0.2)  # 队列已满（其他客户端的任务），稍后重试
+                errors[page_index + 1] = '服务已停止'
+            return False
+
+        in_flight = 0
+        for _ in range(max(self.num_workers, 1)):
+            if not submit_next_page():
+                break
+            in_flight += 1
+
+        while in_flight:
+            kind, item = events.get()
+            if kind == 'partial':
+                if image_bytes is not None:
+                    item['json_path'] = os.path.basename(item['json_path'])
+                    item['md_path'] = os.path.basename(item['md_path'])
+                on_partial(item)
+                continue
+
+            in_flight -= 1
+            page_idx = item.request['page_index'] + 1
+            if item.result.get('success'):
+                results[page_idx] = item.result['results'][0]
+            else:
+                errors[page_idx] = item.result.get('error', '识别失败')
+            if submit_next_page():
+                in_flight += 1
+
+        pages = [results[page_idx] for page_idx in sorted(results)]
+        response = {
+            'success': not errors,
+            'processing_time': time.time() - start_time,
+            'results': pages,
+            'save_path': save_path,
+            'page_count': page_count
+        }
+        if pages:
+            response.update(merge_page_results(save_path, pages))
+        if errors:
+            response['error'] = f'{len(errors)}/{page_count} 页识别失败'
+            response['failed_pages'] = {str(page_idx): error for page_idx, error in sorted(errors.items())}
+
+        print(f"✅ 文档识别完成: {name}，{len(pages)}/{page_count} 页，耗时 {response['processing_time']:.2f} 秒")
+        # 各页任务只计入页数，整个文档在这里计为一个请求
+        self.metrics.observe_document(response['processing_time'], response)
+
+        if cache_key is not None and response['success']:
+            self.result_cache.store(cache_key, response)
+        if image_bytes is not None:
+            os.remove(doc_path)
+            response = self.inline_results(response)
+        return response
+
+    def display_name(self, request: Dict[str, Any]) -> str:
+        """请求中图片的文件名（上传请求使用客户端提供的 image_name）"""
+        if request.get('image_bytes') is not None:
+            return os.path.basename(request.get('image_name') or 'upload.png')
+        return os.path.basename(request['image_path'])
+
+    def result_save_path(self, request: Dict[str, Any]) -> str:
+        """
+        请求的结果目录：output_dir/图片名
+
+        上传请求的结果不落在服务器的 output_dir 中，而是写入新建的临时目录，
+        打包进响应后由 inline_results 删除；多页文档的逐页任务使用文档的 result_dir
+        """
+        if 'result_dir' in request:
+            return request['result_dir']
+        image_name = os.path.splitext(self.display_name(request))[0]
+        if request.get('image_bytes') is not None:
+            return os.path.join(tempfile.mkdtemp(prefix='ocr_upload_'), image_name)
+        return os.path.join(request.get('output_dir', 'output'), image_name)
+
+    def inline_results(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        把上传请求的结果目录打包进响应，并删除服务器上的临时目录
+
+        响应中 files 列出每个文件的相对路径和大小，文件内容按相同顺序拼接后作为帧的 blob 附件返回；
+        results 中的 json_path/md_path 以及其他 *_path 字段改为相对路径
+        """
+        save_path = response.pop('save_path')
+        files = []
+        chunks = []
+        for root, _, names in os.walk(save_path):
+            for name in sorted(names):
+                file_path = os.path.join(root, name)
+                with open(file_path, 'rb') as f:
+                    data = f.read()
+                files.append({
+                    'path': os.path.relpath(file_path, save_path).replace(os.sep, '/'),
+                    'size': len(data)
+                })
+                chunks.append(data)
+        shutil.rmtree(os.path.dirname(save_path), ignore_errors=True)
+
+        for page in response.get('results', []):
+            page['json_path'] = os.path.relpath(page['json_path'], save_path).replace(os.sep, '/')
+            page['md_path'] = os.path.relpath(page['md_path'], save_path).replace(os.sep, '/')
+        for key, value in response.items():
+            if key.endswith('_path'):
+                response[key] = os.path.relpath(value, save_path).replace(os.sep, '/')
+        response['files'] = files
+        response['blob'] = b''.join(chunks)  # 发送时从响应中取出，作为帧的 blob
+        return response
+
+    def handle_ocr_request(self, request: Dict[str, Any], on_page=None, worker: int = 0) -> Dict[str, Any]:
+        """
+        处理OCR识别请求，响应中的 timings 为各阶段耗时（见 ocr_metrics）
+
+        参数:
+            on_page: 每保存完一页调用 on_page(partial)，partial 包含该页的文件路径、
+                     Markdown 文本和版面块，用于流式返回
+            worker: 执行任务的工作线程编号，使用该线程独占的 pipeline
+        """
+        # 整个任务使用同一个 pipeline，期间发生的热重载不会影响它
+        timings = StageTimings()
+        pipeline, generation = self.acquire_pipeline(worker)
+        try:
+            with bind_timings(pipeline, timings):
+                response = self._run_ocr(request, pipeline, timings, on_page)
+        finally:
+            self.release_pipeline(pipeline)
+        response['timings'] = timings.to_dict()
+        response['model_generation'] = generation
+        return response
+
+    def _run_ocr(self, request: Dict[str, Any], pipeline, timings: StageTimings,
+                 on_page=None) -> Dict[str, Any]:
+        """handle_ocr_request 的实际处理过程，各阶段耗时记到 timings 上"""
+        if not pipeline:
             return {
                 'success': False,
                 'error': '模型未初始化'
             }
 
         image_path = request.get('image_path')
-        output_dir = request.get('output_dir', 'output')
+        image_bytes = request.get('image_bytes')
+        page_index = request.get('page_index')  # 多页文档的逐页任务
 
-        if not image_path or not os.path.exists(image_path):
-            return {
-                'success': False,
-                'error': f'图片文件不存在: {image_path}'
-            }
+        invalid = self.validate_ocr_request(request)
+        if invalid is not None:
+            return invalid
 
+        temp_input = None
+        save_path = None
         try:
-            print(f"🔍 开始OCR识别: {os.path.basename(image_path)}")
+            page_label = f" 第 {page_index + 1} 页" if page_index is not None else ''
+            print(f"🔍 开始OCR识别: {self.display_name(request)}{page_label}")
             start_time = time.time()
 
-            # 执行OCR
-            output = self.pipeline.predict(image_path)
+            with timings.timed('decode'):
+                if page_index is not None:
+                    # 只渲染本任务负责的一页
+                    image_input = render_page(image_path, page_index)
+                elif request.get('prepared_image') is not None:
+                    # 已在预处理线程池中解码和缩放
+                    image_input = request['prepared_image']
+                elif image_bytes is not None:
+                    # 上传的图片直接在内存中解码，无法解码的格式才写入临时文件
+                    image_input = decode_image_bytes(image_bytes)
+                    if image_input is None:
+                        suffix = os.path.splitext(self.display_name(request))[1]
+                        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+                            f.write(image_bytes)
+                        temp_input = image_input = f.name
+                else:
+                    image_input = image_path
 
-            end_time = time.time()
+            # 执行OCR：优先使用逐页产出结果的 predict_iter，每页识别完立即保存
+            predict = getattr(pipeline, 'predict_iter', pipeline.predict)
+            with timings.timed('inference'):
+                output = predict(image_input)
+            output = timings.timed_iter(output, 'inference')
 
             # 保存结果
-            image_name = os.path.splitext(os.path.basename(image_path))[0]
-            save_path = os.path.join(output_dir, image_name)
+            save_path = self.result_save_path(request)
             os.makedirs(save_path, exist_ok=True)
 
             results = []
             for idx, res in enumerate(output):
+                # 每页写入独立的文件，避免多页结果互相覆盖
+                if page_index is not None:
+                    page_idx = page_index + 1
+                    stem = page_file_stem(page_idx)
+                else:
+                    page_idx = idx + 1
+                    stem = 'result' if idx == 0 else f'result_{page_idx}'
                 result_data = {
-                    'page_idx': idx + 1,
-                    'json_path': os.path.join(save_path, f'result.json'),
-                    'md_path': os.path.join(save_path, f'result.md')
+                    'page_idx': page_idx,
+                    'json_path': os.path.join(save_path, f'{stem}.json'),
+                    'md_path': os.path.join(save_path, f'{stem}.md')
                 }
-                res.save_to_json(save_path=save_path)
-                res.save_to_markdown(save_path=save_path)
+                with timings.timed('serialize'):
+                    res.save_to_json(save_path=result_data['json_path'])
+                    res.save_to_markdown(save_path=result_data['md_path'])
                 results.append(result_data)
 
+                if on_page is not None:
+                    with open(result_data['md_path'], 'r', encoding='utf-8') as f:
+                        markdown = f.read()
+                    partial = dict(result_data, elapsed=time.time() - start_time,
+                                   markdown=markdown, blocks=page_blocks(res))
+                    if image_bytes is not None:
+                        # 上传请求的服务器端路径对客户端没有意义
+                        partial['json_path'] = os.path.basename(result_data['json_path'])
+                        partial['md_path'] = os.path.basename(result_data['md_path'])
+                    on_page(partial)
+
+            end_time = time.time()
+
             print(f"✅ OCR完成，耗时: {end_time - start_time:.2f} 秒")
 
-            return {
+            response = {
                 'success': True,
                 'processing_time': end_time - start_time,
                 'results': results,
                 'save_path': save_path
             }
+            if 'preprocess' in request:
+                # 坐标对应缩放后的图片，按 scale 换算回原图
+                response['preprocess'] = request['preprocess']
+            return response
 
         except Exception as e:
             error_msg = f"OCR处理失败: {e}"
             print(f"❌ {error_msg}")
+            if image_bytes is not None and save_path is not None:
+                shutil.rmtree(os.path.dirname(save_path), ignore_errors=True)
             return {
                 'success': False,
                 'error': error_msg,
                 'details': traceback.format_exc()
             }
+        finally:
+            if temp_input is not None:
+                os.remove(temp_input)
 
     def handle_status_request(self) -> Dict[str, Any]:
         """处理状态查询请求"""
         return {
             'success': True,
             'server_running': self.running,
-            'model_loaded': self.pipeline is not None,
+            'model_loaded': bool(self.pipelines),
             'host': self.host,
-            'port': self.port
+            'port': self.port,
+            'workers': self.num_workers,
+            'active_jobs': self.active_jobs,
+            'queue_length': self.job_queue.qsize(),
+            'queue_capacity': self.job_queue.maxsize,
+            'processes': self.process_pool.status() if self.process_pool else [],
+            'result_cache': self.result_cache.stats() if self.result_cache else None,
+            'cpu': self.cpu_plan.to_dict() if self.cpu_plan else None,
+            'model_generation': self.pipeline_generation,
+            'reload': self.reload_state,
+            'metrics': self.metrics.snapshot()
         }
 
+    def metrics_text(self) -> str:
+        """Prometheus 文本格式的指标"""
+        gauges = {
+            'ocr_queue_length': self.job_queue.qsize(),
+            'ocr_queue_capacity': self.job_queue.maxsize,
+            'ocr_active_jobs': self.active_jobs,
+            'ocr_workers': self.num_workers
+        }
+        if self.result_cache is not None:
+            stats = self.result_cache.stats()
+            gauges['ocr_result_cache_entries'] = stats['entries']
+            gauges['ocr_result_cache_bytes'] = stats['size_bytes']
+        pids = [worker['pid'] for worker in self.process_pool.status()] if self.process_pool else []
+        return self.metrics.prometheus_text(gauges, pids)
+
     def handle_shutdown_request(self) -> Dict[str, Any]:
         """处理关闭服务请求"""
         print("🛑 收到关闭服务请求")
         self.running = False
+        # 唤醒阻塞在 accept() 上的主线程，由它执行 stop() 等待进行中的任务完成
+        self.close_listener()
         return {
             'success': True,
             'message': '服务正在关闭'
         }
 
-    def stop(self):
-        """停止服务器"""
+    def close_listener(self):
+        """停止接受新连接"""
+        server_socket, self.server_socket = self.server_socket, None
+        if server_socket is None:
+            return
+        try:
+            # 只 close() 不会唤醒另一个线程中阻塞的 accept()
+            server_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        server_socket.close()
+
+    def drain(self, timeout: float) -> bool:
+        """
+        等待连接线程上的请求全部写回响应、排队和进行中的推理任务全部完成，返回是否在 timeout 秒内完成
+
+        只看推理任务不够：多页文档在上一页完成、下一页入队之间没有任何任务，
+        任务完成后连接线程也还要写回响应
+        """
+        deadline = time.time() + timeout
+        while self.requests_in_flight or self.job_queue.qsize() or self.active_jobs:
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.2)
+        return True
+
+    def stop(self, drain_timeout: Optional[float] = None):
+        """
+        停止服务器
+
+        参数:
+            drain_timeout: 等待进行中任务完成的最长秒数，None 时使用 self.drain_timeout，0 表示不等待
+        """
         self.running = False
+        self.close_listener()
 
-        if self.server_socket:
-            self.server_socket.close()
+        if drain_timeout is None:
+            drain_timeout = self.drain_timeout
+        pending = self.job_queue.qsize() + self.active_jobs
+        if drain_timeout > 0 and (pending or self.requests_in_flight) and self.workers:
+            print(f"⏳ 等待 {self.requests_in_flight} 个进行中的请求、{pending} 个进行中/排队的任务完成"
+                  f"（最多 {drain_timeout:.0f} 秒）...")
+            if not self.drain(drain_timeout):
+                print("⚠ 等待超时，取消剩余任务")
+
+        # 通知工作线程退出，并取消还在排队的任务
+        self._workers_stop.set()
+        while True:
+            try:
+                job = self.job_queue.get_nowait()
+            except queue.Empty:
+                break
+            job.finish({'success': False, 'error': '服务已停止'})
+        for worker in self.workers:
+            worker.join(timeout=5)
+        self.workers = []
+
+        if self.process_pool is not None:
+            self.process_pool.close()
+            self.process_pool = None
+
+        if self.preprocessor is not None:
+            self.preprocessor.close()
 
         print("🔌 PPOCR 服务已停止")
 
         # 清理资源
-        if self.pipeline:
-            del self.pipeline
-            self.pipeline = None
+        self.pipelines = []
+        gc.collect()
 
         print("🧹 模型资源已释放")
 
 
 def main():
     """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='PaddleOCRVL 持久化服务器')
+    parser.add_argument('--host', default='localhost', help='监听地址')
+    parser.add_argument('--port', type=int, default=8888, help='监听端口')
+    parser.add_argument('--workers', type=int, default=1, help='推理工作线程数（每个线程各加载一份模型）')
+    parser.add_argument('--queue-size', type=int, default=16, help='等待队列容量，满时返回繁忙')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='推理进程数（>0 时启用多进程模式，fork 后共享权重内存）')
+    parser.add_argument('--cache-dir', default='.ocr_cache', help='OCR 结果缓存目录')
+    parser.add_argument('--cache-size-mb', type=int, default=2048, help='结果缓存容量上限 (MB)')
+    parser.add_argument('--no-cache', action='store_true', help='禁用结果缓存')
+    parser.add_argument('--max-side', type=int, default=0,
+                        help='预处理：图片最长边上限（像素），0 表示不缩放')
+    parser.add_argument('--target-dpi', type=int, default=0,
+                        help='预处理：按图片自带的 DPI 缩小到该分辨率，0 表示不使用')
+    parser.add_argument('--grayscale', action='store_true', help='预处理：几乎没有颜色的图片转为灰度')
+    parser.add_argument('--dedupe', action='store_true',
+                        help='预处理：解码后像素完全相同的图片（例如另存为其他格式或去掉了元数据）复用已有结果')
+    parser.add_argument('--preprocess-workers', type=int, default=2, help='预处理线程数')
+    parser.add_argument('--no-preprocess', action='store_true', help='禁用推理前的预处理')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='在该端口提供 Prometheus 指标 http://host:port/metrics，0 表示不启用')
+    parser.add_argument('--profile-startup', metavar='TRACE_PATH', default=None,
+                        help='输出启动各阶段耗时汇总，并把 Chrome trace 写入该文件'
+                             '（导入阶段需同时设置环境变量 OCR_PROFILE_STARTUP=1）')
+    parser.add_argument('--snapshot', nargs='?', const='.ocr_cache/model_snapshot.bin', default=None,
+                        metavar='PATH',
+                        help='使用模型权重快照加快重启（默认 .ocr_cache/model_snapshot.bin），'
+                             '首次启动后在后台生成')
+    parser.add_argument('--cpu-threads', type=int, default=0,
+                        help='每个推理工作线程/进程的计算线程数，0 表示把可用核心平均分给各工作者')
+    parser.add_argument('--cpu-pin', choices=['none', 'cores', 'numa'], default='none',
+                        help='把各推理工作者绑定到互不重叠的核心集合（cores）或 NUMA 节点（numa）')
+    parser.add_argument('--cpu-autotune', choices=['throughput', 'latency'], default=None,
+                        help='启动时用校准图片试跑多个线程数，按吞吐量（--processes 模式下同时调整进程数）或延迟选择')
+    parser.add_argument('--calibration-image', default=None,
+                        help='CPU 调优使用的校准图片，默认生成一张文字图片')
+    parser.add_argument('--mkldnn-cache-capacity', type=int, default=None,
+                        help='oneDNN 按输入形状缓存的算子数量（图片尺寸差异大时可调大）')
+    parser.add_argument('--drain-timeout', type=float, default=600,
+                        help='关闭服务（shutdown 请求 / SIGTERM）时等待进行中任务完成的最长秒数，0 表示不等待')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='使用 asyncio 前端（单事件循环处理大量空闲/状态查询连接）')
+    args = parser.parse_args()
+
     print("=" * 60)
     print("PaddleOCRVL 持久化服务器")
     print("=" * 60)
 
-    server = PPOCRServer()
+    # 只有显式开启了某项预处理时才使用预处理器，否则图片按原样交给 pipeline 读取
+    preprocessor = None
+    wants_preprocess = (args.max_side > 0 or args.target_dpi > 0 or args.grayscale
+                        or args.dedupe)
+    if wants_preprocess and not args.no_preprocess:
+        from image_preprocess import ImagePreprocessor
+        preprocessor = ImagePreprocessor(
+            max_side=args.max_side, target_dpi=args.target_dpi, grayscale=args.grayscale,
+            dedupe=args.dedupe,
+            num_workers=args.preprocess_workers
+        )
+
+    # 在加载模型之前确定线程数，避免各工作者的 OpenMP / MKL 线程超额订阅 CPU
+    cpu_plan = plan_cpu(args.processes or args.workers, args.cpu_threads, args.cpu_pin)
+    configure_process(cpu_plan)
+    print(f"⚙ CPU 分配: {cpu_plan.describe()}")
+
+    server = PPOCRServer(args.host, args.port, args.workers, args.queue_size, args.processes,
+                         cache_dir=None if args.no_cache else args.cache_dir,
+                         cache_size_mb=args.cache_size_mb, preprocessor=preprocessor,
+                         snapshot_path=args.snapshot, drain_timeout=args.drain_timeout,
+                         cpu_plan=cpu_plan, mkldnn_cache_capacity=args.mkldnn_cache_capacity)
 
     # 初始化模型
-    if not server.initialize_model():
+    if args.profile_startup:
+        profiler.start()
+    profiled = profiler.enabled
+    initialized = server.initialize_model()
+    profiler.stop()
+    if profiled:
+        print_startup_summary(args.profile_startup)
+    if not initialized:
         print("❌ 模型初始化失败，服务器退出")
         return
 
+    if args.cpu_autotune:
+        server.autotune_cpu(args.cpu_autotune, args.calibration_image,
+                            None if args.no_cache else os.path.join(args.cache_dir, 'cpu_tuning.json'))
+
+    # 多进程模式：在启动任何线程之前 fork 推理进程
+    server.start_process_pool()
+    server.refresh_snapshot(time.time() - profiler.origin_wall)
+
+    if args.metrics_port:
+        from ocr_metrics import start_metrics_http_server
+        start_metrics_http_server(args.host, args.metrics_port, server.metrics_text)
+        print(f"📈 Prometheus 指标: http://{args.host}:{args.metrics_port}/metrics")
+
     # 启动服务器
     try:
-        server.start_server()
+        if args.use_async:
+            from ocr_async_server import AsyncFrontend
+            AsyncFrontend(server).run()
+        else:
+            server.start_server()
     except KeyboardInterrupt:
         print("\n⚠ 收到中断信号")
     except Exception as e:
@@ -0,0 +1,254 @@
+"""
+多进程推理工作池
+模型在主进程加载完成后 fork 出 N 个推理进程，所有进程以写时复制方式共享同一份权重内存
+
+技术细节：
+- fork 前调用 gc.freeze()，避免子进程里的垃圾回收触碰对象头导致共享页被复制
+- 每个子进程通过 Pipe 接收请求并串行执行 handle_ocr_request，结果原样发回；
+  流式请求的每页中间结果先以 ('partial', ...) 发回，最后是 ('result', ...)
+- 分发时选择当前负载（进行中的任务数）最少的存活进程
+- 不支持 fork 的平台（Windows）退回 spawn 方式，每个进程各自加载模型，内存不共享；
+  子进程用主进程 PPOCRServer 的构造参数（server_kwargs：结果缓存、快照、mkldnn、预处理设置）创建自己的服务对象
+- reload() 逐个重新加载子进程中的模型：等该进程当前任务完成后发送 ('reload',)，
+  期间新请求分发给其余进程，始终至少有 N-1 个进程在服务；
+  重新加载后的模型是子进程私有的，不再与主进程共享权重内存
+- 指定 cpu_plan（cpu_tuning.CpuPlan）时，第 i 个子进程启动后绑定到分配给它的核心并设置线程数
+
+使用方法：
+    python ocr_server.py --processes 4
+"""
+
+import gc
+import signal
+import threading
+import traceback
+import multiprocessing
+from typing import Any, Callable, Dict, List
+
+
+def _apply_cpu_plan(cpu_plan, index):
+    if cpu_plan is not None:
+        from cpu_tuning import apply_worker
+        apply_worker(cpu_plan, index)
+
+
+def _worker_main(conn, handler, reloader=None, cpu_plan=None, index=0):
+    """子进程主循环：收到 None 或管道关闭时退出，收到 ('reload',) 时重新加载模型"""
+    # 终止信号由主进程统一处理
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _apply_cpu_plan(cpu_plan, index)
+
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        if request is None:
+            break
+        if request == ('reload',):
+            try:
+                result = reloader()
+            except Exception as e:
+                result = {'success': False, 'error': f'模型重新加载失败: {e}',
+                          'details': traceback.format_exc()}
+            conn.send(('result', result))
+            continue
+
+        def publish(partial):
+            conn.send(('partial', partial))
+
+        try:
+            result = handler(request, publish if request.get('stream') else None)
+        except Exception as e:
+            result = {
+                'success': False,
+                'error': f'OCR处理失败: {e}',
+                'details': traceback.format_exc()
+            }
+        conn.send(('result', result))
+
+
+def _spawn_worker_main(conn, server_kwargs=None, cpu_plan=None, index=0):
+    """spawn 模式的子进程入口：按主进程的构造参数创建 PPOCRServer，在子进程中独立加载模型"""
+    from ocr_server import PPOCRServer
+    from startup_profiler import profiler
+
+    # 先绑定核心再加载模型，权重内存分配在本进程使用的核心附近（NUMA）
+    _apply_cpu_plan(cpu_plan, index)
+    kwargs = dict(server_kwargs or {})
+    preprocess_options = kwargs.pop('preprocess_options', None)
+    if preprocess_options is not None:
+        from image_preprocess import ImagePreprocessor
+        kwargs['preprocessor'] = ImagePreprocessor(**preprocess_options)
+    server = PPOCRServer(cpu_plan=cpu_plan, **kwargs)
+    initialized = server.initialize_model()
+    # 启动阶段记录到此为止，恢复被包装的函数，之后的推理不再计时
+    profiler.stop()
+    if not initialized:
+        return
+    _worker_main(conn, server.handle_ocr_request, server.reload_in_place, cpu_plan, index)
+
+
+class _WorkerProcess:
+    """一个推理子进程及其管道"""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.lock = threading.Lock()  # 管道上同一时间只有一个请求
+        self.load = 0
+        self.jobs_done = 0
+        self.alive = True
+        self.reloading = False
+
+
+class ProcessWorkerPool:
+    """多进程推理工作池"""
+
+    def __init__(self, handler: Callable[[Dict[str, Any]], Dict[str, Any]], num_processes: int,
+                 reloader: Callable[[], Dict[str, Any]] = None, cpu_plan=None,
+                 server_kwargs: Dict[str, Any] = None):
+        self.handler = handler
+        self.reloader = reloader
+        self.cpu_plan = cpu_plan
+        self.server_kwargs = server_kwargs  # spawn 模式下子进程构造 PPOCRServer 的参数
+        self.num_processes = num_processes
+        self.workers: List[_WorkerProcess] = []
+        self.shared_weights = False
+        self._lock = threading.Condition()
+
+    def start(self):
+        """启动子进程；必须在模型加载完成之后、启动任何其他线程之前调用"""
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+            # 冻结现有对象，子进程的垃圾回收不再扫描（写入）它们
+            gc.freeze()
+            self.shared_weights = True
+        else:
+            context = multiprocessing.get_context('spawn')
+            print("⚠ 当前平台不支持 fork，每个推理进程将独立加载模型（内存不共享）")
+
+        for index in range(self.num_processes):
+            parent_conn, child_conn = context.Pipe()
+            if self.shared_weights:
+                process = context.Process(target=_worker_main,
+                                          args=(child_conn, self.handler, self.reloader, self.cpu_plan, index))
+            else:
+                process = context.Process(target=_spawn_worker_main,
+                                          args=(child_conn, self.server_kwargs, self.cpu_plan, index))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self.workers.append(_WorkerProcess(process, parent_conn))
+
+        if self.shared_weights:
+            gc.unfreeze()
+
+        print(f"✅ 已启动 {self.num_processes} 个推理进程"
+              f"（{'共享权重内存' if self.shared_weights else '独立加载模型'}）")
+
+    def _pick_worker(self):
+        """选择负载最小的存活进程；正在重新加载模型的进程不参与分发"""
+        with self._lock:
+            while True:
+                alive = [worker for worker in self.workers if worker.alive]
+                if not alive:
+                    return None
+                ready = [worker for worker in alive if not worker.reloading]
+                if ready:
+                    break
+                # 只有一个进程且正在重新加载时，等它完成
+                self._lock.wait()
+            worker = min(ready, key=lambda w: w.load)
+            worker.load += 1
+            return worker
+
+    def run(self, request: Dict[str, Any], on_page=None) -> Dict[str, Any]:
+        """把请求分发给负载最小的进程并等待结果；on_page 接收流式请求的每页中间结果"""
+        worker = self._pick_worker()
+        if worker is None:
+            return {'success': False, 'error': '没有可用的推理进程'}
+
+        try:
+            with worker.lock:
+                worker.conn.send(request)
+                while True:
+                    kind, payload = worker.conn.recv()
+                    if kind == 'result':
+                        result = payload
+                        break
+                    if on_page is not None:
+                        on_page(payload)
+            worker.jobs_done += 1
+            return result
+        except (EOFError, OSError) as e:
+            worker.alive = False
+            print(f"❌ 推理进程 {worker.process.pid} 已退出: {e}")
+            return {'success': False, 'error': f'推理进程异常退出: {e}'}
+        finally:
+            with self._lock:
+                worker.load -= 1
+
+    def status(self) -> List[Dict[str, Any]]:
+        """各进程的状态，用于 status 响应"""
+        with self._lock:
+            return [{
+                'pid': worker.process.pid,
+                'alive': worker.alive and worker.process.is_alive(),
+                'load': worker.load,
+                'jobs_done': worker.jobs_done,
+                'reloading': worker.reloading
+            } for worker in self.workers]
+
+    def reload(self, on_progress: Callable[[int, int], None] = None) -> Dict[str, Any]:
+        """
+        逐个重新加载各子进程中的模型（滚动重启），同一时间只有一个进程停止服务
+
+        参数:
+            on_progress: 每个进程完成后调用 on_progress(已完成数, 总数)
+
+        返回:
+            dict: success 以及失败时的 error
+        """
+        workers = [worker for worker in self.workers if worker.alive]
+        for done, worker in enumerate(workers, 1):
+            with self._lock:
+                worker.reloading = True
+            try:
+                # 拿到管道锁即表示该进程当前的任务已经完成；已经分发给它、还在排队的任务在重新加载后执行
+                with worker.lock:
+                    worker.conn.send(('reload',))
+                    kind, result = worker.conn.recv()
+            except (EOFError, OSError) as e:
+                worker.alive = False
+                result = {'success': False, 'error': f'推理进程异常退出: {e}'}
+            finally:
+                with self._lock:
+                    worker.reloading = False
+                    self._lock.notify_all()
+            if not result.get('success'):
+                return {'success': False, 'error': f"推理进程 {worker.process.pid}: {result.get('error')}"}
+            self.shared_weights = False
+            if on_progress is not None:
+                on_progress(done, len(workers))
+        return {'success': True}
+
+    def close(self, timeout=5):
+        """通知子进程退出并回收"""
+        for worker in self.workers:
+            # 正在处理任务的进程拿不到锁，稍后直接终止
+            if worker.lock.acquire(timeout=1):
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+                finally:
+                    worker.lock.release()
+        for worker in self.workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.conn.close()
+        self.workers = []
@@ -6,113 +6,311 @@
 1. 支持 framework="paddle" 参数
 2. 手动解析 safetensors 文件格式
 3. 自动转换 bfloat16 到 float32（纯 numpy 实现，无需 PyTorch）
+4. 按需加载：只解析 header，get_tensor/get_slice 时才解码对应张量或切片
+5. 进程级缓存：模型构建期间同一文件重复打开时复用已解析的 header 和已解码的数据
+   （缓存的是 numpy 数组，每次读取都返回新的 paddle tensor，调用方原地修改不会影响其他读取者）
+6. 模型快照：set_snapshot 启用后，从 model_snapshot 生成的单个 float32 快照文件读取张量
 
 技术细节：
-- 直接读取 safetensors 二进制文件
+- 使用 mmap 映射 safetensors 文件，按 header 中的 data_offsets 直接构建 numpy 视图
 - 解析 header 获取张量信息
-- 使用位运算将 bfloat16 转换为 float32
+- 使用位运算将 bfloat16 转换为 float32（bf16_converter 分块多线程实现）
 - 转换为 Paddle tensor
 """
 
+import os
 import sys
+import json
+import mmap
+import time
+import struct
+import threading
+from contextlib import contextmanager
 import numpy as np
 import paddle
 from safetensors import safe_open as original_safe_open
+from bf16_converter import bfloat16_to_float32
+from startup_profiler import profiler
+
+
+# safetensors dtype 字符串到 numpy dtype 的映射
+DTYPE_MAP = {
+    'F32': np.float32,
+    'F64': np.float64,
+    'I32': np.int32,
+    'I64': np.int64,
+    'U8': np.uint8,
+    'F16': np.float16,
+}
+
+# 进程级 checkpoint 缓存：(路径, 大小, mtime) -> _Checkpoint
+# 只在 checkpoint_cache() 上下文内启用，退出时显式清空
+_checkpoint_cache = {}
+_cache_lock = threading.Lock()
+_cache_depth = 0
+
+# 模型快照（model_snapshot.ModelSnapshot）：设置后优先从快照读取已转换为 float32 的张量
+_snapshot = None
+
+# 本进程打开过的 checkpoint（按首次打开顺序），用于生成快照
+opened_checkpoints = []
+
+
+class _Checkpoint:
+    """一个已 mmap 并解析过 header 的 safetensors 文件"""
+    
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        # 整个文件只 mmap 一次，张量数据直接从映射区域读取
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        # 读取 header 长度 (前 8 字节) 和 header JSON
+        header_size = struct.unpack_from('<Q', self.mmap, 0)[0]
+        header = json.loads(self.mmap[8:8 + header_size].decode('utf-8'))
+        
+        # 获取数据起始位置
+        self.data_start = 8 + header_size
+        
+        # 移除 __metadata__ 如果存在
+        self.tensor_info = {k: v for k, v in header.items() if k != '__metadata__'}
+        
+        # 已解码的完整张量数据（numpy 数组），仅缓存中的 checkpoint 使用
+        self.decoded = None
+    
+    def close(self):
+        """释放已解码的张量、mmap 和文件句柄"""
+        self.decoded = None
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def _cache_key(filename):
+    stat = os.stat(filename)
+    return (os.path.realpath(filename), stat.st_size, stat.st_mtime_ns)
+
+
+def set_snapshot(snapshot):
+    """启用（或传入 None 停用）模型快照"""
+    global _snapshot
+    with _cache_lock:
+        _snapshot = snapshot
+
+
+def _new_checkpoint(filename):
+    """从快照或原文件打开 checkpoint（调用方持有 _cache_lock）"""
+    path = os.path.realpath(filename)
+    if path not in opened_checkpoints:
+        opened_checkpoints.append(path)
+    if _snapshot is not None:
+        checkpoint = _snapshot.checkpoint_for(filename)
+        if checkpoint is not None:
+            return checkpoint
+    return _Checkpoint(filename)
+
+
+def _open_checkpoint(filename):
+    """打开 checkpoint；缓存启用时复用已解析的结果，返回 (checkpoint, 是否命中缓存)"""
+    with _cache_lock:
+        if _cache_depth == 0:
+            return _new_checkpoint(filename), False
+        
+        key = _cache_key(filename)
+        checkpoint = _checkpoint_cache.get(key)
+        if checkpoint is not None:
+            return checkpoint, True
+        
+        checkpoint = _new_checkpoint(filename)
+        checkpoint.decoded = {}
+        _checkpoint_cache[key] = checkpoint
+        return checkpoint, False
+
+
+def clear_checkpoint_cache():
+    """清空 checkpoint 缓存，释放缓存持有的权重副本"""
+    with _cache_lock:
+        for checkpoint in _checkpoint_cache.values():
+            checkpoint.close()
+        _checkpoint_cache.clear()
+
+
+def _reset_after_fork():
+    """
+    fork 出的子进程中重置进程级状态：fork 时其他线程可能持有 _cache_lock 或正在构建模型，
+    子进程中这些线程不存在，锁永远不会释放；缓存的 checkpoint 属于父进程的那次构建，直接丢弃
+    """
+    global _checkpoint_cache, _cache_lock, _cache_depth, _snapshot
+    _checkpoint_cache = {}
+    _cache_lock = threading.Lock()
+    _cache_depth = 0
+    _snapshot = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@contextmanager
+def checkpoint_cache():
+    """
+    在 with 块内启用进程级 checkpoint 缓存，退出时显式清空
+    
+    用法:
+        with checkpoint_cache():
+            pipeline = PaddleOCRVL()
+    """
+    global _cache_depth
+    with _cache_lock:
+        _cache_depth += 1
+    try:
+        yield
+    finally:
+        with _cache_lock:
+            _cache_depth -= 1
+            outermost = _cache_depth == 0
+        if outermost:
+            clear_checkpoint_cache()
+
+
+class TensorSlice:
+    """get_slice 返回的切片对象，接口与 safetensors 的 PySafeSlice 保持一致"""
+    
+    def __init__(self, wrapper, info):
+        self._wrapper = wrapper
+        self._info = info
+    
+    def get_shape(self):
+        return list(self._info['shape'])
+    
+    def get_dtype(self):
+        return self._info['dtype']
+    
+    def __getitem__(self, index):
+        # 只解码 index 覆盖的范围
+        return self._wrapper._materialize(self._info, index)
 
 
 class SafeOpenWrapper:
     """兼容的 safe_open 包装器，支持 paddle 框架"""
     
-    def __init__(self, filename, framework, device="cpu"):
+    def __init__(self, filename, framework, device="cpu", lazy=True):
         self.filename = filename
         self.framework = framework
         self.device = device
+        # lazy=True 时 __enter__ 只解析 header，get_tensor/get_slice 按需解码
+        self.lazy = lazy
         self.tensors = None
         self._original = None
+        self._checkpoint = None
+        self._cached = False
+        # 启动耗时分析：本次打开的阶段标记和张量解码累计耗时
+        self._profile = None
+        self._decode_time = 0.0
+        self._decoded_count = 0
     
-    def bfloat16_to_float32(self, data_bytes):
-        """手动将 bfloat16 字节数据转换为 float32 numpy 数组"""
-        # bfloat16 是 16 位，每个元素 2 字节
-        # 将字节数据转换为 uint16
-        bfloat16_data = np.frombuffer(data_bytes, dtype=np.uint16)
-        
-        # bfloat16 转 float32: 在 bfloat16 值的后面补 16 位 0
-        # bfloat16: [sign(1bit)][exp(8bit)][mantissa(7bit)]
-        # float32:  [sign(1bit)][exp(8bit)][mantissa(23bit)]
-        float32_data = np.zeros(len(bfloat16_data), dtype=np.float32)
-        # 将 bfloat16 (uint16) 左移 16 位，填充到 float32 的高 16 位
-        float32_data.view(np.uint32)[:] = bfloat16_data.astype(np.uint32) << 16
+    def _view_tensor(self, info):
+        """在 mmap 区域上直接构建张量的 numpy 视图（零拷贝）"""
+        dtype_str = info['dtype']
+        begin, end = info['data_offsets']
+        np_dtype = np.uint16 if dtype_str == 'BF16' else DTYPE_MAP.get(dtype_str, np.float32)
+        count = (end - begin) // np.dtype(np_dtype).itemsize
+        return np.frombuffer(self._checkpoint.mmap, dtype=np_dtype, count=count,
+                             offset=self._checkpoint.data_start + begin)
+    
+    def _release_pages(self, info):
+        """张量已交给 paddle 后，通知内核可以回收对应的映射页（只读文件映射，可安全丢弃）"""
+        if not hasattr(mmap, 'MADV_DONTNEED'):
+            return  # Windows 等平台不支持 madvise，由系统自行回收
+        begin, end = info['data_offsets']
+        data_start = self._checkpoint.data_start
+        start = (data_start + begin) // mmap.PAGESIZE * mmap.PAGESIZE
+        length = data_start + end - start
+        if length > 0:
+            self._checkpoint.mmap.madvise(mmap.MADV_DONTNEED, start, length)
+    
+    def _to_paddle(self, tensor_data):
+        """将 numpy 数组交给 paddle（paddle 内部只复制一次）"""
+        if self.device != "cpu" and paddle.is_compiled_with_cuda():
+            return paddle.to_tensor(tensor_data).cuda()
+        return paddle.to_tensor(tensor_data)
+    
+    def _decode(self, info, index=None):
+        """解码单个张量（或其中 index 指定的切片）为连续的 numpy 数组，bfloat16 转为 float32"""
+        # mmap 上的视图，不产生 bytes 拷贝；切片也在视图上完成，只解码需要的部分
+        tensor_data = self._view_tensor(info).reshape(info['shape'])
+        if index is not None:
+            tensor_data = tensor_data[index]
         
-        return float32_data
+        if info['dtype'] == 'BF16':
+            # 转换 bfloat16 到 float32（分块、多线程）
+            tensor_data = bfloat16_to_float32(tensor_data)
+        return np.ascontiguousarray(tensor_data)
+    
+    def _materialize(self, info, index=None):
+        """解码单个张量（或其中 index 指定的切片）为 paddle tensor"""
+        start_time = time.perf_counter()
+        tensor_data = self._decode(info, index)
+        # 转换为 paddle tensor
+        tensor = self._to_paddle(tensor_data)
+        # 及时释放对 mmap 的引用，保证 __exit__ 时可以关闭映射
+        del tensor_data
+        self._release_pages(info)
+        self._decode_time += time.perf_counter() - start_time
+        self._decoded_count += 1
+        return tensor
+    
+    def _load_tensor(self, name):
+        """
+        解码完整张量；缓存中的 checkpoint 只解码一次
+
+        缓存的是解码后的 numpy 数组，每次都返回新复制的 paddle tensor，
+        调用方的原地修改（set_state_dict 复制、dtype 转换）不会被之后的读取看到
+        """
+        info = self._checkpoint.tensor_info[name]
+        decoded = self._checkpoint.decoded
+        if decoded is None:
+            return self._materialize(info)
+        tensor_data = decoded.get(name)
+        if tensor_data is None:
+            start_time = time.perf_counter()
+            tensor_data = decoded[name] = self._decode(info)
+            self._decode_time += time.perf_counter() - start_time
+            self._decoded_count += 1
+        return self._to_paddle(tensor_data)
     
     def __enter__(self):
         # 如果是 paddle 框架，需要特殊处理
         if self.framework == "paddle":
             print(f"  [加载中] 加载模型权重: {self.filename}")
+            start_time = time.time()
+            self._profile = profiler.begin(f'safetensors {os.path.basename(self.filename)}',
+                                           'safetensors', path=str(self.filename))
+            
+            self._checkpoint, self._cached = _open_checkpoint(self.filename)
+            tensor_info = self._checkpoint.tensor_info
+            
+            tensor_count = len(tensor_info)
+            bfloat16_count = sum(1 for info in tensor_info.values() if info['dtype'] == 'BF16')
             
-            # 直接读取 safetensors 文件并手动解析
-            import struct
-            import json
+            if not self.lazy:
+                # 立即模式：一次性解码全部张量
+                self.tensors = {key: self._load_tensor(key) for key in tensor_info}
             
-            with open(self.filename, 'rb') as f:
-                # 读取 header 长度 (前 8 字节)
-                header_size = struct.unpack('<Q', f.read(8))[0]
-                
-                # 读取 header JSON
-                header_bytes = f.read(header_size)
-                header = json.loads(header_bytes.decode('utf-8'))
-                
-                # 获取数据起始位置
-                data_start = 8 + header_size
-                
-                self.tensors = {}
-                tensor_count = 0
-                bfloat16_count = 0
-                
-                # 移除 __metadata__ 如果存在
-                tensor_info = {k: v for k, v in header.items() if k != '__metadata__'}
-                
-                for key, info in tensor_info.items():
-                    dtype_str = info['dtype']
-                    shape = info['shape']
-                    data_offsets = info['data_offsets']
-                    
-                    tensor_count += 1
-                    
-                    # 读取张量数据
-                    f.seek(data_start + data_offsets[0])
-                    tensor_bytes = f.read(data_offsets[1] - data_offsets[0])
-                    
-                    # 根据 dtype 解析数据
-                    if dtype_str == 'BF16':
-                        bfloat16_count += 1
-                        # 转换 bfloat16 到 float32
-                        tensor_data = self.bfloat16_to_float32(tensor_bytes)
-                        tensor_data = tensor_data.reshape(shape)
-                    else:
-                        # 其他类型直接使用 numpy dtype
-                        dtype_map = {
-                            'F32': np.float32,
-                            'F64': np.float64,
-                            'I32': np.int32,
-                            'I64': np.int64,
-                            'U8': np.uint8,
-                            'F16': np.float16,
-                        }
-                        np_dtype = dtype_map.get(dtype_str, np.float32)
-                        tensor_data = np.frombuffer(tensor_bytes, dtype=np_dtype).reshape(shape)
-                    
-                    # 转换为 paddle tensor
-                    if self.device != "cpu" and paddle.is_compiled_with_cuda():
-                        self.tensors[key] = paddle.to_tensor(tensor_data).cuda()
-                    else:
-                        self.tensors[key] = paddle.to_tensor(tensor_data)
-                
-                if bfloat16_count > 0:
-                    print(f"  [⚠ 警告] {bfloat16_count}/{tensor_count} 个张量需要从 bfloat16 转换为 float32")
-                    print(f"  [提示] 运行 'python convert_models_once.py' 一次性转换所有模型，加快后续加载速度")
-                else:
-                    print(f"  [完成] 加载了 {tensor_count} 个张量（已优化为 float32）")
+            elapsed = time.time() - start_time
+            mode = "按需加载" if self.lazy else f"耗时 {elapsed:.2f} 秒"
+            if self._cached:
+                print(f"  [缓存命中] 复用已解析的 {tensor_count} 个张量（{mode}）")
+            elif getattr(self._checkpoint, 'from_snapshot', False):
+                print(f"  [快照] 从模型快照读取 {tensor_count} 个 float32 张量（{mode}）")
+            elif bfloat16_count > 0:
+                print(f"  [⚠ 警告] {bfloat16_count}/{tensor_count} 个张量需要从 bfloat16 转换为 float32（{mode}）")
+                print(f"  [提示] 运行 'python convert_models_once.py' 一次性转换所有模型，加快后续加载速度")
+            else:
+                verb = "解析" if self.lazy else "加载"
+                print(f"  [完成] {verb}了 {tensor_count} 个张量（已优化为 float32，{mode}）")
             
             return self
         else:
@@ -122,28 +320,39 @@ class SafeOpenWrapper:
     
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.framework == "paddle":
+            profiler.end(self._profile, cached=self._cached,
+                         snapshot=getattr(self._checkpoint, 'from_snapshot', False),
+                         decoded_tensors=self._decoded_count,
+                         decode_seconds=round(self._decode_time, 3))
+            self._profile = None
             self.tensors = None
+            # 缓存中的 checkpoint 由缓存负责关闭
+            if self._checkpoint is not None and self._checkpoint.decoded is None:
+                self._checkpoint.close()
+            self._checkpoint = None
             return False
         else:
             return self._original.__exit__(exc_type, exc_val, exc_tb)
     
     def keys(self):
         if self.framework == "paddle":
-            return self.tensors.keys()
+            # 键直接来自 header，无需解码任何张量
+            return self._checkpoint.tensor_info.keys()
         else:
             return self._original.keys()
     
     def get_tensor(self, name):
         if self.framework == "paddle":
-            return self.tensors[name]
+            if self.tensors is not None:
+                return self.tensors[name]
+            return self._load_tensor(name)
         else:
             return self._original.get_tensor(name)
     
     def get_slice(self, name):
-        """获取张量切片（返回整个张量的视图）"""
+        """获取张量切片对象，索引时只解码请求的范围"""
         if self.framework == "paddle":
-            # 返回整个张量（模拟切片功能）
-            return self.tensors[name]
+            return TensorSlice(self, self._checkpoint.tensor_info[name])
         else:
             return self._original.get_slice(name)
     
@@ -0,0 +1,231 @@
+"""
+服务启动耗时分析
+记录启动过程中每个阶段的耗时和常驻内存变化，输出 Chrome trace 文件
+（chrome://tracing 或 https://ui.perfetto.dev 打开，火焰图形式展示嵌套阶段）
+
+记录的阶段：
+- 导入：paddle、setup_safetensors（含 safetensors）、safetensors 补丁、paddleocr
+- PaddleOCRVL() 构建，其中包括：
+  - 每个子模型的创建（PP-DocLayoutV2、PaddleOCR-VL-0.9B）
+  - VLM 配置文件加载
+  - 每次 safetensors 文件打开（从打开到关闭，包含张量解码和 bfloat16 转换）
+  - 权重赋值（set_state_dict）
+
+技术细节：
+- 默认关闭：未开启时每个阶段只多一次属性判断，不读取 /proc，也不包装 PaddleX 的函数
+- --profile-startup 在解析参数后调用 start()，记录模型构建及之后的阶段；导入阶段发生在解析参数之前，
+  需要设置环境变量 OCR_PROFILE_STARTUP=1 才会记录
+- 模型初始化完成后调用 stop() 停止记录并恢复被包装的函数，之后的请求不受影响
+- PaddleX 内部函数按名称查找后包装，不同版本找不到的函数直接跳过，
+  trace 的 metadata 中列出实际生效的挂钩
+- 使用 OCR_PROFILE_STARTUP=1 python ocr_server.py --profile-startup startup_trace.json
+  输出包含导入阶段的 trace 文件和阶段汇总
+"""
+
+import os
+import json
+import time
+import functools
+import importlib
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from ocr_metrics import process_rss
+
+
+# 设置为 1 时从导入 startup_profiler 开始记录（包括解析命令行参数之前的导入阶段）
+PROFILE_ENV = 'OCR_PROFILE_STARTUP'
+
+# PaddleX 内部需要计时的函数：(模块, 类.函数 或 函数, 阶段名)
+# 阶段名中的 {model_name} 由调用参数中的模型配置填充
+PADDLEX_HOOKS = [
+    ('paddlex.inference.pipelines.base', 'BasePipeline.create_model', '创建模型 {model_name}'),
+    ('paddlex.inference.models', 'create_predictor', 'create_predictor {model_name}'),
+    ('paddlex.inference.models.common.vlm.transformers.configuration_utils',
+     'PretrainedConfig.from_pretrained', 'VLM 配置加载'),
+    ('paddlex.inference.models.common.vlm.transformers.model_utils',
+     'PretrainedModel.from_pretrained', 'VLM from_pretrained'),
+    ('paddlex.inference.models.common.vlm.transformers.model_utils',
+     '_load_state_dict_into_model', '权重赋值'),
+    ('paddle.nn', 'Layer.set_state_dict', 'set_state_dict {class_name}'),
+]
+
+
+def _phase_name(template: str, args, kwargs) -> str:
+    """用调用参数填充阶段名中的占位符"""
+    if '{' not in template:
+        return template
+    model_name = kwargs.get('model_name')
+    config = kwargs.get('config')
+    for arg in args:
+        if isinstance(arg, dict) and config is None:
+            config = arg
+        elif isinstance(arg, str) and model_name is None:
+            model_name = arg
+    if model_name is None and isinstance(config, dict):
+        model_name = config.get('model_name')
+    class_name = type(args[0]).__name__ if args else ''
+    return template.format(model_name=model_name or '?', class_name=class_name)
+
+
+class StartupProfiler:
+    """启动阶段计时器（线程安全）"""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.events = []
+        self.origin = time.perf_counter()
+        self.origin_wall = time.time()
+        self.hooks = []  # 已安装的挂钩 (所属对象, 属性名, 原始值)
+        self.hook_names = []
+        self._lock = threading.Lock()
+        self._stack = threading.local()
+
+    def _now_us(self) -> float:
+        return (time.perf_counter() - self.origin) * 1e6
+
+    def begin(self, name: str, category: str = 'startup', **args):
+        """开始一个阶段，返回交给 end() 的标记；停止记录后返回 None"""
+        if not self.enabled:
+            return None
+        stack = getattr(self._stack, 'names', None)
+        if stack is None:
+            stack = self._stack.names = []
+        stack.append(name)
+        return name, category, len(stack) - 1, args, process_rss(), self._now_us()
+
+    def end(self, token, **extra):
+        """结束 begin() 开始的阶段，extra 补充到事件参数中"""
+        if token is None:
+            return
+        end = self._now_us()
+        rss_after = process_rss()
+        name, category, depth, args, rss_before, start = token
+        self._stack.names.pop()
+        args.update(extra)
+        if rss_before is not None and rss_after is not None:
+            args['rss_mb'] = round(rss_after / 1048576, 1)
+            args['rss_delta_mb'] = round((rss_after - rss_before) / 1048576, 1)
+        with self._lock:
+            self.events.append({
+                'name': name, 'cat': category, 'start': start, 'dur': end - start,
+                'tid': threading.get_ident(), 'depth': depth, 'args': args
+            })
+
+    @contextmanager
+    def phase(self, name: str, category: str = 'startup', **args):
+        """记录 with 块的耗时和 RSS 变化；停止记录后为空操作"""
+        token = self.begin(name, category, **args)
+        try:
+            yield
+        finally:
+            self.end(token)
+
+    def wrap(self, owner, attribute: str, template: str, category: str = 'paddlex') -> bool:
+        """把 owner.attribute 包装为带计时的版本，返回是否成功"""
+        raw = owner.__dict__.get(attribute) if isinstance(owner, type) else getattr(owner, attribute, None)
+        if raw is None:
+            return False
+        wrapper_type = type(raw) if isinstance(raw, (classmethod, staticmethod)) else None
+        func = raw.__func__ if wrapper_type else raw
+        if not callable(func):
+            return False
+
+        profiler = self
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            with profiler.phase(_phase_name(template, args, kwargs), category):
+                return func(*args, **kwargs)
+
+        setattr(owner, attribute, wrapper_type(timed) if wrapper_type else timed)
+        self.hooks.append((owner, attribute, raw))
+        self.hook_names.append(f'{getattr(owner, "__name__", owner)}.{attribute}')
+        return True
+
+    def install_paddlex_hooks(self) -> List[str]:
+        """包装 PADDLEX_HOOKS 中能找到的函数，返回生效的挂钩"""
+        installed = []
+        for module_name, path, template in PADDLEX_HOOKS:
+            try:
+                owner = importlib.import_module(module_name)
+            except Exception:
+                continue
+            *owners, attribute = path.split('.')
+            for owner_name in owners:
+                owner = getattr(owner, owner_name, None)
+            if owner is not None and self.wrap(owner, attribute, template):
+                installed.append(f'{module_name}.{path}')
+        return installed
+
+    def start(self):
+        """开始记录（之前的阶段不会补记）"""
+        self.enabled = True
+
+    def stop(self):
+        """停止记录并恢复被包装的函数"""
+        self.enabled = False
+        hooks, self.hooks = self.hooks, []
+        for owner, attribute, raw in reversed(hooks):
+            setattr(owner, attribute, raw)
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """Chrome trace 格式（Trace Event Format）：阶段为 X 事件，RSS 为计数器事件"""
+        pid = os.getpid()
+        trace_events = [{'name': 'process_name', 'ph': 'M', 'pid': pid,
+                         'args': {'name': 'ocr_server 启动'}}]
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event['start'])
+        for event in events:
+            trace_events.append({
+                'name': event['name'], 'cat': event['cat'], 'ph': 'X', 'pid': pid, 'tid': event['tid'],
+                'ts': round(event['start'], 1), 'dur': round(event['dur'], 1), 'args': event['args']
+            })
+            if 'rss_mb' in event['args']:
+                trace_events.append({
+                    'name': 'RSS (MB)', 'ph': 'C', 'pid': pid, 'ts': round(event['start'] + event['dur'], 1),
+                    'args': {'rss': event['args']['rss_mb']}
+                })
+        return {
+            'traceEvents': trace_events,
+            'displayTimeUnit': 'ms',
+            'metadata': {
+                'started_at': self.origin_wall,
+                'hooks': list(self.hook_names)
+            }
+        }
+
+    def write_chrome_trace(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f, ensure_ascii=False)
+
+    def summary(self, min_duration: float = 0.05) -> List[str]:
+        """按时间顺序缩进显示的阶段汇总（只列出耗时不少于 min_duration 秒的阶段）"""
+        with self._lock:
+            events = sorted(self.events, key=lambda event: (event['start'], event['depth']))
+        lines = []
+        for event in events:
+            seconds = event['dur'] / 1e6
+            if seconds < min_duration:
+                continue
+            rss = event['args'].get('rss_delta_mb')
+            rss_text = f"  RSS {rss:+.0f} MB" if rss is not None else ''
+            lines.append(f"{'  ' * event['depth']}{event['name']}: {seconds:.2f} 秒{rss_text}")
+        return lines
+
+
+# 进程级实例：设置了 OCR_PROFILE_STARTUP 时 ocr_server 导入时即开始记录，否则由 --profile-startup 开启
+profiler = StartupProfiler(os.environ.get(PROFILE_ENV, '') not in ('', '0'))
+
+
+def print_startup_summary(trace_path: Optional[str] = None):
+    """打印阶段汇总，指定路径时同时写出 Chrome trace"""
+    print("⏱ 启动阶段耗时:")
+    for line in profiler.summary():
+        print(f"   {line}")
+    if trace_path:
+        profiler.write_chrome_trace(trace_path)
+        print(f"📝 启动 trace 已保存: {trace_path}（chrome://tracing 或 ui.perfetto.dev 打开）")
@@ -0,0 +1,208 @@
+"""
+ocr_protocol 分帧协议的单元测试
+
+运行方法：
+    python -m pytest test_ocr_protocol.py
+    python -m unittest test_ocr_protocol
+"""
+
+import json
+import random
+import socket
+import asyncio
+import unittest
+import threading
+
+import ocr_protocol
+from ocr_protocol import (
+    HEADER, MAGIC, PROTOCOL_VERSION, CODEC_JSON, CODEC_MSGPACK,
+    FRAME_REQUEST, FRAME_RESPONSE, FRAME_ERROR, FRAME_PARTIAL,
+    MAX_PAYLOAD_SIZE, MAX_BLOB_SIZE, ProtocolError,
+    pack_frame, unpack_header, decode_payload, send_message, recv_message, read_message_async
+)
+
+
+FRAME_TYPES = (FRAME_REQUEST, FRAME_RESPONSE, FRAME_ERROR, FRAME_PARTIAL)
+CODECS = (CODEC_JSON, CODEC_MSGPACK) if ocr_protocol.msgpack is not None else (CODEC_JSON,)
+
+MESSAGE = {'type': 'ocr', 'image_path': 'C:/图片/发票.png', 'request_id': 7, 'stream': True,
+           'pages': [1, 2, 3], 'options': {'dpi': 200}}
+
+
+def raw_frame(payload, frame_type=FRAME_REQUEST, codec=CODEC_JSON, blob=b'',
+              magic=MAGIC, version=PROTOCOL_VERSION):
+    """绕过 pack_frame 的检查直接拼出一帧"""
+    return HEADER.pack(magic, version, frame_type, codec, len(payload), len(blob)) + payload + blob
+
+
+def read_async(data):
+    """把 data 喂给 StreamReader 后用 read_message_async 读取一帧"""
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await read_message_async(reader)
+    return asyncio.run(main())
+
+
+class RoundTripTest(unittest.TestCase):
+    """每种编码与帧类型的编解码往返"""
+
+    def test_pack_unpack(self):
+        for codec in CODECS:
+            for frame_type in FRAME_TYPES:
+                for blob in (b'', b'\x00\xff' * 1000):
+                    with self.subTest(codec=codec, frame_type=frame_type, blob=len(blob)):
+                        data = pack_frame(MESSAGE, frame_type, blob, codec)
+                        got_type, got_codec, payload_len, blob_len = unpack_header(data[:HEADER.size])
+                        self.assertEqual((got_type, got_codec, blob_len), (frame_type, codec, len(blob)))
+                        payload = data[HEADER.size:HEADER.size + payload_len]
+                        self.assertEqual(decode_payload(payload, codec), MESSAGE)
+                        self.assertEqual(data[HEADER.size + payload_len:], blob)
+
+    def test_socketpair(self):
+        left, right = socket.socketpair()
+        with left, right:
+            for codec in CODECS:
+                for frame_type in FRAME_TYPES:
+                    with self.subTest(codec=codec, frame_type=frame_type):
+                        send_message(left, MESSAGE, frame_type, blob=b'img', codec=codec)
+                        frame = recv_message(right)
+                        self.assertEqual(frame, (frame_type, MESSAGE, b'img', codec))
+            left.close()
+            self.assertIsNone(recv_message(right))
+
+    def test_async(self):
+        for codec in CODECS:
+            for frame_type in FRAME_TYPES:
+                with self.subTest(codec=codec, frame_type=frame_type):
+                    frame = read_async(pack_frame(MESSAGE, frame_type, b'img', codec))
+                    self.assertEqual(frame, (frame_type, MESSAGE, b'img', codec))
+        self.assertIsNone(read_async(b''))
+
+    def test_large_frame(self):
+        blob = bytes(range(256)) * 20000
+        left, right = socket.socketpair()
+        with left, right:
+            # 发送方在另一端读取之前就会被写缓冲区阻塞，必须并发读取
+            result = []
+            thread = threading.Thread(target=lambda: result.append(recv_message(right)))
+            thread.start()
+            send_message(left, MESSAGE, blob=blob)
+            thread.join(10)
+            self.assertEqual(result[0].blob, blob)
+
+
+class MalformedFrameTest(unittest.TestCase):
+    """损坏、截断或超限的帧"""
+
+    def test_bad_magic(self):
+        data = raw_frame(b'{}', magic=b'XX')
+        with self.assertRaises(ProtocolError):
+            unpack_header(data[:HEADER.size])
+        with self.assertRaises(ProtocolError):
+            read_async(data)
+
+    def test_bad_version(self):
+        data = raw_frame(b'{}', version=PROTOCOL_VERSION + 1)
+        with self.assertRaises(ProtocolError):
+            unpack_header(data[:HEADER.size])
+        with self.assertRaises(ProtocolError):
+            read_async(data)
+
+    def test_oversized_header(self):
+        for payload_len, blob_len in ((MAX_PAYLOAD_SIZE + 1, 0), (0, MAX_BLOB_SIZE + 1)):
+            with self.subTest(payload_len=payload_len, blob_len=blob_len):
+                header = HEADER.pack(MAGIC, PROTOCOL_VERSION, FRAME_REQUEST, CODEC_JSON, payload_len, blob_len)
+                with self.assertRaises(ProtocolError):
+                    unpack_header(header)
+                with self.assertRaises(ProtocolError):
+                    read_async(header)
+
+    def test_oversized_pack(self):
+        with self.assertRaises(ProtocolError):
+            pack_frame({}, blob=_Sized(MAX_BLOB_SIZE + 1))
+
+    def test_truncated(self):
+        data = pack_frame(MESSAGE, FRAME_REQUEST, b'blob')
+        # 帧头内截断、payload 内截断、blob 内截断
+        for cut in (3, HEADER.size + 5, len(data) - 1):
+            with self.subTest(cut=cut):
+                left, right = socket.socketpair()
+                with left, right:
+                    left.sendall(data[:cut])
+                    left.close()
+                    with self.assertRaises(ProtocolError):
+                        recv_message(right)
+                with self.assertRaises(ProtocolError):
+                    read_async(data[:cut])
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ProtocolError):
+            read_async(raw_frame(b'{}', codec=9))
+
+    def test_non_dict_payload(self):
+        # 格式正确但不是字典的 payload 抛出 ValueError，整帧已读取，后续帧仍可解析
+        for payload in ([1, 2], 'text', 3, None):
+            with self.subTest(payload=payload):
+                data = raw_frame(json.dumps(payload).encode())
+                left, right = socket.socketpair()
+                with left, right:
+                    left.sendall(data + pack_frame(MESSAGE, FRAME_REQUEST))
+                    with self.assertRaises(ValueError):
+                        recv_message(right)
+                    self.assertEqual(recv_message(right).message, MESSAGE)
+
+    def test_non_dict_payload_async(self):
+        async def main():
+            reader = asyncio.StreamReader()
+            reader.feed_data(raw_frame(b'[1, 2]') + pack_frame(MESSAGE, FRAME_REQUEST))
+            reader.feed_eof()
+            with self.assertRaises(ValueError):
+                await read_message_async(reader)
+            return await read_message_async(reader)
+        self.assertEqual(asyncio.run(main()).message, MESSAGE)
+
+    def test_invalid_json(self):
+        left, right = socket.socketpair()
+        with left, right:
+            left.sendall(raw_frame(b'{not json') + raw_frame(b'\xff\xfe') + pack_frame(MESSAGE))
+            for _ in range(2):
+                with self.assertRaises(ValueError):
+                    recv_message(right)
+            self.assertEqual(recv_message(right).message, MESSAGE)
+
+    def test_random_bytes(self):
+        # 随机字节流只能以 ProtocolError 或 ValueError 结束，不能挂起或抛出其他异常
+        rng = random.Random(0)
+        for _ in range(200):
+            data = bytes(rng.getrandbits(8) for _ in range(rng.randint(1, 64)))
+            if rng.random() < 0.5:
+                # 带上合法的帧头前缀，让随机数据进入更深的解析路径
+                data = MAGIC + bytes([PROTOCOL_VERSION]) + data
+            left, right = socket.socketpair()
+            with left, right:
+                right.settimeout(5)
+                left.sendall(data)
+                left.close()
+                try:
+                    while recv_message(right) is not None:
+                        pass
+                except (ProtocolError, ValueError):
+                    pass
+
+
+class _Sized(bytes):
+    """声明长度很大但不实际分配内存的 blob"""
+
+    def __new__(cls, size):
+        obj = super().__new__(cls)
+        obj.size = size
+        return obj
+
+    def __len__(self):
+        return self.size
+
+
+if __name__ == '__main__':
+    unittest.main()